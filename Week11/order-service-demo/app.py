@@ -3,22 +3,214 @@ Order Service API
 Demo implementation với REST CRUD, Query endpoint và Webhook notifications
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+import math
+import os
 import uuid
+import json
+import base64
 import hmac
 import hashlib
 import requests
-import threading
-from functools import wraps
+import time
+import heapq
+from operator import itemgetter
+from functools import wraps, lru_cache
+from contextlib import contextmanager
+from order_archive import ARCHIVABLE_STATUSES, OrderArchive
+from order_record import ORDER_FIELDS
+from order_store import OrderStore, PreconditionFailed
+from order_stats import merge_groups, merge_stats
+from order_events import EventFeed
+from search_cache import SearchCache
+from text_index import query_terms
+from sqlite_store import SqliteStorage, SqliteOrderStore, SqliteWebhookRegistry, SqliteEventFeed
+from webhook_dispatcher import WebhookDispatcher
+from webhook_outbox import WebhookOutbox
+from webhook_registry import WebhookRegistry
+from webhook_client import WebhookClient
+from webhook_guard import DeliveryGuard
+from write_ahead_log import WriteAheadLog, WriteAheadLogError
 
 app = Flask(__name__)
 CORS(app)
 
-# ============= In-memory Data Store =============
-orders_db = {}
-webhooks_db = {}
+# ============= Order Config =============
+# Số orders tối đa trong một request POST /orders:batch
+ORDER_BATCH_MAX_SIZE = int(os.getenv('ORDER_BATCH_MAX_SIZE', '1000'))
+# Số orders tối đa một request POST /orders:transition được chuyển trạng thái
+ORDER_TRANSITION_MAX_SIZE = int(os.getenv('ORDER_TRANSITION_MAX_SIZE', '10000'))
+
+# Số shards (mỗi shard một lock ghi) của orders_db
+ORDER_STORE_SHARDS = int(os.getenv('ORDER_STORE_SHARDS', '16'))
+
+VALID_STATUSES = ['pending', 'confirmed', 'processing', 'shipped', 'delivered', 'cancelled']
+
+# ============= Data Store =============
+# Storage backend của orders / webhooks: 'memory' (mặc định) hoặc 'sqlite'
+# (SQLite WAL mode, dùng chung giữa nhiều gunicorn worker processes)
+STORE_BACKEND = os.getenv('STORE_BACKEND', 'memory')
+STORE_SQLITE_PATH = os.getenv('STORE_SQLITE_PATH', 'orders.db')
+# Số events gần nhất được giữ để client SSE resume theo Last-Event-ID
+ORDER_EVENTS_RETENTION = int(os.getenv('ORDER_EVENTS_RETENTION', '10000'))
+# Số kết quả /orders/search được cache (0 = tắt); chỉ backend memory, vì writes của
+# các processes khác vào SQLite không làm cache của process này bị invalidate
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '256'))
+
+search_cache = None
+sqlite_storage = None
+if STORE_BACKEND == 'sqlite':
+    sqlite_storage = SqliteStorage(STORE_SQLITE_PATH)
+    orders_db = SqliteOrderStore(sqlite_storage)
+    webhooks_db = SqliteWebhookRegistry(sqlite_storage)
+    order_events = SqliteEventFeed(sqlite_storage, capacity=ORDER_EVENTS_RETENTION)
+elif STORE_BACKEND == 'memory':
+    search_cache = SearchCache(SEARCH_CACHE_SIZE) if SEARCH_CACHE_SIZE > 0 else None
+    orders_db = OrderStore(shards=ORDER_STORE_SHARDS, search_cache=search_cache)
+    webhooks_db = WebhookRegistry()
+    order_events = EventFeed(capacity=ORDER_EVENTS_RETENTION)
+else:
+    raise ValueError(f"Unknown STORE_BACKEND: {STORE_BACKEND}")
+
+# ============= Webhook Delivery Config =============
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+WEBHOOK_CONNECT_TIMEOUT = float(os.getenv('WEBHOOK_CONNECT_TIMEOUT', '3'))
+WEBHOOK_TIMEOUT = float(os.getenv('WEBHOOK_TIMEOUT', '10'))
+WEBHOOK_POOL_HOSTS = int(os.getenv('WEBHOOK_POOL_HOSTS', '100'))
+WEBHOOK_POOL_SIZE = int(os.getenv('WEBHOOK_POOL_SIZE', str(WEBHOOK_WORKERS)))
+WEBHOOK_OUTBOX_PATH = os.getenv('WEBHOOK_OUTBOX_PATH', 'webhook_outbox.db')
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '8'))
+WEBHOOK_RETRY_BASE_SECONDS = float(os.getenv('WEBHOOK_RETRY_BASE_SECONDS', '2'))
+WEBHOOK_RETRY_MAX_SECONDS = float(os.getenv('WEBHOOK_RETRY_MAX_SECONDS', '600'))
+WEBHOOK_BREAKER_THRESHOLD = int(os.getenv('WEBHOOK_BREAKER_THRESHOLD', '5'))
+WEBHOOK_BREAKER_COOLDOWN_SECONDS = float(os.getenv('WEBHOOK_BREAKER_COOLDOWN_SECONDS', '30'))
+
+# ============= Persistence Config =============
+# Thư mục chứa write-ahead log + snapshots của backend memory ('' để tắt)
+WAL_DIR = os.getenv('WAL_DIR', 'data')
+WAL_FSYNC = os.getenv('WAL_FSYNC', 'true').lower() == 'true'
+# Chụp snapshot (và bỏ các log segments cũ) sau mỗi chừng này records
+WAL_SNAPSHOT_EVERY = int(os.getenv('WAL_SNAPSHOT_EVERY', '100000'))
+# Số orders được gom lại cho mỗi lần add_many khi recover từ snapshot + WAL
+WAL_RECOVERY_BATCH = int(os.getenv('WAL_RECOVERY_BATCH', '20000'))
+
+# ============= Archive Config =============
+# Thư mục chứa segments của orders đã archive ('' để tắt); chỉ backend memory
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', '')
+# Orders delivered / cancelled không thay đổi trong chừng này ngày được chuyển sang archive
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', '90'))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv('ARCHIVE_INTERVAL_SECONDS', '3600'))
+# Số orders tối đa mỗi lượt archive (writes vào các orders này bị chặn trong lúc ghi segment)
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '10000'))
+# Số blocks (128 orders mỗi block) đã giải nén được giữ trong bộ nhớ cho get / search
+ARCHIVE_CACHE_BLOCKS = int(os.getenv('ARCHIVE_CACHE_BLOCKS', '256'))
+# Segments nhỏ hơn chừng này orders của cùng tháng được gộp lại sau mỗi lượt archive
+ARCHIVE_SEGMENT_MAX_ORDERS = int(os.getenv('ARCHIVE_SEGMENT_MAX_ORDERS', '100000'))
+
+# ============= Write-Ahead Log =============
+
+@contextmanager
+def frozen_stores():
+    """Chặn mọi writes vào orders_db và webhooks_db"""
+    with orders_db.locked(), webhooks_db.locked():
+        yield
+
+def collect_snapshot():
+    return {'order': orders_db.snapshot(), 'webhook': webhooks_db.snapshot()}
+
+# Orders đã đọc từ snapshot / WAL nhưng chưa được thêm vào orders_db (id -> version mới nhất)
+recovered_orders = {}
+
+def flush_recovered_orders():
+    """Thêm các orders đang gom vào orders_db qua add_many: mỗi index được cập nhật một lần cho cả lô"""
+    if recovered_orders:
+        orders_db.add_many(list(recovered_orders.values()))
+        recovered_orders.clear()
+
+def recover_order(order):
+    # Put thay thế toàn bộ order nên chỉ cần giữ version cuối cùng của mỗi id
+    recovered_orders[order['id']] = order
+    if len(recovered_orders) >= WAL_RECOVERY_BATCH:
+        flush_recovered_orders()
+
+def load_snapshot_entity(kind, data):
+    if kind == 'order':
+        recover_order(data)
+    else:
+        webhooks_db.add(data)
+
+def replay_wal_record(op, data):
+    if op == 'order.put':
+        recover_order(data)
+    elif op == 'order.put_many':
+        for order in data:
+            recover_order(order)
+    elif op == 'order.delete':
+        # Bỏ version đang gom (nếu có) và version đã nằm trong orders_db (nếu có)
+        recovered_orders.pop(data['id'], None)
+        if data['id'] in orders_db:
+            orders_db.delete(data['id'])
+    elif op == 'webhook.put':
+        webhooks_db.add(data)
+    elif data['id'] in webhooks_db:
+        webhooks_db.delete(data['id'])
+
+# Backend sqlite đã durable nên không cần WAL
+wal = (WriteAheadLog(WAL_DIR, fsync=WAL_FSYNC, snapshot_every=WAL_SNAPSHOT_EVERY)
+       if WAL_DIR and STORE_BACKEND == 'memory' else None)
+if wal is not None:
+    wal.recover(load_snapshot_entity, replay_wal_record)
+    flush_recovered_orders()
+    orders_db.attach_journal(wal)
+    webhooks_db.attach_journal(wal)
+    wal.start_snapshots(frozen_stores, collect_snapshot)
+
+# ============= Order Archive =============
+
+def archive_closed_orders():
+    """
+    Chuyển orders delivered / cancelled không thay đổi trong ARCHIVE_AFTER_DAYS ngày sang archive:
+    segment được ghi xong (durable) rồi orders mới bị xóa khỏi orders_db. Trả về số orders đã archive
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+    
+    def archivable(order):
+        # Kiểm tra lại khi đang giữ lock: order có thể vừa được update
+        return order['status'] in ARCHIVABLE_STATUSES and order['updatedAt'] < cutoff
+    
+    orders = [order for status in ARCHIVABLE_STATUSES
+              for order in orders_db.search({'status': status}) if order['updatedAt'] < cutoff]
+    # Theo createdAt để mỗi lượt ghi vào ít partitions (tháng) nhất
+    order_ids = [order['id'] for order in sorted(orders, key=itemgetter('createdAt', 'id'))]
+    archived = 0
+    for start in range(0, len(order_ids), ARCHIVE_BATCH_SIZE):
+        batch = order_ids[start:start + ARCHIVE_BATCH_SIZE]
+        archived += len(orders_db.delete_many(batch, archivable, order_archive.write))
+    # Mỗi lượt thêm segments mới cho từng tháng: gộp lại để search không phải mở ngày càng nhiều segments
+    order_archive.compact()
+    return archived
+
+def drop_archived_orders():
+    """
+    Xóa khỏi orders_db các orders đã có trong archive: crash sau khi segment đã durable nhưng
+    trước khi việc xóa vào WAL để lại order ở cả hai nơi. Sau bước này search không cần loại
+    trùng giữa orders_db và archive
+    """
+    order_ids = [order['id'] for status in ARCHIVABLE_STATUSES
+                 for order in orders_db.search({'status': status}) if order_archive.contains(order)]
+    if order_ids:
+        orders_db.delete_many(order_ids)
+
+# Backend sqlite đã giữ dữ liệu trên đĩa nên không cần archive
+order_archive = (OrderArchive(ARCHIVE_DIR, cache_blocks=ARCHIVE_CACHE_BLOCKS,
+                              segment_max_orders=ARCHIVE_SEGMENT_MAX_ORDERS, fsync=WAL_FSYNC)
+                 if ARCHIVE_DIR and STORE_BACKEND == 'memory' else None)
+if order_archive is not None:
+    drop_archived_orders()
+    order_archive.start_job(archive_closed_orders, ARCHIVE_INTERVAL_SECONDS)
 
 # ============= Helper Functions =============
 
@@ -34,61 +226,235 @@ def calculate_total(items):
     """Tính tổng tiền đơn hàng"""
     return sum(item['quantity'] * item['unitPrice'] for item in items)
 
+def build_order(data, now, status='pending'):
+    """Tạo order mới từ request data đã validate"""
+    return {
+        'id': generate_id('ord'),
+        'customerId': data['customerId'],
+        'items': data['items'],
+        'totalAmount': calculate_total(data['items']),
+        'status': status,
+        'shippingAddress': data.get('shippingAddress'),
+        'notes': data.get('notes'),
+        'createdAt': now,
+        'updatedAt': now,
+        'version': 1
+    }
+
+def with_order_validators(response, order):
+    """Gắn ETag (version của order) và Last-Modified (updatedAt) vào response"""
+    response.set_etag(str(order.get('version', 1)))
+    response.last_modified = datetime.fromisoformat(order['updatedAt'])
+    return response
+
+def is_not_modified(order):
+    """If-None-Match (ưu tiên) hoặc If-Modified-Since khớp với version hiện tại của order"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(str(order.get('version', 1)))
+    if request.if_modified_since is not None:
+        last_modified = datetime.fromisoformat(order['updatedAt']).replace(microsecond=0)
+        return last_modified <= request.if_modified_since
+    return False
+
+def if_match_precondition():
+    """Precondition cho orders_db.update từ header If-Match (None nếu không có header)"""
+    if_match = request.if_match
+    if not if_match:
+        return None
+    return lambda current: if_match.contains(str(current.get('version', 1)))
+
+def precondition_failed_response():
+    return error_response('PRECONDITION_FAILED', 'Order has been modified', [
+        {'field': 'If-Match', 'message': 'ETag does not match the current order version'}
+    ], 412)
+
 def generate_webhook_secret():
     """Generate webhook secret"""
     return f"whsec_{uuid.uuid4().hex}"
 
-def create_webhook_signature(payload, secret):
-    """Tạo HMAC signature cho webhook payload"""
-    message = str(payload).encode()
-    signature = hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
-    return f"sha256={signature}"
+def serialize_webhook_payload(payload):
+    """Serialize payload một lần thành canonical JSON bytes (sorted keys, không khoảng trắng)"""
+    return json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+@lru_cache(maxsize=1024)
+def _webhook_hmac(secret):
+    """HMAC đã được khởi tạo key cho mỗi secret, dùng lại bằng copy()"""
+    return hmac.new(secret.encode(), digestmod=hashlib.sha256)
+
+def create_webhook_signature(body, secret):
+    """Tạo HMAC signature trên đúng các bytes được gửi đi"""
+    mac = _webhook_hmac(secret).copy()
+    mac.update(body)
+    return f"sha256={mac.hexdigest()}"
+
+def build_webhook_request(delivery):
+    """
+    Tạo (body, headers) cho delivery; batch được gửi dưới dạng một JSON array đã ký.
+    None nếu webhook đã bị xóa: delivery không được gửi (kể cả không ký) tới URL cũ
+    """
+    webhook = webhooks_db.get(delivery['webhookId'])
+    if webhook is None:
+        return None
+    if not delivery['batch']:
+        return delivery['bodies'][0], delivery['headers']
+    
+    body = b'[' + b','.join(delivery['bodies']) + b']'
+    headers = dict(delivery['headers'])
+    headers['X-Webhook-Event'] = 'batch'
+    headers['X-Webhook-Batch-Size'] = str(len(delivery['bodies']))
+    headers.pop('X-Webhook-Signature', None)
+    
+    if webhook.get('secret'):
+        headers['X-Webhook-Signature'] = create_webhook_signature(body, webhook['secret'])
+    return body, headers
+
+def gate_webhook_delivery(delivery):
+    """Circuit breaker + rate limit của subscriber, trả về số giây cần hoãn delivery"""
+    webhook = webhooks_db.get(delivery['webhookId'])
+    rate_limit = webhook.get('rateLimit') if webhook else None
+    return delivery_guard.acquire(delivery['webhookId'], rate_limit)
+
+def deliver_webhook(delivery):
+    """Gửi một webhook delivery từ outbox (chạy trong delivery worker), trả về True nếu thành công"""
+    webhook_request = build_webhook_request(delivery)
+    if webhook_request is None:
+        # Webhook bị xóa sau khi delivery được claim: bỏ delivery
+        webhook_outbox.discard(delivery['outboxIds'])
+        return False
+    body, headers = webhook_request
+    try:
+        response = webhook_client.post(delivery['url'], body, headers)
+        print(f"Webhook sent to {delivery['url']}: {response.status_code}")
+        if 200 <= response.status_code < 300:
+            webhook_outbox.ack(delivery['outboxIds'])
+            delivery_guard.record_success(delivery['webhookId'])
+            return True
+        error = f'HTTP {response.status_code}'
+        # Chỉ lỗi phía subscriber (5xx / 429) mới tính cho circuit breaker
+        if response.status_code >= 500 or response.status_code == 429:
+            delivery_guard.record_failure(delivery['webhookId'])
+    except Exception as e:
+        print(f"Webhook failed for {delivery['url']}: {str(e)}")
+        error = str(e)
+        delivery_guard.record_failure(delivery['webhookId'])
+    
+    # Retry với backoff hoặc chuyển sang dead letters
+    dead = webhook_outbox.fail(delivery['outboxIds'], error)
+    if dead:
+        print(f"{dead} webhook event(s) moved to dead letters for {delivery['url']}: {error}")
+    return False
+
+webhook_client = WebhookClient(
+    pool_connections=WEBHOOK_POOL_HOSTS,
+    pool_maxsize=WEBHOOK_POOL_SIZE,
+    connect_timeout=WEBHOOK_CONNECT_TIMEOUT,
+    read_timeout=WEBHOOK_TIMEOUT
+)
+
+webhook_dispatcher = WebhookDispatcher(
+    deliver_webhook,
+    workers=WEBHOOK_WORKERS,
+    max_queue_size=WEBHOOK_QUEUE_SIZE
+)
+
+delivery_guard = DeliveryGuard(
+    failure_threshold=WEBHOOK_BREAKER_THRESHOLD,
+    cooldown=WEBHOOK_BREAKER_COOLDOWN_SECONDS
+)
+
+# Backend sqlite: bảng outbox nằm cùng database với orders để được ghi cùng transaction
+webhook_outbox = WebhookOutbox(
+    STORE_SQLITE_PATH if sqlite_storage is not None else WEBHOOK_OUTBOX_PATH,
+    max_attempts=WEBHOOK_MAX_ATTEMPTS,
+    base_delay=WEBHOOK_RETRY_BASE_SECONDS,
+    max_delay=WEBHOOK_RETRY_MAX_SECONDS,
+    lease_seconds=WEBHOOK_TIMEOUT * 3,
+    storage=sqlite_storage
+)
+
+@contextmanager
+def order_transaction():
+    """
+    Mutation order (hoặc webhook) + ghi outbox / change feed của nó trong một transaction.
+    Backend sqlite: commit hoặc rollback cùng nhau. Backend memory: WAL và outbox là hai file
+    riêng, order được commit trước nên crash ngay sau đó có thể làm mất event của order
+    """
+    if sqlite_storage is None:
+        yield
+        return
+    with sqlite_storage.transaction():
+        yield
+
+def build_webhook_deliveries(event_type, order_data, previous_status=None):
+    """Tạo deliveries (đã serialize + ký) của một event cho các subscribers"""
+    # Chỉ duyệt các webhooks active đã subscribe event này
+    subscribers = webhooks_db.subscribers(event_type)
+    if not subscribers:
+        return []
+    
+    payload = {
+        'id': generate_id('evt'),
+        'event': event_type,
+        'timestamp': get_current_time(),
+        'data': {
+            'order': order_data
+        }
+    }
+    
+    if previous_status:
+        payload['data']['previousStatus'] = previous_status
+    
+    # Serialize một lần, mọi subscriber nhận cùng một buffer; ký một lần cho mỗi secret
+    body = serialize_webhook_payload(payload)
+    signatures = {}
+    deliveries = []
+    
+    for webhook in subscribers:
+        headers = {
+            'Content-Type': 'application/json',
+            'X-Webhook-Event': event_type,
+            'X-Webhook-Id': webhook['id']
+        }
+        
+        secret = webhook.get('secret')
+        if secret:
+            if secret not in signatures:
+                signatures[secret] = create_webhook_signature(body, secret)
+            headers['X-Webhook-Signature'] = signatures[secret]
+        
+        deliveries.append({
+            'webhookId': webhook['id'],
+            'url': webhook['url'],
+            'eventType': event_type,
+            'orderId': order_data['id'],
+            'body': body,
+            'headers': headers,
+            'batch': webhook.get('batch')
+        })
+    
+    return deliveries
+
+def build_feed_event(event_type, order_data, previous_status=None):
+    """Event (event_type, JSON data) cho change feed /orders/events"""
+    data = {'event': event_type, 'timestamp': get_current_time(), 'order': order_data}
+    if previous_status:
+        data['previousStatus'] = previous_status
+    return event_type, json.dumps(data, ensure_ascii=False)
 
 def send_webhook_notification(event_type, order_data, previous_status=None):
-    """Gửi webhook notification đến tất cả registered webhooks"""
-    def send_async():
-        for webhook_id, webhook in webhooks_db.items():
-            if not webhook.get('isActive', True):
-                continue
-            if event_type not in webhook.get('events', []):
-                continue
-            
-            payload = {
-                'id': generate_id('evt'),
-                'event': event_type,
-                'timestamp': get_current_time(),
-                'data': {
-                    'order': order_data
-                }
-            }
-            
-            if previous_status:
-                payload['data']['previousStatus'] = previous_status
-            
-            headers = {
-                'Content-Type': 'application/json',
-                'X-Webhook-Event': event_type,
-                'X-Webhook-Id': webhook_id
-            }
-            
-            if webhook.get('secret'):
-                headers['X-Webhook-Signature'] = create_webhook_signature(payload, webhook['secret'])
-            
-            try:
-                response = requests.post(
-                    webhook['url'],
-                    json=payload,
-                    headers=headers,
-                    timeout=10
-                )
-                print(f"Webhook sent to {webhook['url']}: {response.status_code}")
-            except Exception as e:
-                print(f"Webhook failed for {webhook['url']}: {str(e)}")
-    
-    # Gửi webhook async để không block response
-    thread = threading.Thread(target=send_async)
-    thread.daemon = True
-    thread.start()
+    """Gửi webhook notification đến tất cả registered webhooks (và change feed SSE)"""
+    # Ghi vào outbox, relay + delivery workers sẽ gửi để không block response
+    webhook_outbox.enqueue(build_webhook_deliveries(event_type, order_data, previous_status))
+    order_events.publish([build_feed_event(event_type, order_data, previous_status)])
+
+def send_webhook_notifications(events):
+    """Gửi nhiều events (event_type, order, previous_status) trong một lần ghi outbox"""
+    deliveries = []
+    for event in events:
+        deliveries.extend(build_webhook_deliveries(*event))
+    webhook_outbox.enqueue(deliveries)
+    if events:
+        order_events.publish([build_feed_event(*event) for event in events])
 
 def error_response(code, message, details=None, status_code=400):
     """Tạo error response chuẩn"""
@@ -100,31 +466,212 @@ def error_response(code, message, details=None, status_code=400):
         response['details'] = details
     return jsonify(response), status_code
 
+def encode_cursor(sort_by, order):
+    """Tạo opaque cursor từ (sortKey, id) của row cuối trang"""
+    raw = json.dumps([sort_by, order[sort_by], order['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, sort_by):
+    """Giải mã cursor thành (sortKey, id), trả về None nếu cursor không hợp lệ"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        field, sort_key, order_id = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    
+    key_type = (int, float) if sort_by == 'totalAmount' else str
+    if field != sort_by or not isinstance(sort_key, key_type) or not isinstance(order_id, str):
+        return None
+    return (sort_key, order_id)
+
+def build_search_filters(params):
+    """Chuẩn hóa filters của /orders/search từ query args hoặc JSON body"""
+    filters = {}
+    for field in ('customerId', 'status', 'fromDate', 'toDate', 'q'):
+        if params.get(field):
+            filters[field] = params.get(field)
+    for field in ('minTotal', 'maxTotal'):
+        try:
+            value = float(params[field])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if math.isfinite(value):
+            filters[field] = value
+    return filters
+
+def validate_search_filter(search_filter):
+    """Validate search filter trong body (bulk write), trả về list errors"""
+    errors = []
+    for field, value in search_filter.items():
+        if field in ('customerId', 'status', 'fromDate', 'toDate', 'q'):
+            if not isinstance(value, str) or not value:
+                errors.append({'field': f'filter.{field}', 'message': f'{field} must be a non-empty string'})
+            elif field == 'q' and not query_terms(value):
+                errors.append({'field': 'filter.q', 'message': 'q must contain at least one letter or digit'})
+            elif field == 'status' and value not in VALID_STATUSES:
+                errors.append({'field': 'filter.status', 'message': f'Status must be one of: {", ".join(VALID_STATUSES)}'})
+        elif field in ('minTotal', 'maxTotal'):
+            if type(value) not in (int, float) or not math.isfinite(value):
+                errors.append({'field': f'filter.{field}', 'message': f'{field} must be a finite number'})
+        else:
+            errors.append({'field': f'filter.{field}', 'message': f'Unknown filter field {field}'})
+    if not search_filter:
+        # Filter rỗng sẽ khớp mọi order
+        errors.append({'field': 'filter', 'message': 'filter must contain at least one field'})
+    return errors
+
+def invalid_query_response(filters):
+    """400 nếu q không có term nào (chỉ có dấu câu / khoảng trắng), ngược lại None"""
+    if 'q' in filters and not query_terms(filters['q']):
+        return error_response('VALIDATION_ERROR', 'Invalid search query', [
+            {'field': 'q', 'message': 'q must contain at least one letter or digit'}
+        ])
+    return None
+
+def validate_batch_config(batch):
+    """Validate batch config của webhook, trả về (config đã chuẩn hóa, errors)"""
+    if batch is None:
+        return None, []
+    if not isinstance(batch, dict):
+        return None, [{'field': 'batch', 'message': 'batch must be an object'}]
+    
+    config = {
+        'maxEvents': batch.get('maxEvents', 100),
+        'maxDelayMs': batch.get('maxDelayMs', 1000),
+        'coalesce': batch.get('coalesce', False)
+    }
+    errors = []
+    if type(config['maxEvents']) is not int or not 1 <= config['maxEvents'] <= 1000:
+        errors.append({'field': 'batch.maxEvents', 'message': 'maxEvents must be an integer between 1 and 1000'})
+    if type(config['maxDelayMs']) is not int or not 0 <= config['maxDelayMs'] <= 60000:
+        errors.append({'field': 'batch.maxDelayMs', 'message': 'maxDelayMs must be an integer between 0 and 60000'})
+    if not isinstance(config['coalesce'], bool):
+        errors.append({'field': 'batch.coalesce', 'message': 'coalesce must be a boolean'})
+    return config, errors
+
+def validate_rate_limit_config(rate_limit):
+    """Validate token-bucket rate limit của webhook, trả về (config đã chuẩn hóa, errors)"""
+    if rate_limit is None:
+        return None, []
+    if not isinstance(rate_limit, dict):
+        return None, [{'field': 'rateLimit', 'message': 'rateLimit must be an object'}]
+    
+    rps = rate_limit.get('requestsPerSecond')
+    if type(rps) not in (int, float) or rps <= 0:
+        return None, [{'field': 'rateLimit.requestsPerSecond', 'message': 'requestsPerSecond must be a positive number'}]
+    
+    config = {
+        'requestsPerSecond': rps,
+        'burst': rate_limit.get('burst', max(1, int(rps)))
+    }
+    if type(config['burst']) is not int or config['burst'] < 1:
+        return None, [{'field': 'rateLimit.burst', 'message': 'burst must be a positive integer'}]
+    return config, []
+
+def invalid_cursor_response():
+    """Error response cho cursor không hợp lệ"""
+    return error_response('BAD_REQUEST', 'Invalid cursor', [
+        {'field': 'cursor', 'message': 'cursor is malformed or does not match sortBy'}
+    ])
+
+@lru_cache(maxsize=256)
+def parse_fields(value):
+    """
+    Parse ?fields= thành cây projection {field: True | cây con}, trả về None nếu không hợp lệ.
+    Field cấp đầu phải thuộc ORDER_FIELDS; field lồng nhau dùng dấu chấm (vd. items.productId)
+    """
+    tree = {}
+    for path in value.split(','):
+        parts = path.strip().split('.')
+        if parts[0] not in ORDER_FIELDS or not all(parts):
+            return None
+        node = tree
+        for part in parts[:-1]:
+            if node.get(part) is True:
+                # Đã chọn toàn bộ field cha
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = True
+    return tree
+
+def project(value, tree):
+    """Chỉ giữ các field trong cây projection (áp dụng cho từng phần tử nếu value là list)"""
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {
+        field: value[field] if subtree is True else project(value[field], subtree)
+        for field, subtree in tree.items() if field in value
+    }
+
+def requested_projection():
+    """(cây projection hoặc None nếu không có ?fields=, error response nếu fields không hợp lệ)"""
+    fields = request.args.get('fields')
+    if fields is None:
+        return None, None
+    tree = parse_fields(fields)
+    if tree is None:
+        return None, error_response('BAD_REQUEST', 'Invalid fields', [
+            {'field': 'fields', 'message': f'fields must be a comma-separated list of: {", ".join(sorted(ORDER_FIELDS))}'}
+        ])
+    return tree, None
+
+def validate_status_field(data):
+    """Status (nếu có key 'status', kể cả null / 0) phải là một trong VALID_STATUSES"""
+    if 'status' in data and (not isinstance(data['status'], str) or data['status'] not in VALID_STATUSES):
+        return [{'field': 'status', 'message': f'Status must be one of: {", ".join(VALID_STATUSES)}'}]
+    return []
+
 def validate_order_data(data, is_update=False):
     """Validate order data"""
-    errors = []
+    errors = validate_status_field(data)
     
     if not is_update or 'customerId' in data:
         if not data.get('customerId'):
             errors.append({'field': 'customerId', 'message': 'customerId is required'})
+        elif not isinstance(data['customerId'], str):
+            errors.append({'field': 'customerId', 'message': 'customerId must be a string'})
     
     if not is_update or 'items' in data:
         items = data.get('items', [])
-        if not items:
+        if not isinstance(items, list):
+            errors.append({'field': 'items', 'message': 'items must be an array'})
+        elif not items:
             errors.append({'field': 'items', 'message': 'At least one item is required'})
         else:
             for i, item in enumerate(items):
+                if not isinstance(item, dict):
+                    errors.append({'field': f'items[{i}]', 'message': 'item must be an object'})
+                    continue
                 if not item.get('productId'):
                     errors.append({'field': f'items[{i}].productId', 'message': 'productId is required'})
                 if not item.get('productName'):
                     errors.append({'field': f'items[{i}].productName', 'message': 'productName is required'})
-                if not item.get('quantity') or item.get('quantity', 0) < 1:
-                    errors.append({'field': f'items[{i}].quantity', 'message': 'quantity must be at least 1'})
-                if item.get('unitPrice') is None or item.get('unitPrice', 0) < 0:
-                    errors.append({'field': f'items[{i}].unitPrice', 'message': 'unitPrice must be non-negative'})
+                # NaN / Infinity (JSON parser của Python chấp nhận) làm hỏng thứ tự của index totalAmount
+                quantity = item.get('quantity')
+                if type(quantity) not in (int, float) or not math.isfinite(quantity) or quantity < 1:
+                    errors.append({'field': f'items[{i}].quantity', 'message': 'quantity must be a finite number of at least 1'})
+                unit_price = item.get('unitPrice')
+                if type(unit_price) not in (int, float) or not math.isfinite(unit_price) or unit_price < 0:
+                    errors.append({'field': f'items[{i}].unitPrice', 'message': 'unitPrice must be a finite non-negative number'})
+            if not errors and not math.isfinite(calculate_total(items)):
+                errors.append({'field': 'items', 'message': 'totalAmount must be a finite number'})
     
     return errors
 
+@app.before_request
+def start_webhook_relay():
+    """Start outbox relay khi process bắt đầu phục vụ request"""
+    webhook_outbox.ensure_relay(webhook_dispatcher.submit, gate_webhook_delivery)
+
+@app.errorhandler(WriteAheadLogError)
+def write_ahead_log_failed(error):
+    """WAL không ghi được: mutation không durable, trả 503 thay vì treo request"""
+    print(f"Write-ahead log error: {str(error)}")
+    return error_response('STORAGE_UNAVAILABLE', 'Changes cannot be persisted at the moment', status_code=503)
+
 # ============= CRUD Endpoints for Orders =============
 
 @app.route('/api/v1/orders', methods=['GET'])
@@ -132,32 +679,56 @@ def get_orders():
     """GET /orders - Lấy danh sách tất cả orders"""
     page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', 20, type=int)
+    cursor = request.args.get('cursor')
+    
+    projection, error = requested_projection()
+    if error:
+        return error
     
     # Validate pagination
     page = max(1, page)
     limit = max(1, min(100, limit))
-    
-    # Get all orders sorted by createdAt desc
-    all_orders = sorted(
-        orders_db.values(),
-        key=lambda x: x['createdAt'],
-        reverse=True
-    )
-    
-    # Paginate
-    total = len(all_orders)
-    start = (page - 1) * limit
-    end = start + limit
-    paginated_orders = all_orders[start:end]
-    
-    return jsonify({
-        'data': paginated_orders,
-        'pagination': {
+    # Orders đã archive được trộn vào danh sách giống /orders/search
+    archived_total = order_archive.count({}) if order_archive is not None else 0
+    total = len(orders_db) + archived_total
+    
+    if cursor:
+        # Keyset pagination: tiếp tục ngay sau row cuối của trang trước
+        after = decode_cursor(cursor, 'createdAt')
+        if after is None:
+            return invalid_cursor_response()
+        paginated_orders = orders_db.page_after(after, limit + 1)
+        has_more = len(paginated_orders) > limit
+        paginated_orders = paginated_orders[:limit]
+        if archived_total:
+            hot_count = limit if has_more else limit + 1
+            merged = merge_archived({}, 'createdAt', True, hot_count, paginated_orders, after)
+            has_more = has_more or len(merged) > limit
+            paginated_orders = merged[:limit]
+        pagination = {'limit': limit, 'total': total}
+    else:
+        # Lấy trang hiện tại từ index createdAt (desc), không cần sort lại
+        start = (page - 1) * limit
+        if archived_total:
+            hot_orders = orders_db.page(0, start + limit)
+            paginated_orders = merge_archived({}, 'createdAt', True, start + limit, hot_orders)[start:]
+        else:
+            paginated_orders = orders_db.page(start, limit)
+        has_more = start + limit < total
+        pagination = {
             'page': page,
             'limit': limit,
             'total': total,
             'totalPages': (total + limit - 1) // limit if total > 0 else 0
         }
+    
+    pagination['nextCursor'] = (
+        encode_cursor('createdAt', paginated_orders[-1]) if has_more and paginated_orders else None
+    )
+    
+    return jsonify({
+        'data': project(paginated_orders, projection) if projection else paginated_orders,
+        'pagination': pagination
     })
 
 @app.route('/api/v1/orders', methods=['POST'])
@@ -174,36 +745,191 @@ def create_order():
         return error_response('VALIDATION_ERROR', 'Invalid request body', errors)
     
     # Create order
-    order_id = generate_id('ord')
+    order = build_order(data, get_current_time())
+    
+    with order_transaction():
+        orders_db.add(order)
+        
+        # Send webhook notification
+        send_webhook_notification('order.created', order)
+    
+    return with_order_validators(jsonify(order), order), 201
+
+@app.route('/api/v1/orders:batch', methods=['POST'])
+def create_orders_batch():
+    """POST /orders:batch - Tạo nhiều orders trong một request"""
+    data = request.get_json()
+    
+    if not data:
+        return error_response('BAD_REQUEST', 'Request body is required')
+    if not isinstance(data, dict):
+        return error_response('VALIDATION_ERROR', 'Invalid request body', [
+            {'field': 'body', 'message': 'Request body must be a JSON object'}
+        ])
+    
+    orders_data = data.get('orders')
+    atomic = data.get('atomic', False)
+    
+    if not isinstance(orders_data, list) or not orders_data:
+        return error_response('VALIDATION_ERROR', 'Invalid request body', [
+            {'field': 'orders', 'message': 'orders must be a non-empty array'}
+        ])
+    if len(orders_data) > ORDER_BATCH_MAX_SIZE:
+        return error_response('VALIDATION_ERROR', 'Invalid request body', [
+            {'field': 'orders', 'message': f'At most {ORDER_BATCH_MAX_SIZE} orders per batch'}
+        ])
+    if not isinstance(atomic, bool):
+        return error_response('VALIDATION_ERROR', 'Invalid request body', [
+            {'field': 'atomic', 'message': 'atomic must be a boolean'}
+        ])
+    
+    # Validate tất cả orders trong một lượt
     now = get_current_time()
+    results = []
+    valid_orders = []
+    all_errors = []
     
-    order = {
-        'id': order_id,
-        'customerId': data['customerId'],
-        'items': data['items'],
-        'totalAmount': calculate_total(data['items']),
-        'status': 'pending',
-        'shippingAddress': data.get('shippingAddress'),
-        'notes': data.get('notes'),
-        'createdAt': now,
-        'updatedAt': now
-    }
+    for i, order_data in enumerate(orders_data):
+        if isinstance(order_data, dict):
+            errors = validate_order_data(order_data)
+        else:
+            errors = [{'field': '', 'message': 'order must be an object'}]
+        
+        if errors:
+            results.append({'index': i, 'status': 400, 'errors': errors})
+            all_errors.extend(
+                {'field': f"orders[{i}].{error['field']}".rstrip('.'), 'message': error['message']}
+                for error in errors
+            )
+        else:
+            order = build_order(order_data, now)
+            valid_orders.append(order)
+            results.append({'index': i, 'status': 201, 'order': order})
+    
+    # atomic: chỉ tạo khi tất cả orders hợp lệ
+    if atomic and all_errors:
+        return error_response('VALIDATION_ERROR', 'Invalid orders, nothing was created', all_errors)
+    
+    with order_transaction():
+        orders_db.add_many(valid_orders)
+        
+        # Một lần ghi outbox cho toàn bộ notifications
+        send_webhook_notifications([('order.created', order) for order in valid_orders])
+    
+    status_code = 201 if len(valid_orders) == len(orders_data) else 207
+    return jsonify({
+        'created': len(valid_orders),
+        'failed': len(orders_data) - len(valid_orders),
+        'results': results
+    }), status_code
+
+@app.route('/api/v1/orders:transition', methods=['POST'])
+def transition_orders():
+    """POST /orders:transition - Chuyển trạng thái nhiều orders (theo ids hoặc search filter)"""
+    data = request.get_json()
     
-    orders_db[order_id] = order
+    if not data:
+        return error_response('BAD_REQUEST', 'Request body is required')
+    if not isinstance(data, dict):
+        return error_response('VALIDATION_ERROR', 'Invalid request body', [
+            {'field': 'body', 'message': 'Request body must be a JSON object'}
+        ])
     
-    # Send webhook notification
-    send_webhook_notification('order.created', order)
+    target_status = data.get('status')
+    from_status = data.get('fromStatus')
+    order_ids = data.get('ids')
+    search_filter = data.get('filter')
     
-    return jsonify(order), 201
+    errors = []
+    if target_status not in VALID_STATUSES:
+        errors.append({'field': 'status', 'message': f'Status must be one of: {", ".join(VALID_STATUSES)}'})
+    if from_status is not None and from_status not in VALID_STATUSES:
+        errors.append({'field': 'fromStatus', 'message': f'fromStatus must be one of: {", ".join(VALID_STATUSES)}'})
+    if (order_ids is None) == (search_filter is None):
+        errors.append({'field': 'ids', 'message': 'Exactly one of ids or filter is required'})
+    elif order_ids is not None and (not isinstance(order_ids, list) or not all(isinstance(i, str) for i in order_ids)):
+        errors.append({'field': 'ids', 'message': 'ids must be an array of order ids'})
+    elif search_filter is not None and not isinstance(search_filter, dict):
+        errors.append({'field': 'filter', 'message': 'filter must be an object'})
+    elif search_filter is not None:
+        errors.extend(validate_search_filter(search_filter))
+    if errors:
+        return error_response('VALIDATION_ERROR', 'Invalid request body', errors)
+    
+    if search_filter is not None:
+        # Cùng semantics với /orders/search
+        order_ids = [order['id'] for order in orders_db.search(build_search_filters(search_filter))]
+    order_ids = list(dict.fromkeys(order_ids))
+    
+    if len(order_ids) > ORDER_TRANSITION_MAX_SIZE:
+        return error_response('VALIDATION_ERROR', 'Too many orders', [
+            {'field': 'ids', 'message': f'At most {ORDER_TRANSITION_MAX_SIZE} orders per transition, narrow the filter'}
+        ])
+    
+    now = get_current_time()
+    outcomes = {}
+    
+    def build_changes(order):
+        outcome = {'id': order['id'], 'previousStatus': order['status'], 'status': order['status']}
+        outcomes[order['id']] = outcome
+        if from_status is not None and order['status'] != from_status:
+            outcome['outcome'] = 'skipped'
+            return None
+        if order['status'] == target_status:
+            outcome['outcome'] = 'unchanged'
+            return None
+        outcome['outcome'] = 'updated'
+        outcome['status'] = target_status
+        return {'status': target_status, 'updatedAt': now}
+    
+    # Một lượt giữ lock, các index chỉ cập nhật một lần
+    with order_transaction():
+        updates = orders_db.update_many(order_ids, build_changes)
+        
+        # Một lần ghi outbox cho toàn bộ notifications
+        events = []
+        for order, _ in updates:
+            previous_status = outcomes[order['id']]['previousStatus']
+            events.append(('order.updated', order))
+            events.append(('order.status_changed', order, previous_status))
+        send_webhook_notifications(events)
+    
+    results = [outcomes.get(order_id, {'id': order_id, 'outcome': 'not_found'}) for order_id in order_ids]
+    summary = {}
+    for result in results:
+        summary[result['outcome']] = summary.get(result['outcome'], 0) + 1
+    
+    return jsonify({
+        'status': target_status,
+        'summary': summary,
+        'results': results
+    })
+
+def find_order(order_id):
+    """Order trong orders_db, hoặc bản đã archive nếu order đã được chuyển sang archive"""
+    order = orders_db.get(order_id)
+    if order is None and order_archive is not None:
+        order = order_archive.get(order_id)
+    return order
+
+def order_missing_response(order_id):
+    """Order không có trong orders_db: 409 nếu đã được archive (chỉ đọc), ngược lại 404"""
+    if order_archive is not None and order_archive.get(order_id) is not None:
+        return error_response('ORDER_ARCHIVED', 'Order is archived and can no longer be modified', status_code=409)
+    return error_response('NOT_FOUND', 'Order not found', status_code=404)
 
 @app.route('/api/v1/orders/<order_id>', methods=['GET'])
 def get_order_by_id(order_id):
     """GET /orders/{orderId} - Lấy thông tin một order (với HATEOAS links)"""
-    order = orders_db.get(order_id)
+    order = find_order(order_id)
     
     if not order:
         return error_response('NOT_FOUND', 'Order not found', status_code=404)
     
+    # Client đã có version hiện tại: 304 không body
+    if is_not_modified(order):
+        return with_order_validators(Response(status=304), order)
+    
     # Thêm HATEOAS links đơn giản
     base_url = request.host_url.rstrip('/')
     order_with_links = order.copy()
@@ -212,7 +938,7 @@ def get_order_by_id(order_id):
         'collection': f'{base_url}/api/v1/orders'
     }
     
-    return jsonify(order_with_links)
+    return with_order_validators(jsonify(order_with_links), order)
 
 @app.route('/api/v1/orders/<order_id>', methods=['PUT'])
 def update_order(order_id):
@@ -220,7 +946,7 @@ def update_order(order_id):
     order = orders_db.get(order_id)
     
     if not order:
-        return error_response('NOT_FOUND', 'Order not found', status_code=404)
+        return order_missing_response(order_id)
     
     data = request.get_json()
     
@@ -232,32 +958,32 @@ def update_order(order_id):
     if errors:
         return error_response('VALIDATION_ERROR', 'Invalid request body', errors)
     
-    # Validate status
-    valid_statuses = ['pending', 'confirmed', 'processing', 'shipped', 'delivered', 'cancelled']
-    if data.get('status') and data['status'] not in valid_statuses:
-        return error_response('VALIDATION_ERROR', 'Invalid status', [
-            {'field': 'status', 'message': f'Status must be one of: {", ".join(valid_statuses)}'}
-        ])
-    
-    previous_status = order['status']
-    
     # Update order
-    order['customerId'] = data['customerId']
-    order['items'] = data['items']
-    order['totalAmount'] = calculate_total(data['items'])
-    order['status'] = data.get('status', order['status'])
-    order['shippingAddress'] = data.get('shippingAddress')
-    order['notes'] = data.get('notes')
-    order['updatedAt'] = get_current_time()
-    
-    orders_db[order_id] = order
-    
-    # Send webhook notifications
-    send_webhook_notification('order.updated', order)
-    if previous_status != order['status']:
-        send_webhook_notification('order.status_changed', order, previous_status)
+    changes = {
+        'customerId': data['customerId'],
+        'items': data['items'],
+        'totalAmount': calculate_total(data['items']),
+        'shippingAddress': data.get('shippingAddress'),
+        'notes': data.get('notes'),
+        'updatedAt': get_current_time()
+    }
+    if 'status' in data:
+        changes['status'] = data['status']
+    with order_transaction():
+        try:
+            previous, order = orders_db.update(order_id, changes, if_match_precondition())
+        except KeyError:
+            # Order bị xóa bởi request đồng thời
+            return error_response('NOT_FOUND', 'Order not found', status_code=404)
+        except PreconditionFailed:
+            return precondition_failed_response()
+        
+        # Send webhook notifications
+        send_webhook_notification('order.updated', order)
+        if previous['status'] != order['status']:
+            send_webhook_notification('order.status_changed', order, previous['status'])
     
-    return jsonify(order)
+    return with_order_validators(jsonify(order), order)
 
 @app.route('/api/v1/orders/<order_id>', methods=['PATCH'])
 def patch_order(order_id):
@@ -265,7 +991,7 @@ def patch_order(order_id):
     order = orders_db.get(order_id)
     
     if not order:
-        return error_response('NOT_FOUND', 'Order not found', status_code=404)
+        return order_missing_response(order_id)
     
     data = request.get_json()
     
@@ -273,68 +999,88 @@ def patch_order(order_id):
         return error_response('BAD_REQUEST', 'Request body is required')
     
     # Validate status if provided
-    valid_statuses = ['pending', 'confirmed', 'processing', 'shipped', 'delivered', 'cancelled']
-    if data.get('status') and data['status'] not in valid_statuses:
-        return error_response('VALIDATION_ERROR', 'Invalid status', [
-            {'field': 'status', 'message': f'Status must be one of: {", ".join(valid_statuses)}'}
-        ])
-    
-    previous_status = order['status']
+    errors = validate_status_field(data)
+    if errors:
+        return error_response('VALIDATION_ERROR', 'Invalid status', errors)
     
     # Partial update
+    changes = {}
     if 'status' in data:
-        order['status'] = data['status']
+        changes['status'] = data['status']
     if 'shippingAddress' in data:
-        order['shippingAddress'] = data['shippingAddress']
+        changes['shippingAddress'] = data['shippingAddress']
     if 'notes' in data:
-        order['notes'] = data['notes']
-    
-    order['updatedAt'] = get_current_time()
-    orders_db[order_id] = order
-    
-    # Send webhook notifications
-    send_webhook_notification('order.updated', order)
-    if previous_status != order['status']:
-        send_webhook_notification('order.status_changed', order, previous_status)
+        changes['notes'] = data['notes']
+    
+    changes['updatedAt'] = get_current_time()
+    with order_transaction():
+        try:
+            previous, order = orders_db.update(order_id, changes, if_match_precondition())
+        except KeyError:
+            # Order bị xóa bởi request đồng thời
+            return error_response('NOT_FOUND', 'Order not found', status_code=404)
+        except PreconditionFailed:
+            return precondition_failed_response()
+        
+        # Send webhook notifications
+        send_webhook_notification('order.updated', order)
+        if previous['status'] != order['status']:
+            send_webhook_notification('order.status_changed', order, previous['status'])
     
-    return jsonify(order)
+    return with_order_validators(jsonify(order), order)
 
 @app.route('/api/v1/orders/<order_id>', methods=['DELETE'])
 def delete_order(order_id):
     """DELETE /orders/{orderId} - Xóa order"""
-    order = orders_db.get(order_id)
-    
-    if not order:
-        return error_response('NOT_FOUND', 'Order not found', status_code=404)
-    
-    # Send webhook notification before deleting
-    send_webhook_notification('order.deleted', order)
-    
-    del orders_db[order_id]
+    with order_transaction():
+        try:
+            order = orders_db.delete(order_id)
+        except KeyError:
+            return order_missing_response(order_id)
+        
+        # Payload là version cuối cùng của order đã xóa
+        send_webhook_notification('order.deleted', order)
     
     return '', 204
 
 # ============= Query Endpoint =============
 
+def merge_archived(filters, sort_by, reverse, count, hot_orders, after=None):
+    """
+    count orders đầu tiên của hot_orders (từ orders_db, đã sort, tối đa count) trộn với orders đã
+    archive: khi hot_orders đủ count, archive chỉ cần tìm orders xếp trước order cuối của hot_orders
+    """
+    sort_key = itemgetter(sort_by, 'id')
+    before = sort_key(hot_orders[-1]) if len(hot_orders) >= count else None
+    archived = order_archive.search_page(filters, sort_by, reverse, count, after, before)
+    # Order vừa được ghi sang archive nhưng chưa bị xóa khỏi orders_db chỉ được tính một lần
+    hot_ids = {order['id'] for order in hot_orders}
+    archived = [order for order in archived if order['id'] not in hot_ids]
+    return top_orders(hot_orders + archived, sort_by, reverse, count)
+
+def top_orders(orders, sort_by, reverse, count):
+    """count orders đầu tiên theo (sort_by, id)"""
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    return select(count, orders, key=itemgetter(sort_by, 'id'))
+
 @app.route('/api/v1/orders/search', methods=['GET'])
 def search_orders():
     """GET /orders/search - Tìm kiếm orders"""
     # Get query parameters
-    customer_id = request.args.get('customerId')
-    status = request.args.get('status')
-    from_date = request.args.get('fromDate')
-    to_date = request.args.get('toDate')
-    min_total = request.args.get('minTotal', type=float)
-    max_total = request.args.get('maxTotal', type=float)
     sort_by = request.args.get('sortBy', 'createdAt')
     sort_order = request.args.get('sortOrder', 'desc')
     page = request.args.get('page', 1, type=int)
     limit = request.args.get('limit', 20, type=int)
+    cursor = request.args.get('cursor')
     
     # Validate pagination
     page = max(1, page)
     limit = max(1, min(100, limit))
     
+    projection, error = requested_projection()
+    if error:
+        return error
+    
     # Validate sort parameters
     valid_sort_fields = ['createdAt', 'totalAmount', 'status']
     if sort_by not in valid_sort_fields:
@@ -342,63 +1088,198 @@ def search_orders():
     if sort_order not in ['asc', 'desc']:
         sort_order = 'desc'
     
-    # Filter orders
-    filtered_orders = list(orders_db.values())
-    
-    if customer_id:
-        filtered_orders = [o for o in filtered_orders if o['customerId'] == customer_id]
-    
-    if status:
-        filtered_orders = [o for o in filtered_orders if o['status'] == status]
-    
-    if from_date:
-        filtered_orders = [o for o in filtered_orders if o['createdAt'] >= from_date]
-    
-    if to_date:
-        filtered_orders = [o for o in filtered_orders if o['createdAt'] <= to_date]
-    
-    if min_total is not None:
-        filtered_orders = [o for o in filtered_orders if o['totalAmount'] >= min_total]
-    
-    if max_total is not None:
-        filtered_orders = [o for o in filtered_orders if o['totalAmount'] <= max_total]
+    # Build applied filters
+    filters = build_search_filters(request.args)
+    error = invalid_query_response(filters)
+    if error:
+        return error
     
-    # Sort
     reverse = sort_order == 'desc'
-    filtered_orders.sort(key=lambda x: x.get(sort_by, ''), reverse=reverse)
     
-    # Paginate
-    total = len(filtered_orders)
-    start = (page - 1) * limit
-    end = start + limit
-    paginated_orders = filtered_orders[start:end]
-    
-    # Build applied filters
-    filters = {}
-    if customer_id:
-        filters['customerId'] = customer_id
-    if status:
-        filters['status'] = status
-    if from_date:
-        filters['fromDate'] = from_date
-    if to_date:
-        filters['toDate'] = to_date
-    if min_total is not None:
-        filters['minTotal'] = min_total
-    if max_total is not None:
-        filters['maxTotal'] = max_total
-    
-    return jsonify({
-        'data': paginated_orders,
-        'pagination': {
+    if cursor:
+        # Keyset pagination: chi phí mỗi trang không phụ thuộc độ sâu
+        after = decode_cursor(cursor, sort_by)
+        if after is None:
+            return invalid_cursor_response()
+        paginated_orders, has_more = orders_db.search_after(filters, sort_by, reverse, limit, after)
+        if order_archive is not None:
+            # Orders đã archive nằm sau cursor được trộn với trang từ orders_db; khi orders_db còn
+            # orders sau trang, chỉ orders đã archive xếp trước order cuối của trang mới vào được trang
+            hot_count = limit if has_more else limit + 1
+            merged = merge_archived(filters, sort_by, reverse, hot_count, paginated_orders, after)
+            has_more = has_more or len(merged) > limit
+            paginated_orders = merged[:limit]
+        pagination = {'limit': limit}
+    else:
+        # Filter qua query planner (dùng secondary indexes), sort + paginate trong store
+        start = (page - 1) * limit
+        archived_total = order_archive.count(filters) if order_archive is not None else 0
+        if archived_total:
+            # Lấy start + limit orders đầu từ orders_db rồi trộn với orders đã archive
+            hot_orders, total = orders_db.search_page(filters, sort_by, reverse, 0, start + limit)
+            paginated_orders = merge_archived(filters, sort_by, reverse, start + limit, hot_orders)[start:]
+            total += archived_total
+        else:
+            paginated_orders, total = orders_db.search_page(filters, sort_by, reverse, start, limit)
+        has_more = start + limit < total
+        pagination = {
             'page': page,
             'limit': limit,
             'total': total,
             'totalPages': (total + limit - 1) // limit if total > 0 else 0
-        },
+        }
+    
+    pagination['nextCursor'] = (
+        encode_cursor(sort_by, paginated_orders[-1]) if has_more and paginated_orders else None
+    )
+    
+    return jsonify({
+        'data': project(paginated_orders, projection) if projection else paginated_orders,
+        'pagination': pagination,
         'filters': filters
     })
 
+# ============= Export Endpoint =============
+
+# Gom các dòng NDJSON đến khoảng này rồi mới ghi ra response
+EXPORT_BUFFER_BYTES = 64 * 1024
+
+def scan_orders(filters):
+    """
+    Orders khớp filters trong orders_db và archive theo (createdAt, id) tăng dần. Order vừa được
+    ghi sang archive nhưng chưa bị xóa khỏi orders_db nằm liền nhau sau khi trộn, chỉ bản trong
+    orders_db được giữ
+    """
+    if order_archive is None:
+        yield from orders_db.scan(filters)
+        return
+    previous_id = None
+    for order in heapq.merge(orders_db.scan(filters), order_archive.scan(filters), key=itemgetter('createdAt', 'id')):
+        if order['id'] != previous_id:
+            yield order
+        previous_id = order['id']
+
+@app.route('/api/v1/orders/export', methods=['GET'])
+def export_orders():
+    """GET /orders/export - Stream orders dạng NDJSON (cùng filters với /orders/search, thêm since)"""
+    filters = build_search_filters(request.args)
+    since = request.args.get('since')
+    if since:
+        filters['since'] = since
+    error = invalid_query_response(filters)
+    if error:
+        return error
+    projection, error = requested_projection()
+    if error:
+        return error
+    
+    # Watermark cho lần sync tiếp theo: thời điểm bắt đầu export
+    started_at = get_current_time()
+    
+    def generate():
+        buffer = []
+        size = 0
+        for order in scan_orders(filters):
+            if projection:
+                order = project(order, projection)
+            line = json.dumps(order, ensure_ascii=False) + '\n'
+            buffer.append(line)
+            size += len(line)
+            if size >= EXPORT_BUFFER_BYTES:
+                yield ''.join(buffer)
+                buffer = []
+                size = 0
+        if buffer:
+            yield ''.join(buffer)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'X-Export-Watermark': started_at}
+    )
+
+# ============= Event Stream Endpoint =============
+
+# Gửi comment keep-alive khi không có event trong chừng này giây (giữ kết nối qua proxy)
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+# Thời gian EventSource chờ trước khi tự kết nối lại
+SSE_RETRY_MS = 3000
+# Số events đọc từ feed mỗi lần
+SSE_READ_BATCH = 100
+
+def format_sse(event_id, event_type, data):
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+
+@app.route('/api/v1/orders/events', methods=['GET'])
+def stream_order_events():
+    """GET /orders/events - Server-Sent Events stream các order.* events, resume bằng Last-Event-ID"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    if last_event_id is None:
+        # Client mới chỉ nhận events từ thời điểm kết nối
+        cursor = order_events.last_id()
+    else:
+        try:
+            cursor = int(last_event_id)
+        except ValueError:
+            return error_response('BAD_REQUEST', 'Invalid Last-Event-ID', [
+                {'field': 'Last-Event-ID', 'message': 'Last-Event-ID must be an integer event id'}
+            ])
+    
+    def generate(cursor):
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        idle_since = time.monotonic()
+        while True:
+            events, next_cursor, complete = order_events.read_after(cursor, SSE_READ_BATCH)
+            if not complete:
+                # Events sau Last-Event-ID đã bị bỏ khỏi buffer: client cần đồng bộ lại (vd. /orders/export?since=)
+                yield format_sse(next_cursor if not events else events[0][0] - 1, 'resync',
+                                 json.dumps({'lastEventId': cursor}))
+            if events:
+                yield ''.join(format_sse(*event) for event in events)
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since >= SSE_HEARTBEAT_SECONDS:
+                yield ": keepalive\n\n"
+                idle_since = time.monotonic()
+            cursor = next_cursor
+            if not events:
+                order_events.wait(cursor, SSE_HEARTBEAT_SECONDS)
+    
+    return Response(
+        generate(cursor),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# ============= Stats Endpoint =============
+
+# Chiều nhóm của /orders/stats -> key trong response
+STATS_GROUPS = {
+    'status': 'byStatus',
+    'customerId': 'byCustomer',
+    'day': 'byDay',
+}
+
+@app.route('/api/v1/orders/stats', methods=['GET'])
+def order_stats():
+    """GET /orders/stats - Count / sum / min / max của totalAmount theo status, customer và ngày tạo"""
+    group_by = request.args.get('groupBy')
+    dimensions = group_by.split(',') if group_by else list(STATS_GROUPS)
+    invalid = [dimension for dimension in dimensions if dimension not in STATS_GROUPS]
+    if invalid:
+        return error_response('VALIDATION_ERROR', 'Invalid groupBy', [
+            {'field': 'groupBy', 'message': f'groupBy must be a comma-separated list of: {", ".join(STATS_GROUPS)}'}
+        ])
+
+    # Aggregates được duy trì khi ghi order nên chi phí chỉ phụ thuộc số groups
+    stats = orders_db.stats(set(dimensions) | {'status'})
+    if order_archive is not None:
+        stats = merge_stats(stats, order_archive.aggregates(set(dimensions) | {'status'}))
+    response = {'totals': merge_groups(stats['status'].values())}
+    for dimension in dimensions:
+        response[STATS_GROUPS[dimension]] = stats[dimension]
+
+    return jsonify(response)
+
 # ============= Webhook Endpoints =============
 
 @app.route('/api/v1/webhooks', methods=['GET'])
@@ -426,6 +1307,11 @@ def register_webhook():
         if event not in valid_events:
             errors.append({'field': 'events', 'message': f'Invalid event: {event}'})
     
+    batch, batch_errors = validate_batch_config(data.get('batch'))
+    errors.extend(batch_errors)
+    rate_limit, rate_limit_errors = validate_rate_limit_config(data.get('rateLimit'))
+    errors.extend(rate_limit_errors)
+    
     if errors:
         return error_response('VALIDATION_ERROR', 'Invalid request body', errors)
     
@@ -440,23 +1326,65 @@ def register_webhook():
         'secret': data.get('secret') or generate_webhook_secret(),
         'isActive': True,
         'description': data.get('description'),
+        'batch': batch,
+        'rateLimit': rate_limit,
         'createdAt': now,
         'updatedAt': now
     }
     
-    webhooks_db[webhook_id] = webhook
+    webhooks_db.add(webhook)
     
     return jsonify(webhook), 201
 
+@app.route('/api/v1/webhooks/dead-letters', methods=['GET'])
+def get_dead_letters():
+    """GET /webhooks/dead-letters - Lấy danh sách deliveries đã hết số lần retry"""
+    webhook_id = request.args.get('webhookId')
+    limit = max(1, min(100, request.args.get('limit', 50, type=int)))
+    
+    return jsonify({
+        'data': webhook_outbox.list_dead_letters(webhook_id, limit)
+    })
+
+@app.route('/api/v1/webhooks/dead-letters/replay', methods=['POST'])
+def replay_dead_letters():
+    """POST /webhooks/dead-letters/replay - Gửi lại dead letters (theo ids hoặc webhookId)"""
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(i, int) for i in ids)):
+        return error_response('VALIDATION_ERROR', 'Invalid request body', [
+            {'field': 'ids', 'message': 'ids must be an array of dead letter ids'}
+        ])
+    
+    # Letters của webhook đã bị xóa không được gửi lại
+    replayed, skipped = webhook_outbox.replay_dead_letters(ids, data.get('webhookId'), webhooks_db.__contains__)
+    
+    return jsonify({'replayed': replayed, 'skipped': skipped}), 202
+
+@app.route('/api/v1/webhooks/dead-letters/<int:dead_letter_id>/replay', methods=['POST'])
+def replay_dead_letter(dead_letter_id):
+    """POST /webhooks/dead-letters/{id}/replay - Gửi lại một dead letter"""
+    replayed, skipped = webhook_outbox.replay_dead_letters([dead_letter_id], webhook_exists=webhooks_db.__contains__)
+    if skipped:
+        return error_response('WEBHOOK_NOT_FOUND', 'Webhook of this dead letter no longer exists', status_code=409)
+    if replayed == 0:
+        return error_response('NOT_FOUND', 'Dead letter not found', status_code=404)
+    
+    return jsonify({'replayed': 1}), 202
+
 @app.route('/api/v1/webhooks/<webhook_id>', methods=['GET'])
 def get_webhook_by_id(webhook_id):
-    """GET /webhooks/{webhookId} - Lấy thông tin webhook"""
+    """GET /webhooks/{webhookId} - Lấy thông tin webhook (kèm trạng thái circuit breaker / rate limit)"""
     webhook = webhooks_db.get(webhook_id)
     
     if not webhook:
         return error_response('NOT_FOUND', 'Webhook not found', status_code=404)
     
-    return jsonify(webhook)
+    webhook_with_state = webhook.copy()
+    webhook_with_state['deliveryState'] = delivery_guard.state(webhook_id, webhook.get('rateLimit'))
+    
+    return jsonify(webhook_with_state)
 
 @app.route('/api/v1/webhooks/<webhook_id>', methods=['PUT'])
 def update_webhook(webhook_id):
@@ -480,30 +1408,51 @@ def update_webhook(webhook_id):
                     {'field': 'events', 'message': f'Invalid event: {event}'}
                 ])
     
+    # Validate batch config if provided (null để tắt batching)
+    batch, batch_errors = validate_batch_config(data.get('batch'))
+    if batch_errors:
+        return error_response('VALIDATION_ERROR', 'Invalid batch config', batch_errors)
+    
+    rate_limit, rate_limit_errors = validate_rate_limit_config(data.get('rateLimit'))
+    if rate_limit_errors:
+        return error_response('VALIDATION_ERROR', 'Invalid rate limit config', rate_limit_errors)
+    
     # Update
+    changes = {}
     if 'url' in data:
-        webhook['url'] = data['url']
+        changes['url'] = data['url']
     if 'events' in data:
-        webhook['events'] = data['events']
+        changes['events'] = data['events']
     if 'isActive' in data:
-        webhook['isActive'] = data['isActive']
+        changes['isActive'] = data['isActive']
     if 'description' in data:
-        webhook['description'] = data['description']
+        changes['description'] = data['description']
+    if 'batch' in data:
+        changes['batch'] = batch
+    if 'rateLimit' in data:
+        changes['rateLimit'] = rate_limit
     
-    webhook['updatedAt'] = get_current_time()
-    webhooks_db[webhook_id] = webhook
+    changes['updatedAt'] = get_current_time()
+    try:
+        webhook = webhooks_db.update(webhook_id, changes)
+    except KeyError:
+        # Webhook bị xóa bởi request đồng thời
+        return error_response('NOT_FOUND', 'Webhook not found', status_code=404)
     
     return jsonify(webhook)
 
 @app.route('/api/v1/webhooks/<webhook_id>', methods=['DELETE'])
 def delete_webhook(webhook_id):
     """DELETE /webhooks/{webhookId} - Xóa webhook"""
-    webhook = webhooks_db.get(webhook_id)
-    
-    if not webhook:
+    try:
+        # Deliveries đang chờ (kể cả batch chưa đến hạn) của webhook bị xóa cùng webhook
+        with order_transaction():
+            webhooks_db.delete(webhook_id)
+            webhook_outbox.purge_webhook(webhook_id)
+    except KeyError:
         return error_response('NOT_FOUND', 'Webhook not found', status_code=404)
     
-    del webhooks_db[webhook_id]
+    delivery_guard.forget(webhook_id)
     
     return '', 204
 
@@ -532,17 +1481,13 @@ def test_webhook(webhook_id):
         'X-Webhook-Id': webhook_id
     }
     
+    body = serialize_webhook_payload(test_payload)
     if webhook.get('secret'):
-        headers['X-Webhook-Signature'] = create_webhook_signature(test_payload, webhook['secret'])
+        headers['X-Webhook-Signature'] = create_webhook_signature(body, webhook['secret'])
     
     try:
         start_time = datetime.now()
-        response = requests.post(
-            webhook['url'],
-            json=test_payload,
-            headers=headers,
-            timeout=10
-        )
+        response = webhook_client.post(webhook['url'], body, headers)
         response_time = int((datetime.now() - start_time).total_seconds() * 1000)
         
         return jsonify({
@@ -555,7 +1500,7 @@ def test_webhook(webhook_id):
         return jsonify({
             'success': False,
             'statusCode': None,
-            'responseTime': 10000,
+            'responseTime': int(WEBHOOK_TIMEOUT * 1000),
             'message': 'Webhook request timed out'
         })
     except Exception as e:
@@ -575,7 +1520,12 @@ def health_check():
         'status': 'healthy',
         'timestamp': get_current_time(),
         'ordersCount': len(orders_db),
-        'webhooksCount': len(webhooks_db)
+        'webhooksCount': len(webhooks_db),
+        'webhookDelivery': webhook_dispatcher.stats(),
+        'webhookOutbox': webhook_outbox.stats(),
+        'writeAheadLog': wal.stats() if wal is not None else None,
+        'searchCache': search_cache.stats() if search_cache is not None else None,
+        'orderArchive': order_archive.stats() if order_archive is not None else None
     })
 
 # ============= Create Sample Data =============
@@ -625,7 +1575,7 @@ def create_sample_data():
     for order_data in sample_orders:
         order_id = generate_id('ord')
         now = get_current_time()
-        orders_db[order_id] = {
+        orders_db.add({
             'id': order_id,
             'customerId': order_data['customerId'],
             'items': order_data['items'],
@@ -634,11 +1584,14 @@ def create_sample_data():
             'shippingAddress': order_data.get('shippingAddress'),
             'notes': order_data.get('notes'),
             'createdAt': now,
-            'updatedAt': now
-        }
+            'updatedAt': now,
+            'version': 1
+        })
 
 if __name__ == '__main__':
-    create_sample_data()
+    # Chỉ tạo dữ liệu mẫu khi chưa có dữ liệu khôi phục từ WAL
+    if not len(orders_db):
+        create_sample_data()
     print("\n" + "="*60)
     print("Order Service API started!")
     print("="*60)
@@ -0,0 +1,588 @@
+"""
+Order Archive
+Cold storage cho orders đã đóng (delivered / cancelled): segment files NDJSON nén gzip, bất biến,
+chia theo tháng tạo order. Mỗi segment gồm các blocks nén độc lập, sắp theo createdAt; index của
+segment (bounds, postings theo customerId, bloom filter ids theo block) cho phép đếm mà không đọc
+dữ liệu và chỉ đọc các blocks có thể chứa kết quả
+"""
+
+import base64
+import glob
+import gzip
+import hashlib
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from operator import itemgetter
+
+from order_stats import OrderAggregates, merge_stats
+from order_store import FILTER_PREDICATES
+from search_cache import SearchCache
+
+# Trạng thái cuối của order: chỉ các orders này được archive
+ARCHIVABLE_STATUSES = ('delivered', 'cancelled')
+
+# Bloom filter ~10 bits mỗi key, 7 hàm hash: tỉ lệ false positive khoảng 1%
+BLOOM_BITS_PER_KEY = 10
+BLOOM_HASHES = 7
+
+# Số orders mỗi block (một gzip member, đọc và giải nén độc lập với phần còn lại của segment)
+BLOCK_ORDERS = 128
+
+# Filters mà index của segment trả lời được bằng range (min / max) của field tương ứng
+_RANGE_FILTERS = {
+    'fromDate': ('min_created', False),
+    'toDate': ('max_created', True),
+    'minTotal': ('min_total', False),
+    'maxTotal': ('max_total', True),
+    'since': ('min_updated', False),
+}
+
+
+def _hash(key):
+    """(first, step) cho double hashing, dùng chung cho mọi bloom filters khi tra cùng một key"""
+    digest = hashlib.blake2b(str(key).encode(), digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+def _encode_rows(rows):
+    """Posting list (số thứ tự của orders trong segment) -> base64 của uint32 little-endian"""
+    rows = array('I', rows)
+    if sys.byteorder != 'little':
+        rows.byteswap()
+    return base64.b64encode(rows.tobytes()).decode('ascii')
+
+
+def _decode_rows(data):
+    rows = array('I', base64.b64decode(data))
+    if sys.byteorder != 'little':
+        rows.byteswap()
+    return rows
+
+
+class BloomFilter:
+    """Bloom filter trên bytearray, dùng double hashing từ một digest blake2b"""
+
+    def __init__(self, size, hashes=BLOOM_HASHES, bits=None):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bits if bits is not None else bytearray((size + 7) // 8)
+
+    @classmethod
+    def of(cls, keys, size=None):
+        keys = set(keys)
+        bloom = cls(size or max(64, len(keys) * BLOOM_BITS_PER_KEY))
+        for key in keys:
+            bloom.add(key)
+        return bloom
+
+    def _positions(self, hashed):
+        first, step = hashed
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(_hash(key)):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def has(self, hashed):
+        """Như `key in bloom` với hashed = _hash(key) đã tính sẵn"""
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(hashed))
+
+    def __contains__(self, key):
+        return self.has(_hash(key))
+
+    def to_dict(self):
+        return {'size': self.size, 'hashes': self.hashes, 'bits': base64.b64encode(bytes(self.bits)).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['size'], data['hashes'], bytearray(base64.b64decode(data['bits'])))
+
+
+class Segment:
+    """Index của một segment (file .index.json); dữ liệu (.jsonl.gz) chỉ được đọc theo block khi cần"""
+
+    def __init__(self, path, index):
+        self.path = path
+        self.seq = index['seq']
+        self.partition = index['partition']
+        self.count = index['count']
+        self.min_created, self.max_created = index['minCreatedAt'], index['maxCreatedAt']
+        self.min_total, self.max_total = index['minTotal'], index['maxTotal']
+        self.min_updated = index.get('minUpdatedAt')
+        self.max_updated = index['maxUpdatedAt']
+        self.statuses = set(index['statuses'])
+        self.ids = BloomFilter.from_dict(index['idBloom'])
+        self.aggregates = index['aggregates']
+        # Seqs của các segments mà segment này thay thế (kết quả của compact)
+        self.replaces = index.get('replaces', [])
+        self.blocks = index['blocks']
+        self.block_created = index['blockCreatedAt']
+        self.block_ids = [BloomFilter.from_dict(bloom) for bloom in index['blockIdBlooms']]
+        # customerId -> posting (base64), giải mã khi được tra
+        self.customers = index['customers']
+
+    @property
+    def block_count(self):
+        return len(self.blocks) - 1
+
+    def may_match(self, filters):
+        """False nếu chắc chắn không có order nào của segment khớp filters"""
+        if 'customerId' in filters and filters['customerId'] not in self.customers:
+            return False
+        if 'status' in filters and filters['status'] not in self.statuses:
+            return False
+        if 'fromDate' in filters and self.max_created < filters['fromDate']:
+            return False
+        if 'toDate' in filters and self.min_created > filters['toDate']:
+            return False
+        if 'minTotal' in filters and self.max_total < filters['minTotal']:
+            return False
+        if 'maxTotal' in filters and self.min_total > filters['maxTotal']:
+            return False
+        if 'since' in filters and self.max_updated < filters['since']:
+            return False
+        return True
+
+    def exact_count(self, filters):
+        """
+        Số orders của segment khớp filters nếu index trả lời được (mọi range filter bao trọn
+        segment, còn lại tối đa một filter status hoặc customerId), ngược lại None
+        """
+        if not self.may_match(filters):
+            return 0
+        remaining = []
+        for field, value in filters.items():
+            bound = _RANGE_FILTERS.get(field)
+            if bound is None:
+                remaining.append(field)
+                continue
+            attribute, upper = bound
+            limit = getattr(self, attribute)
+            if limit is None or (limit > value if upper else limit < value):
+                return None
+        if not remaining:
+            return self.count
+        if len(remaining) == 1 and remaining[0] in ('status', 'customerId'):
+            group = self.aggregates[remaining[0]].get(filters[remaining[0]])
+            return group['count'] if group else 0
+        return None
+
+    def block_bounds(self, block):
+        """(min, max) createdAt của block: block sau bắt đầu từ createdAt >= mọi order của block"""
+        high = self.block_created[block + 1] if block + 1 < len(self.block_created) else self.max_created
+        return self.block_created[block], high
+
+    def candidates(self, filters):
+        """
+        [(block, rows)] có thể chứa orders khớp filters; rows là vị trí trong block của các orders
+        của customerId (từ posting), None khi phải xét cả block
+        """
+        if 'customerId' in filters:
+            blocks = {}
+            for row in _decode_rows(self.customers[filters['customerId']]):
+                blocks.setdefault(row // BLOCK_ORDERS, []).append(row % BLOCK_ORDERS)
+            candidates = list(blocks.items())
+        else:
+            candidates = [(block, None) for block in range(self.block_count)]
+        if 'fromDate' in filters or 'toDate' in filters:
+            low, high = filters.get('fromDate'), filters.get('toDate')
+            candidates = [(block, rows) for block, rows in candidates
+                          if (low is None or self.block_bounds(block)[1] >= low)
+                          and (high is None or self.block_bounds(block)[0] <= high)]
+        return candidates
+
+
+def _index_of(seq, partition, orders, blocks, replaces=()):
+    """Index của segment; orders đã sắp theo (createdAt, id), blocks là offsets của các gzip members"""
+    aggregates = OrderAggregates()
+    customers = {}
+    for row, order in enumerate(orders):
+        aggregates.add(order)
+        customers.setdefault(order['customerId'], []).append(row)
+    totals = [order['totalAmount'] for order in orders]
+    updated = [order['updatedAt'] for order in orders]
+    chunks = [orders[start:start + BLOCK_ORDERS] for start in range(0, len(orders), BLOCK_ORDERS)]
+    return {
+        'seq': seq,
+        'partition': partition,
+        'count': len(orders),
+        'minCreatedAt': orders[0]['createdAt'],
+        'maxCreatedAt': orders[-1]['createdAt'],
+        'minTotal': min(totals),
+        'maxTotal': max(totals),
+        'minUpdatedAt': min(updated),
+        'maxUpdatedAt': max(updated),
+        'statuses': sorted({order['status'] for order in orders}),
+        'idBloom': BloomFilter.of(order['id'] for order in orders).to_dict(),
+        'aggregates': aggregates.snapshot(),
+        'blocks': blocks,
+        'blockCreatedAt': [chunk[0]['createdAt'] for chunk in chunks],
+        'blockIdBlooms': [BloomFilter.of((order['id'] for order in chunk), BLOCK_ORDERS * BLOOM_BITS_PER_KEY).to_dict()
+                          for chunk in chunks],
+        'customers': {customer_id: _encode_rows(rows) for customer_id, rows in customers.items()},
+        'replaces': list(replaces),
+    }
+
+
+class OrderArchive:
+    """
+    Segments được ghi một lần (file tạm + fsync + rename, index ghi sau cùng nên segment chỉ
+    hiện ra khi đã durable) và không bao giờ bị sửa; compact() thay nhiều segments nhỏ bằng một
+    segment gộp. Danh sách segments được thay theo kiểu copy-on-write nên đọc không cần lock;
+    các blocks đọc gần nhất được giữ đã giải nén (dạng dòng JSON, parse khi cần)
+    """
+
+    def __init__(self, directory, cache_blocks=256, segment_max_orders=100000, fsync=True):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_blocks = cache_blocks
+        self._segment_max_orders = segment_max_orders
+        self._aggregates = {}
+        # Tăng mỗi khi danh sách segments thay đổi; count() cache theo generation này
+        self._generation = 0
+        self._counts = SearchCache(1024)
+        # Files của các segments đã bị thay bởi compact, xóa ở lượt compact sau (khi không còn reader)
+        self._retired = []
+        self._stats = {'blockReads': 0, 'archived': 0, 'compactions': 0}
+        self._next_seq = 1
+        self._segments = self._load()
+
+    # ----- Files -----
+
+    def _base_path(self, seq, partition):
+        return os.path.join(self.directory, f'orders-{partition}-{seq:08d}')
+
+    def _load(self):
+        """
+        Đọc index của mọi segments. File của segment chưa có index (ghi dở khi crash) và segments
+        đã được một segment gộp thay thế (crash trước khi kịp xóa) bị xóa
+        """
+        segments = []
+        for index_path in glob.glob(os.path.join(self.directory, 'orders-*.index.json')):
+            with open(index_path, encoding='utf-8') as f:
+                index = json.load(f)
+            segments.append(Segment(index_path[:-len('.index.json')] + '.jsonl.gz', index))
+        self._next_seq = max((segment.seq for segment in segments), default=0) + 1
+        replaced = {seq for segment in segments for seq in segment.replaces}
+        segments = [segment for segment in segments if segment.seq not in replaced]
+        published = set()
+        for segment in segments:
+            published.update((segment.path, segment.path[:-len('.jsonl.gz')] + '.index.json'))
+            merge_stats(self._aggregates, segment.aggregates)
+        for path in glob.glob(os.path.join(self.directory, 'orders-*')):
+            if path not in published:
+                os.remove(path)
+        return sorted(segments, key=lambda segment: segment.seq)
+
+    def _write_file(self, path, write):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            write(f)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _sync_directory(self):
+        if self.fsync:
+            # fsync thư mục để các rename được durable
+            fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _write_segment(self, partition, orders, replaces=()):
+        """Ghi segment mới; orders đã sắp theo (createdAt, id)"""
+        seq = self._next_seq
+        self._next_seq += 1
+        base_path = self._base_path(seq, partition)
+        members, blocks = [], [0]
+        for start in range(0, len(orders), BLOCK_ORDERS):
+            lines = ''.join(json.dumps(order, ensure_ascii=False) + '\n'
+                            for order in orders[start:start + BLOCK_ORDERS])
+            members.append(gzip.compress(lines.encode('utf-8')))
+            blocks.append(blocks[-1] + len(members[-1]))
+        index = _index_of(seq, partition, orders, blocks, replaces)
+        self._write_file(base_path + '.jsonl.gz', lambda f: f.writelines(members))
+        self._write_file(base_path + '.index.json',
+                         lambda f: f.write(json.dumps(index, ensure_ascii=False).encode('utf-8')))
+        return Segment(base_path + '.jsonl.gz', index)
+
+    # ----- Writes -----
+
+    def write(self, orders):
+        """
+        Ghi orders vào các segments mới theo tháng tạo (createdAt), trả về sau khi mọi segments
+        đã durable; dùng làm before_delete của OrderStore.delete_many
+        """
+        partitions = {}
+        for order in sorted(orders, key=itemgetter('createdAt', 'id')):
+            partitions.setdefault(order['createdAt'][:7], []).append(order)
+        with self._write_lock:
+            segments = [self._write_segment(partition, chunk) for partition, chunk in partitions.items()]
+            self._sync_directory()
+            with self._lock:
+                for segment in segments:
+                    merge_stats(self._aggregates, segment.aggregates)
+                self._segments = self._segments + segments
+                self._generation += 1
+                self._stats['archived'] += len(orders)
+
+    def compact(self):
+        """
+        Gộp các segments nhỏ hơn segment_max_orders của cùng partition (mỗi lượt archive thêm
+        segments mới cho từng tháng) để số segments không tăng theo số lượt archive. Segment gộp
+        ghi seqs của các segments nó thay thế, nên crash giữa chừng không làm trùng orders.
+        Trả về số segments đã bị thay
+        """
+        with self._write_lock:
+            for path in self._retired:
+                if os.path.exists(path):
+                    os.remove(path)
+            self._retired = []
+            partitions = {}
+            for segment in self._segments:
+                partitions.setdefault(segment.partition, []).append(segment)
+            replaced = 0
+            for partition, segments in sorted(partitions.items()):
+                for group in self._compaction_groups(segments):
+                    self._merge(partition, group)
+                    replaced += len(group)
+            return replaced
+
+    def _compaction_groups(self, segments):
+        """Các nhóm segments liên tiếp (theo seq) gộp được mà không vượt segment_max_orders"""
+        groups, group, size = [], [], 0
+        for segment in segments:
+            if segment.count >= self._segment_max_orders:
+                continue
+            if group and size + segment.count > self._segment_max_orders:
+                groups.append(group)
+                group, size = [], 0
+            group.append(segment)
+            size += segment.count
+        if group:
+            groups.append(group)
+        return [group for group in groups if len(group) > 1]
+
+    def _merge(self, partition, group):
+        orders = {}
+        for segment in group:
+            for block in range(segment.block_count):
+                # Cùng id ở nhiều segments: bản trong segment mới hơn được giữ
+                for line in self._read_lines(segment, block, cache=False):
+                    order = json.loads(line)
+                    orders[order['id']] = order
+        merged = self._write_segment(partition, sorted(orders.values(), key=itemgetter('createdAt', 'id')),
+                                     replaces=[segment.seq for segment in group])
+        self._sync_directory()
+        paths = {segment.path for segment in group}
+        with self._lock:
+            self._segments = sorted([segment for segment in self._segments if segment.path not in paths] + [merged],
+                                    key=lambda segment: segment.seq)
+            for key in [key for key in self._cache if key[0] in paths]:
+                del self._cache[key]
+            self._aggregates = {}
+            for segment in self._segments:
+                merge_stats(self._aggregates, segment.aggregates)
+            self._generation += 1
+            self._stats['compactions'] += 1
+        for path in paths:
+            self._retired.extend((path, path[:-len('.jsonl.gz')] + '.index.json'))
+
+    # ----- Reads -----
+
+    def _read_lines(self, segment, block, cache=True):
+        """Các dòng JSON của block, giữ trong LRU cache"""
+        key = (segment.path, block)
+        if cache:
+            with self._lock:
+                lines = self._cache.get(key)
+                if lines is not None:
+                    self._cache.move_to_end(key)
+                    return lines
+        start, end = segment.blocks[block], segment.blocks[block + 1]
+        with open(segment.path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        # split('\n') thay vì splitlines(): chuỗi JSON có thể chứa U+2028 không bị escape
+        lines = gzip.decompress(data).decode('utf-8').split('\n')
+        if not lines[-1]:
+            lines.pop()
+        with self._lock:
+            self._stats['blockReads'] += 1
+            if cache:
+                self._cache[key] = lines
+                while len(self._cache) > self._cache_blocks:
+                    self._cache.popitem(last=False)
+        return lines
+
+    def _read(self, segment, block, rows=None, cache=True):
+        """Orders của block (chỉ các vị trí trong rows nếu có)"""
+        lines = self._read_lines(segment, block, cache)
+        if rows is not None:
+            lines = [lines[row] for row in rows]
+        return [json.loads(line) for line in lines]
+
+    def _find(self, segment, order_id, hashed):
+        blocks = [block for block, bloom in enumerate(segment.block_ids) if bloom.has(hashed)]
+        for block in blocks:
+            for order in self._read(segment, block):
+                if order['id'] == order_id:
+                    return order
+        return None
+
+    def get(self, order_id):
+        """Order đã archive (bản trong segment mới nhất), None nếu không có"""
+        hashed = _hash(order_id)
+        for segment in reversed(self._segments):
+            if segment.ids.has(hashed):
+                order = self._find(segment, order_id, hashed)
+                if order is not None:
+                    return order
+        return None
+
+    def contains(self, order):
+        """True nếu order (id, createdAt) đã có trong archive; chỉ xét segments chứa createdAt của order"""
+        hashed = _hash(order['id'])
+        created_at = order['createdAt']
+        return any(segment.min_created <= created_at <= segment.max_created and segment.ids.has(hashed)
+                   and self._find(segment, order['id'], hashed) is not None
+                   for segment in self._segments)
+
+    def count(self, filters):
+        """
+        Số orders đã archive khớp filters: từ index của segments khi index trả lời được, chỉ đọc
+        các blocks còn lại. Kết quả được cache đến khi danh sách segments thay đổi
+        """
+        with self._lock:
+            segments, generation = self._segments, self._generation
+        key = frozenset(filters.items())
+        total = self._counts.get(key, generation)
+        if total is not None:
+            return total
+        predicates = [(FILTER_PREDICATES[field], value) for field, value in filters.items()]
+        total = 0
+        for segment in segments:
+            exact = segment.exact_count(filters)
+            if exact is not None:
+                total += exact
+                continue
+            for block, rows in segment.candidates(filters):
+                total += sum(1 for order in self._read(segment, block, rows)
+                             if all(predicate(order, value) for predicate, value in predicates))
+        self._counts.put(key, generation, total)
+        return total
+
+    def search_page(self, filters, sort_by, descending, count, after=None, before=None):
+        """
+        Tối đa count orders đã archive khớp filters (cùng semantics với /orders/search) theo thứ tự
+        (sort_by, id), chỉ gồm orders nằm sau cursor `after` và xếp trước key `before` (vd. key của
+        order thứ count lấy từ orders_db: orders từ đó trở đi không thể vào trang). Blocks được đọc
+        theo bound của sort field (createdAt theo block, totalAmount / status theo segment) và dừng
+        khi các blocks còn lại không thể vào trang
+        """
+        predicates = [(FILTER_PREDICATES[field], value) for field, value in filters.items()]
+        sort_key = itemgetter(sort_by, 'id')
+        select = heapq.nlargest if descending else heapq.nsmallest
+
+        def ahead(key, limit):
+            # key xếp trước limit theo thứ tự của trang
+            return key > limit if descending else key < limit
+
+        candidates = []
+        for segment in self._segments:
+            if not segment.may_match(filters):
+                continue
+            for block, rows in segment.candidates(filters):
+                if sort_by == 'createdAt':
+                    bounds = segment.block_bounds(block)
+                elif sort_by == 'totalAmount':
+                    bounds = (segment.min_total, segment.max_total)
+                else:
+                    bounds = (min(segment.statuses), max(segment.statuses))
+                candidates.append((bounds, segment, block, rows))
+        # Block có bound tốt nhất được đọc trước
+        candidates.sort(key=lambda candidate: candidate[0][1 if descending else 0], reverse=descending)
+
+        results, limit = [], before
+        for bounds, segment, block, rows in candidates:
+            best, worst = (bounds[1], bounds[0]) if descending else bounds
+            if limit is not None and ahead(limit[0], best):
+                # Các blocks còn lại đều có bound kém hơn
+                break
+            if after is not None and ahead(worst, after[0]):
+                continue
+            for order in self._read(segment, block, rows):
+                key = sort_key(order)
+                if after is not None and not ahead(after, key):
+                    continue
+                if limit is not None and not ahead(key, limit):
+                    continue
+                if all(predicate(order, value) for predicate, value in predicates):
+                    results.append(order)
+            if len(results) >= count:
+                results = select(count, results, key=sort_key)
+                kth = sort_key(results[-1])
+                if limit is None or ahead(kth, limit):
+                    limit = kth
+        return select(count, results, key=sort_key)
+
+    def scan(self, filters):
+        """
+        Duyệt orders đã archive khớp filters theo (createdAt, id) tăng dần: trộn các segments (mỗi
+        segment đã sắp theo createdAt), mỗi segment chỉ giữ một block trong bộ nhớ. Blocks đọc ở đây
+        không vào LRU cache để export không đẩy các blocks của search ra khỏi cache
+        """
+        predicates = [(FILTER_PREDICATES[field], value) for field, value in filters.items()]
+
+        def orders_of(segment):
+            for block, rows in segment.candidates(filters):
+                for order in self._read(segment, block, rows, cache=False):
+                    if all(predicate(order, value) for predicate, value in predicates):
+                        yield order
+
+        segments = [segment for segment in self._segments if segment.may_match(filters)]
+        return heapq.merge(*map(orders_of, segments), key=itemgetter('createdAt', 'id'))
+
+    def aggregates(self, dimensions):
+        """Aggregates của orders đã archive, cùng dạng OrderStore.stats()"""
+        with self._lock:
+            return {dimension: dict(self._aggregates.get(dimension, {})) for dimension in dimensions}
+
+    def stats(self):
+        """Metrics cho /health"""
+        segments = self._segments
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cachedBlocks'] = len(self._cache)
+        stats['segments'] = len(segments)
+        stats['orders'] = sum(segment.count for segment in segments)
+        return stats
+
+    # ----- Job -----
+
+    def start_job(self, run, interval):
+        """Start thread gọi run() mỗi `interval` giây"""
+        thread = threading.Thread(target=self._run_job, args=(run, interval), name='order-archive')
+        thread.daemon = True
+        thread.start()
+
+    def _run_job(self, run, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                run()
+            except Exception as e:
+                print(f"Order archival failed: {str(e)}")
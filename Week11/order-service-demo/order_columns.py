@@ -0,0 +1,182 @@
+"""
+Order Columns
+Cột NumPy của totalAmount, createdAt (epoch µs) và mã của customerId / status theo row, để filters
+của /orders/search được đánh giá bằng boolean mask thay vì so sánh từng order trong Python
+"""
+
+import math
+from datetime import datetime, timedelta, timezone
+
+try:
+    import numpy as np
+except ImportError:  # numpy là optional: không có thì store chỉ dùng sorted indexes
+    np = None
+
+HAS_NUMPY = np is not None
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+_ZERO = timedelta(0)
+
+# Số nguyên lớn hơn ngưỡng này không biểu diễn chính xác bằng float64
+_EXACT_INT_MAX = 2 ** 53
+
+# Field so sánh bằng: column lưu mã (int32) của giá trị
+CODED_FIELDS = ('customerId', 'status')
+
+
+def to_epoch(value):
+    """
+    Timestamp dạng get_current_time() (UTC, isoformat) -> epoch µs. Trả về None với dạng khác,
+    vì khi đó thứ tự epoch có thể khác thứ tự string mà filters fromDate / toDate đang dùng
+    """
+    if type(value) is not str:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if moment.utcoffset() != _ZERO or moment.isoformat() != value:
+        return None
+    return (moment - _EPOCH) // _MICROSECOND
+
+
+def from_epoch(value):
+    """Ngược lại của to_epoch: epoch µs -> timestamp dạng get_current_time()"""
+    return (_EPOCH + timedelta(microseconds=value)).isoformat()
+
+
+def _exact_amount(value):
+    return type(value) is float or (type(value) is int and -_EXACT_INT_MAX <= value <= _EXACT_INT_MAX)
+
+
+class OrderColumns:
+    """
+    Mỗi order chiếm một row (row của order đã xóa được dùng lại). Cập nhật qua cùng interface
+    với các index khác của OrderStore; chỉ dùng được khi mọi order có giá trị biểu diễn chính xác
+    """
+
+    fields = {'createdAt', 'totalAmount', *CODED_FIELDS}
+
+    def __init__(self, capacity=1024):
+        self._columns = {
+            'createdAt': np.zeros(capacity, dtype=np.int64),
+            'totalAmount': np.zeros(capacity, dtype=np.float64),
+            **{field: np.zeros(capacity, dtype=np.int32) for field in CODED_FIELDS},
+        }
+        self._codes = {field: {} for field in CODED_FIELDS}
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._ids = []
+        self._rows = {}
+        self._free = []
+        self._inexact = set()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def exact(self):
+        return not self._inexact
+
+    def _allocate(self):
+        if self._free:
+            return self._free.pop()
+        row = len(self._ids)
+        if row == len(self._alive):
+            capacity = 2 * row
+            for field, column in self._columns.items():
+                grown = np.zeros(capacity, dtype=column.dtype)
+                grown[:row] = column
+                self._columns[field] = grown
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:row] = self._alive
+            self._alive = alive
+        self._ids.append(None)
+        return row
+
+    def check(self, order):
+        order['createdAt']
+        amount = order['totalAmount']
+        if isinstance(amount, float) and not math.isfinite(amount):
+            raise ValueError('totalAmount must be a finite number')
+        for field in CODED_FIELDS:
+            hash(order[field])
+
+    def insert(self, order):
+        order_id = order['id']
+        # OrderRecord đã lưu createdAt dạng epoch µs: dùng luôn thay vì decode rồi parse lại
+        created = getattr(order, 'createdAt', None)
+        if type(created) is not int:
+            created = to_epoch(order['createdAt'])
+        amount = order['totalAmount']
+        row = self._allocate()
+        self._rows[order_id] = row
+        self._ids[row] = order_id
+        self._alive[row] = True
+        if created is None or not _exact_amount(amount):
+            self._inexact.add(order_id)
+            created, amount = 0, 0
+        self._columns['createdAt'][row] = created
+        self._columns['totalAmount'][row] = amount
+        for field in CODED_FIELDS:
+            codes = self._codes[field]
+            self._columns[field][row] = codes.setdefault(order[field], len(codes))
+
+    def insert_many(self, orders):
+        for order in orders:
+            self.insert(order)
+
+    def remove(self, order):
+        row = self._rows.pop(order['id'], None)
+        if row is None:
+            return
+        self._alive[row] = False
+        self._ids[row] = None
+        self._free.append(row)
+        self._inexact.discard(order['id'])
+
+    def remove_many(self, orders):
+        for order in orders:
+            self.remove(order)
+
+    def rows_of(self, order_ids):
+        return np.fromiter(map(self._rows.__getitem__, order_ids), dtype=np.intp, count=len(order_ids))
+
+    def ids_of(self, rows):
+        ids = self._ids
+        return [ids[row] for row in rows.tolist()]
+
+    def select(self, bounds, equals, rows=None):
+        """
+        Rows thỏa mọi bounds {field: (low, high)} (None = không giới hạn) và equals {field: value},
+        trong `rows` nếu có (candidate set của hash / text index), ngược lại trên mọi rows còn sống
+        """
+        if rows is None:
+            size = len(self._ids)
+            mask = self._alive[:size].copy()
+            column_of = lambda field: self._columns[field][:size]
+        else:
+            mask = np.ones(len(rows), dtype=bool)
+            column_of = lambda field: self._columns[field][rows]
+        for field, value in equals.items():
+            code = self._codes[field].get(value)
+            if code is None:
+                return np.empty(0, dtype=np.intp)
+            mask &= column_of(field) == code
+        for field, (low, high) in bounds.items():
+            column = column_of(field)
+            if low is not None:
+                mask &= column >= low
+            if high is not None:
+                mask &= column <= high
+        return np.flatnonzero(mask) if rows is None else rows[mask]
+
+    def top(self, rows, field, descending, k):
+        """Ids của k rows đầu theo (field, id); chỉ sort trong Python các rows còn lại sau partition"""
+        values = self._columns[field][rows]
+        if len(rows) > k > 0:
+            keys = -values if descending else values
+            threshold = np.partition(keys, k - 1)[k - 1]
+            keep = keys <= threshold
+            rows, values = rows[keep], values[keep]
+        ranked = sorted(zip(values.tolist(), self.ids_of(rows)), reverse=descending)
+        return [order_id for _, order_id in ranked[:k]]
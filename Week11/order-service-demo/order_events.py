@@ -0,0 +1,57 @@
+"""
+Order Events
+Change feed của các order.* events cho SSE: id tăng đơn điệu, resume theo Last-Event-ID
+"""
+
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+
+class EventFeed:
+    """
+    Ring buffer trong bộ nhớ giữ `capacity` events gần nhất. Event là tuple
+    (id, event_type, data) với data là JSON đã serialize sẵn, dùng chung cho mọi client.
+    Events không sống qua restart nên ids của mỗi lần chạy bắt đầu từ thời điểm start (µs từ
+    epoch): lớn hơn mọi id của các lần chạy trước, nên client resume bằng id cũ nhận resync
+    thay vì bỏ sót events hoặc nhận events mới dưới ids đã thấy
+    """
+
+    def __init__(self, capacity=10000, first_id=None):
+        self._events = deque(maxlen=capacity)
+        self._last_id = (time.time_ns() // 1000 if first_id is None else first_id) - 1
+        self._cond = threading.Condition()
+
+    def publish(self, events):
+        """Thêm các events (event_type, data), trả về id của event cuối"""
+        with self._cond:
+            for event_type, data in events:
+                self._last_id += 1
+                self._events.append((self._last_id, event_type, data))
+            self._cond.notify_all()
+            return self._last_id
+
+    def last_id(self):
+        return self._last_id
+
+    def read_after(self, last_id, limit=100):
+        """
+        Trả về (events sau last_id, cursor mới, liên tục hay không). Nếu last_id đã bị đẩy khỏi
+        buffer, thuộc lần chạy trước (nhỏ hơn id đầu tiên của lần chạy này) hoặc lớn hơn id hiện
+        tại thì đọc lại từ event cũ nhất còn giữ
+        """
+        with self._cond:
+            oldest = self._events[0][0] if self._events else self._last_id + 1
+            complete = oldest - 1 <= last_id <= self._last_id
+            start = last_id - oldest + 1 if complete else 0
+            events = list(islice(self._events, start, start + limit))
+            if events:
+                return events, events[-1][0], complete
+            return events, last_id if complete else self._last_id, complete
+
+    def wait(self, last_id, timeout):
+        """Chờ đến khi có event mới hơn last_id (tối đa timeout giây)"""
+        with self._cond:
+            if self._last_id <= last_id:
+                self._cond.wait(timeout)
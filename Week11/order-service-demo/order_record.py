@@ -0,0 +1,243 @@
+"""
+Order Record
+Biểu diễn gọn của order bên trong OrderStore, chỉ chuyển về dict (JSON shape) khi order rời store
+"""
+
+import sys
+import threading
+from itertools import chain
+
+from order_columns import from_epoch, to_epoch
+
+# Thứ tự field khi chuyển về dict (giống build_order)
+ORDER_FIELDS = (
+    'id', 'customerId', 'items', 'totalAmount', 'status', 'shippingAddress',
+    'notes', 'createdAt', 'updatedAt', 'version'
+)
+
+# Field có ít giá trị khác nhau: mọi order dùng chung một object string
+INTERNED_FIELDS = {'customerId', 'productId', 'productName', 'city', 'district', 'country'}
+
+# Field số thường lặp lại (giá theo catalog): dùng chung object qua bảng có giới hạn
+SHARED_NUMBER_FIELDS = {'unitPrice', 'totalAmount'}
+SHARED_NUMBERS_MAX = 65536
+
+# Giới hạn số shape (tập keys) của items / shippingAddress được dùng chung
+KEY_SHAPES_MAX = 1024
+
+# Giới hạn số giá trị status được lưu dưới dạng mã
+STATUS_CODES_MAX = 256
+
+_MISSING = object()
+_FIELD_SET = frozenset(ORDER_FIELDS)
+_key_shapes = {}
+_numbers = {}
+_statuses = []
+_status_codes = {}
+_status_lock = threading.Lock()
+
+
+def _intern(field, value):
+    if type(value) is str:
+        return sys.intern(value) if field in INTERNED_FIELDS else value
+    if field in SHARED_NUMBER_FIELDS and type(value) in (int, float):
+        shared = _numbers.get(value)
+        if shared is None:
+            if len(_numbers) >= SHARED_NUMBERS_MAX:
+                return value
+            shared = _numbers.setdefault(value, value)
+        return shared if type(shared) is type(value) else value
+    return value
+
+
+def pack(mapping):
+    """dict -> tuple (keys, *values); tuple keys được dùng chung giữa các dict cùng shape"""
+    keys = tuple(mapping)
+    shared = _key_shapes.get(keys)
+    if shared is None and len(_key_shapes) < KEY_SHAPES_MAX:
+        shared = _key_shapes.setdefault(keys, keys)
+    return (shared or keys, *map(_intern, keys, mapping.values()))
+
+
+def unpack(packed):
+    return dict(zip(packed[0], packed[1:]))
+
+
+# JSON không có tuple nên giá trị tuple luôn là dạng đã pack
+def _pack_items(items):
+    """
+    Items cùng shape (trường hợp thường gặp) -> một tuple phẳng (keys, *values item 1, *values item 2...),
+    ngược lại tuple các items đã pack
+    """
+    if type(items) is not list or not all(type(item) is dict for item in items):
+        return items
+    packed = list(map(pack, items))
+    keys = packed[0][0] if packed else None
+    if keys and all(item[0] == keys for item in packed):
+        return (keys, *chain.from_iterable(item[1:] for item in packed))
+    return tuple(packed)
+
+
+def _unpack_items(items):
+    if type(items) is not tuple:
+        return items
+    keys = items[0] if items else None
+    if keys and type(keys[0]) is str:
+        size = len(keys)
+        return [dict(zip(keys, items[start:start + size])) for start in range(1, len(items), size)]
+    return list(map(unpack, items))
+
+
+def _pack_address(address):
+    return pack(address) if type(address) is dict else address
+
+
+def _unpack_address(address):
+    return unpack(address) if type(address) is tuple else address
+
+
+# Timestamp dạng get_current_time() lưu thành epoch µs (int), status thành mã trong _statuses;
+# giá trị không mã hóa được giữ nguyên (string) hoặc bọc trong tuple (kiểu khác) để không nhầm với mã
+def _encode_time(value):
+    epoch = to_epoch(value)
+    if epoch is not None:
+        return epoch
+    return value if type(value) is str else (value,)
+
+
+def decode_time(value):
+    """Giá trị createdAt / updatedAt đã lưu trong record -> timestamp gốc"""
+    kind = type(value)
+    if kind is int:
+        return from_epoch(value)
+    return value[0] if kind is tuple else value
+
+
+def _encode_status(value):
+    if type(value) is not str:
+        return (value,)
+    code = _status_codes.get(value)
+    if code is None:
+        with _status_lock:
+            code = _status_codes.get(value)
+            if code is None:
+                if len(_statuses) >= STATUS_CODES_MAX:
+                    return value
+                code = _status_codes[value] = len(_statuses)
+                _statuses.append(sys.intern(value))
+    return code
+
+
+def _decode_status(value):
+    kind = type(value)
+    if kind is int:
+        return _statuses[value]
+    return value[0] if kind is tuple else value
+
+
+_PACKERS = {
+    'items': _pack_items,
+    'shippingAddress': _pack_address,
+    'status': _encode_status,
+    'createdAt': _encode_time,
+    'updatedAt': _encode_time,
+}
+_UNPACKERS = {
+    'items': _unpack_items,
+    'shippingAddress': _unpack_address,
+    'status': _decode_status,
+    'createdAt': decode_time,
+    'updatedAt': decode_time,
+}
+_PLAIN_FIELDS = _FIELD_SET - _UNPACKERS.keys()
+
+
+class OrderRecord:
+    """
+    Slotted record thay cho dict lồng nhau: items / shippingAddress lưu dạng tuple với keys dùng chung,
+    createdAt / updatedAt dạng epoch µs, status dạng mã; field thiếu để trống slot, field lạ (không có trong ORDER_FIELDS) giữ trong `_extra`.
+    Hỗ trợ record[field] / record.get(field) trả về giá trị dạng JSON cho indexes và predicates
+    """
+
+    __slots__ = ORDER_FIELDS + ('_extra',)
+
+    @classmethod
+    def from_dict(cls, order):
+        record = cls()
+        record._extra = None
+        if order.keys() == _FIELD_SET:
+            # Đường nhanh: order đủ field chuẩn (build_order)
+            record.id = order['id']
+            record.customerId = _intern('customerId', order['customerId'])
+            record.items = _pack_items(order['items'])
+            record.totalAmount = _intern('totalAmount', order['totalAmount'])
+            record.status = _encode_status(order['status'])
+            record.shippingAddress = _pack_address(order['shippingAddress'])
+            record.notes = order['notes']
+            record.createdAt = _encode_time(order['createdAt'])
+            record.version = order['version']
+            # Order mới tạo có updatedAt == createdAt: dùng chung một giá trị
+            updated = order['updatedAt']
+            record.updatedAt = record.createdAt if updated == order['createdAt'] else _encode_time(updated)
+            return record
+        for field, value in order.items():
+            if field in _FIELD_SET:
+                packer = _PACKERS.get(field)
+                setattr(record, field, packer(value) if packer else _intern(field, value))
+            else:
+                if record._extra is None:
+                    record._extra = {}
+                record._extra[field] = value
+        # Order mới tạo có updatedAt == createdAt: dùng chung một giá trị
+        if 'createdAt' in order and order.get('updatedAt', _MISSING) == order['createdAt']:
+            record.updatedAt = record.createdAt
+        return record
+
+    def get(self, field, default=None):
+        if field in _FIELD_SET:
+            value = getattr(self, field, _MISSING)
+        else:
+            value = self._extra.get(field, _MISSING) if self._extra else _MISSING
+        if value is _MISSING:
+            return default
+        unpacker = _UNPACKERS.get(field)
+        return unpacker(value) if unpacker else value
+
+    def __getitem__(self, field):
+        if field in _PLAIN_FIELDS:
+            # Đường nhanh cho indexes / predicates
+            try:
+                return getattr(self, field)
+            except AttributeError:
+                raise KeyError(field) from None
+        value = self.get(field, _MISSING)
+        if value is _MISSING:
+            raise KeyError(field)
+        return value
+
+    def to_dict(self):
+        try:
+            created = decode_time(self.createdAt)
+            order = {
+                'id': self.id,
+                'customerId': self.customerId,
+                'items': _unpack_items(self.items),
+                'totalAmount': self.totalAmount,
+                'status': _decode_status(self.status),
+                'shippingAddress': _unpack_address(self.shippingAddress),
+                'notes': self.notes,
+                'createdAt': created,
+                'updatedAt': created if self.updatedAt is self.createdAt else decode_time(self.updatedAt),
+                'version': self.version,
+            }
+        except AttributeError:
+            # Thiếu field (vd. order cũ chưa có version): bỏ qua field đó
+            order = {}
+            for field in ORDER_FIELDS:
+                value = getattr(self, field, _MISSING)
+                if value is not _MISSING:
+                    unpacker = _UNPACKERS.get(field)
+                    order[field] = unpacker(value) if unpacker else value
+        if self._extra:
+            order.update(self._extra)
+        return order
@@ -0,0 +1,174 @@
+"""
+Order Stats
+Aggregates (count, sum, min, max của totalAmount) được cập nhật mỗi khi order thay đổi,
+nhóm theo status, customerId và ngày tạo
+"""
+
+from heapq import heapify, heappop, heappush
+
+# Chiều nhóm -> hàm lấy group key từ order
+DIMENSIONS = {
+    # str(): một status lạ (vd. null trong dữ liệu cũ) không làm groups mất khả năng sort khi trả về JSON
+    'status': lambda order: str(order['status']),
+    'customerId': lambda order: order['customerId'],
+    'day': lambda order: order['createdAt'][:10],
+}
+
+# Field của order mà group key của từng chiều phụ thuộc
+DIMENSION_FIELDS = {'status': 'status', 'customerId': 'customerId', 'day': 'createdAt'}
+
+# Field của order làm thay đổi aggregates khi được update
+AGGREGATE_FIELDS = {'status', 'customerId', 'createdAt', 'totalAmount'}
+
+
+def _round(value):
+    return round(value, 2) if isinstance(value, float) else value
+
+
+def summarize(count, total, minimum, maximum):
+    return {
+        'count': count,
+        'sum': _round(total),
+        'min': minimum,
+        'max': maximum,
+        'avg': _round(total / count) if count else None
+    }
+
+
+def merge_groups(groups):
+    """Gộp nhiều groups thành tổng (O(số groups))"""
+    groups = list(groups)
+    if not groups:
+        return summarize(0, 0, None, None)
+    return summarize(
+        sum(group['count'] for group in groups),
+        sum(group['sum'] for group in groups),
+        min(group['min'] for group in groups),
+        max(group['max'] for group in groups)
+    )
+
+
+def merge_stats(target, snapshot):
+    """Gộp snapshot {dimension: {groupKey: stats}} vào target (vd. orders trong store + archive)"""
+    for dimension, groups in snapshot.items():
+        merged = target.setdefault(dimension, {})
+        for key, group in groups.items():
+            merged[key] = merge_groups([merged[key], group]) if key in merged else group
+    return target
+
+
+def _prune(heap, removed):
+    """Bỏ khỏi đỉnh heap các amounts đã bị xóa"""
+    while heap and removed.get(heap[0]):
+        removed[heap[0]] -= 1
+        if not removed[heap[0]]:
+            del removed[heap[0]]
+        heappop(heap)
+
+
+def _compact(heap, removed):
+    """Dựng lại heap chỉ với các amounts còn lại"""
+    live = []
+    for amount in heap:
+        if removed.get(amount):
+            removed[amount] -= 1
+        else:
+            live.append(amount)
+    removed.clear()
+    heapify(live)
+    heap[:] = live
+
+
+class GroupStats:
+    """
+    Aggregates của một group. min/max đúng cả khi xóa: amounts nằm trong một min-heap và một
+    max-heap, amount bị xóa chỉ được ghi lại (lazy deletion) và bị bỏ khi lên tới đỉnh heap
+    """
+
+    __slots__ = ('count', 'total', '_low', '_high', '_removed_low', '_removed_high')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self._low = []
+        self._high = []
+        self._removed_low = {}
+        self._removed_high = {}
+
+    def add(self, amount, negated):
+        """negated = -amount, tính một lần và dùng chung cho max-heap của mọi chiều"""
+        self.count += 1
+        self.total += amount
+        heappush(self._low, amount)
+        heappush(self._high, negated)
+
+    def remove(self, amount):
+        self.count -= 1
+        self.total -= amount
+        self._removed_low[amount] = self._removed_low.get(amount, 0) + 1
+        self._removed_high[-amount] = self._removed_high.get(-amount, 0) + 1
+        _prune(self._low, self._removed_low)
+        _prune(self._high, self._removed_high)
+        # Amounts đã xóa nằm giữa heap: dựng lại khi chiếm quá nửa (amortized O(1) mỗi lần xóa)
+        if len(self._low) > 2 * self.count + 16:
+            _compact(self._low, self._removed_low)
+            _compact(self._high, self._removed_high)
+
+    def to_dict(self):
+        return summarize(self.count, self.total, self._low[0], -self._high[0])
+
+
+class OrderAggregates:
+    """Aggregates theo từng chiều trong DIMENSIONS; caller giữ lock của store khi cập nhật"""
+
+    def __init__(self):
+        self._groups = {dimension: {} for dimension in DIMENSIONS}
+
+    def check(self, order):
+        """Lỗi nếu order không thể được thêm vào aggregates (group key không hashable, amount không phải số)"""
+        for key_of in DIMENSIONS.values():
+            hash(key_of(order))
+        if not isinstance(order['totalAmount'], (int, float)):
+            raise TypeError('totalAmount must be a number')
+
+    def add(self, order, dimensions=DIMENSIONS):
+        amount = order['totalAmount']
+        negated = -amount
+        for dimension in dimensions:
+            groups = self._groups[dimension]
+            key = DIMENSIONS[dimension](order)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = GroupStats()
+            group.add(amount, negated)
+
+    def remove(self, order, dimensions=DIMENSIONS):
+        for dimension in dimensions:
+            groups = self._groups[dimension]
+            key = DIMENSIONS[dimension](order)
+            group = groups.get(key)
+            if group is None:
+                continue
+            group.remove(order['totalAmount'])
+            if not group.count:
+                del groups[key]
+
+    def replace(self, previous, order, fields):
+        """
+        Như remove(previous) rồi add(order) sau khi update các fields, nhưng chỉ với các chiều có
+        group key phụ thuộc fields (mọi chiều nếu totalAmount thay đổi)
+        """
+        if 'totalAmount' in fields:
+            dimensions = DIMENSIONS
+        else:
+            dimensions = [dimension for dimension, field in DIMENSION_FIELDS.items() if field in fields]
+        if dimensions:
+            self.remove(previous, dimensions)
+            self.add(order, dimensions)
+
+    def snapshot(self, dimensions=DIMENSIONS):
+        """{dimension: {groupKey: stats}} cho các chiều được yêu cầu"""
+        return {
+            dimension: {key: group.to_dict() for key, group in self._groups[dimension].items()}
+            for dimension in dimensions
+        }
@@ -0,0 +1,865 @@
+"""
+Order Store
+In-memory store cho orders, tự duy trì các index khi create/update/delete
+"""
+
+import heapq
+import math
+import threading
+from bisect import bisect_left, bisect_right
+from contextlib import ExitStack, contextmanager
+from itertools import islice
+from operator import attrgetter, itemgetter
+
+from order_columns import CODED_FIELDS, HAS_NUMPY, OrderColumns, to_epoch
+from order_record import OrderRecord, decode_time
+from order_stats import DIMENSIONS, OrderAggregates
+from text_index import TEXT_FIELDS, TextIndex, add_id, add_ids, discard_id, discard_ids, matches, query_terms
+
+_first = itemgetter(0)
+_to_dict = OrderRecord.to_dict
+
+# Sort key theo giá trị đã lưu trong record (createdAt: epoch µs), không phải decode từng record
+_STORED_SORT_KEYS = {'createdAt': attrgetter('createdAt', 'id'), 'totalAmount': attrgetter('totalAmount', 'id')}
+
+
+def _top(records, sort_by, descending, count):
+    """count records đầu tiên theo (sort_by, id)"""
+    select = heapq.nlargest if descending else heapq.nsmallest
+    stored_key = _STORED_SORT_KEYS.get(sort_by)
+    if stored_key is not None:
+        try:
+            return select(count, records, key=stored_key)
+        except TypeError:
+            # Có giá trị không mã hóa được (thứ tự chỉ đúng sau khi decode)
+            pass
+    return select(count, records, key=itemgetter(sort_by, 'id'))
+
+
+def _query_key(filters):
+    """Filters dạng hashable, không phụ thuộc thứ tự; q được thay bằng tập terms của nó"""
+    return frozenset((field, query_terms(value) if field == 'q' else value) for field, value in filters.items())
+
+# Field được index có thứ tự -> cặp filter (cận dưới, cận trên) tương ứng
+RANGE_FILTERS = {
+    'createdAt': ('fromDate', 'toDate'),
+    'totalAmount': ('minTotal', 'maxTotal'),
+}
+
+# Candidate set lớn hơn ngưỡng này thì duyệt theo sort index thay vì sort candidates
+SORT_CANDIDATES_MAX = 1000
+
+# Range filters được đánh giá bằng NumPy columns khi plan tốt nhất có nhiều hơn chừng này rows
+COLUMN_SCAN_MIN = 1000
+
+# Chỉ lấy rows từ candidate set của hash / text index khi set nhỏ hơn 1/COLUMN_SET_RATIO số orders
+# (tra row từng id trong Python), ngược lại mask toàn bộ columns
+COLUMN_SET_RATIO = 64
+
+# Giá trị của filter range -> key trong NumPy column
+COLUMN_ENCODERS = {
+    'createdAt': to_epoch,
+    'totalAmount': float,
+}
+
+# Số orders đọc mỗi lần (trong một lượt giữ _index_lock) khi duyệt theo sort index: scan toàn bộ
+# store (export), search_page và search_after trên candidate set lớn
+SCAN_CHUNK_SIZE = 500
+
+# Insert nhiều keys hơn ngưỡng này thì extend + sort thay vì insort từng key
+BULK_INSERT_MIN = 16
+
+# update_many cập nhật index theo từng chunk chừng này orders, nhả _index_lock giữa các chunks
+# để một lô lớn không chặn reads / writes khác trong suốt thời gian re-index
+UPDATE_CHUNK_SIZE = 1000
+
+# Predicate cho từng filter của /orders/search
+FILTER_PREDICATES = {
+    'customerId': lambda order, value: order['customerId'] == value,
+    'status': lambda order, value: order['status'] == value,
+    'fromDate': lambda order, value: order['createdAt'] >= value,
+    'toDate': lambda order, value: order['createdAt'] <= value,
+    'minTotal': lambda order, value: order['totalAmount'] >= value,
+    'maxTotal': lambda order, value: order['totalAmount'] <= value,
+    'since': lambda order, value: order['updatedAt'] >= value,
+    'q': matches,
+}
+
+# Field của order mà mỗi filter phụ thuộc: update chỉ các field khác không làm cũ kết quả search đã cache
+FILTER_FIELDS = {
+    'customerId': ('customerId',),
+    'status': ('status',),
+    'fromDate': ('createdAt',),
+    'toDate': ('createdAt',),
+    'minTotal': ('totalAmount',),
+    'maxTotal': ('totalAmount',),
+    'since': ('updatedAt',),
+    'q': tuple(TEXT_FIELDS),
+}
+
+
+class PreconditionFailed(Exception):
+    """Order hiện tại không thỏa precondition của update (vd. If-Match không khớp version)"""
+
+
+class SortedIndex:
+    """
+    Index sắp xếp theo (field, order_id), cập nhật bằng bisect. Values và ids nằm trong hai list
+    song song thay vì một tuple cho mỗi key. Với field mà OrderRecord lưu dạng mã hóa (createdAt:
+    epoch µs, xem order_record.py), index giữ chính giá trị đã mã hóa của record: thứ tự các mã trùng
+    thứ tự giá trị gốc nên chỉ phải decode khi so sánh với giá trị không mã hóa được
+    """
+
+    def __init__(self, field, encode=None, decode=None):
+        self.field = field
+        self.fields = {field}
+        self._encode = encode
+        self._decode = decode
+        self._values = []
+        self._ids = []
+        # Số values không ở dạng mã hóa (int): khác 0 thì mọi so sánh đi qua decode
+        self._uncoded = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _stored(self, order):
+        return getattr(order, self.field) if self._decode else order[self.field]
+
+    def _coded(self, stored):
+        return self._decode is None or type(stored) is int
+
+    def _encoded(self, value):
+        """Dạng mã hóa của giá trị gốc value (bound / cursor); None nếu không mã hóa được"""
+        return value if self._encode is None else self._encode(value)
+
+    def _equal_range(self, value, stored=None):
+        """Vị trí [start, stop) của các values bằng giá trị gốc value (stored: dạng đã mã hóa nếu có)"""
+        values = self._values
+        if stored is not None and not self._uncoded:
+            return bisect_left(values, stored), bisect_right(values, stored)
+        return bisect_left(values, value, key=self._decode), bisect_right(values, value, key=self._decode)
+
+    def _position(self, order):
+        """(vị trí của key của order, value đã lưu, value có ở dạng mã hóa không)"""
+        stored = self._stored(order)
+        coded = self._coded(stored)
+        if coded and not self._uncoded:
+            start, stop = self._equal_range(None, stored)
+        else:
+            start, stop = self._equal_range(order[self.field])
+        return bisect_left(self._ids, order['id'], start, stop), stored, coded
+
+    def check(self, order):
+        """
+        Lỗi (KeyError / TypeError / ValueError) nếu key của order không so sánh được với các keys hiện
+        có; NaN không có thứ tự nên bisect không tìm lại được key để xóa
+        """
+        value = order[self.field]
+        if isinstance(value, float) and not math.isfinite(value):
+            raise ValueError(f'{self.field} must be a finite number')
+        if self._values:
+            first = self._values[0]
+            (self._decode(first) if self._decode else first) < value
+
+    def insert(self, order):
+        i, stored, coded = self._position(order)
+        self._values.insert(i, stored)
+        self._ids.insert(i, order['id'])
+        if not coded:
+            self._uncoded += 1
+
+    def insert_many(self, orders):
+        if len(orders) < BULK_INSERT_MIN:
+            for order in orders:
+                self.insert(order)
+            return
+        # Timsort tận dụng các đoạn đã sắp xếp sẵn nên gần như tuyến tính
+        keys = list(zip(self._values, self._ids))
+        for order in orders:
+            stored = self._stored(order)
+            keys.append((stored, order['id']))
+            if not self._coded(stored):
+                self._uncoded += 1
+        if self._uncoded:
+            decode = self._decode
+            keys.sort(key=lambda key: (decode(key[0]), key[1]))
+        else:
+            keys.sort()
+        self._values = [value for value, _ in keys]
+        self._ids = [order_id for _, order_id in keys]
+
+    def remove(self, order):
+        i, _, coded = self._position(order)
+        if i < len(self._ids) and self._ids[i] == order['id']:
+            del self._values[i]
+            del self._ids[i]
+            if not coded:
+                self._uncoded -= 1
+
+    def remove_many(self, orders):
+        if len(orders) < BULK_INSERT_MIN:
+            for order in orders:
+                self.remove(order)
+            return
+        # Một lượt lọc O(n) thay vì xóa từng key (mỗi id chỉ có một key trong index)
+        removed = {order['id'] for order in orders}
+        kept = [i for i, order_id in enumerate(self._ids) if order_id not in removed]
+        self._values = [self._values[i] for i in kept]
+        self._ids = [self._ids[i] for i in kept]
+        self._uncoded = sum(not self._coded(value) for value in self._values) if self._uncoded else 0
+
+    def ids(self, start, stop, reverse=False):
+        """Lấy order ids trong khoảng vị trí [start, stop) theo thứ tự index"""
+        if reverse:
+            n = len(self._ids)
+            start, stop = max(0, n - stop), max(0, n - start)
+            return self._ids[start:stop][::-1]
+        return self._ids[start:stop]
+
+    def key_range(self, low=None, high=None):
+        """(giá trị nhỏ nhất, lớn nhất) của các keys trong [low, high]; None nếu không có key nào"""
+        start, stop = self.range_bounds(low, high)
+        if start >= stop:
+            return None
+        first, last = self._values[start], self._values[stop - 1]
+        if self._decode:
+            return self._decode(first), self._decode(last)
+        return first, last
+
+    def range_bounds(self, low=None, high=None):
+        """Vị trí [start, stop) của các key nằm trong [low, high]"""
+        start = 0 if low is None else self._equal_range(low, self._encoded(low))[0]
+        stop = len(self._ids) if high is None else self._equal_range(high, self._encoded(high))[1]
+        return start, max(start, stop)
+
+    def iter_ids(self, low=None, high=None, after=None, reverse=False):
+        """Duyệt order ids theo thứ tự index, bắt đầu ngay sau key `after` = (value, id)"""
+        start, stop = self.range_bounds(low, high)
+        if after is not None:
+            value, order_id = after
+            equal_start, equal_stop = self._equal_range(value, self._encoded(value))
+            if reverse:
+                stop = min(stop, bisect_left(self._ids, order_id, equal_start, equal_stop))
+            else:
+                start = max(start, bisect_right(self._ids, order_id, equal_start, equal_stop))
+        positions = range(stop - 1, start - 1, -1) if reverse else range(start, stop)
+        ids = self._ids
+        for i in positions:
+            yield ids[i]
+
+
+class HashIndex:
+    """Index value -> posting list (order ids đã sắp xếp) cho các field so sánh bằng"""
+
+    def __init__(self, field):
+        self.field = field
+        self.fields = {field}
+        self._buckets = {}
+
+    def check(self, order):
+        hash(order[self.field])
+
+    def insert(self, order):
+        add_id(self._buckets.setdefault(order[self.field], []), order['id'])
+
+    def _group(self, orders):
+        groups = {}
+        for order in orders:
+            groups.setdefault(order[self.field], []).append(order['id'])
+        return groups
+
+    def insert_many(self, orders):
+        # Mỗi bucket được ghép với các ids mới một lần thay vì insort từng id
+        for value, order_ids in self._group(orders).items():
+            add_ids(self._buckets.setdefault(value, []), order_ids)
+
+    def remove(self, order):
+        bucket = self._buckets.get(order[self.field])
+        if bucket is not None:
+            discard_id(bucket, order['id'])
+            if not bucket:
+                del self._buckets[order[self.field]]
+
+    def remove_many(self, orders):
+        for value, order_ids in self._group(orders).items():
+            bucket = self._buckets.get(value)
+            if bucket is not None:
+                discard_ids(bucket, order_ids)
+                if not bucket:
+                    del self._buckets[value]
+
+    def count(self, value):
+        return len(self._buckets.get(value, ()))
+
+    def ids(self, value):
+        return self._buckets.get(value, ())
+
+
+class _Shard:
+    """Một phần của store: các orders có id hash vào shard này và lock ghi riêng"""
+
+    __slots__ = ('orders', 'lock')
+
+    def __init__(self):
+        self.orders = {}
+        self.lock = threading.RLock()
+
+
+class OrderStore:
+    """
+    Lưu orders theo id và tự duy trì các index phục vụ list/search.
+
+    Orders được chia vào các shards theo id, mỗi shard có lock ghi riêng nên writes vào
+    các shards khác nhau không chặn nhau. Order đã lưu không bao giờ bị sửa tại chỗ
+    (copy-on-write): update tạo version mới rồi thay reference, nên get() không cần lock
+    và mọi order trả ra (kể cả payload webhook) là snapshot nhất quán.
+    Bên trong store mỗi order là một OrderRecord gọn; order chỉ được chuyển về dict khi
+    trả ra ngoài (get / page / search / scan...).
+    `_index_lock` chỉ bao đoạn ngắn thay reference + cập nhật index. Các truy vấn nhiều
+    orders (page/search/scan) chỉ giữ nó trong lúc chụp candidate records từ index (records
+    bất biến nên snapshot này nhất quán); kiểm tra predicates, sort và chuyển sang dict
+    làm sau khi nhả lock để không chặn writers.
+    """
+
+    def __init__(self, shards=16, search_cache=None):
+        self._shards = [_Shard() for _ in range(shards)]
+        self._index_lock = threading.RLock()
+        self._journal = None
+        # Generation tăng ở mọi mutation (giữ _index_lock): toàn store khi thêm / xóa orders,
+        # theo từng field khi update
+        self._search_cache = search_cache
+        self._generation = 0
+        self._field_generations = {}
+        self._aggregates = OrderAggregates()
+        self._created_index = SortedIndex('createdAt', to_epoch, decode_time)
+        self._total_index = SortedIndex('totalAmount')
+        self._customer_index = HashIndex('customerId')
+        self._status_index = HashIndex('status')
+        self._text_index = TextIndex()
+        self._indexes = [
+            self._created_index,
+            self._total_index,
+            self._customer_index,
+            self._status_index,
+            self._text_index,
+        ]
+        self._sort_indexes = {
+            'createdAt': self._created_index,
+            'totalAmount': self._total_index,
+        }
+        self._columns = OrderColumns() if HAS_NUMPY else None
+        if self._columns is not None:
+            self._indexes.append(self._columns)
+
+    def __len__(self):
+        return sum(len(shard.orders) for shard in self._shards)
+
+    def __contains__(self, order_id):
+        return order_id in self._shard(order_id).orders
+
+    def _shard(self, order_id):
+        return self._shards[hash(order_id) % len(self._shards)]
+
+    def _lookup(self, order_id):
+        return self._shard(order_id).orders[order_id]
+
+    @contextmanager
+    def _locking(self, order_ids):
+        """Giữ lock ghi của các shards chứa order_ids, luôn theo thứ tự shard để tránh deadlock"""
+        positions = sorted({hash(order_id) % len(self._shards) for order_id in order_ids})
+        with ExitStack() as stack:
+            for position in positions:
+                stack.enter_context(self._shards[position].lock)
+            yield
+
+    def _get(self, order_id):
+        return self._shard(order_id).orders.get(order_id)
+
+    def get(self, order_id):
+        record = self._get(order_id)
+        return record.to_dict() if record is not None else None
+
+    def _records(self):
+        records = []
+        with self._index_lock:
+            for shard in self._shards:
+                records.extend(shard.orders.values())
+        return records
+
+    def values(self):
+        return list(map(_to_dict, self._records()))
+
+    def _check(self, records, indexes=None):
+        """
+        Tính trước keys của records cho indexes / aggregates (gọi khi giữ _index_lock): lỗi như
+        customerId không hashable xảy ra trước khi store hay index nào bị thay đổi
+        """
+        for index in self._indexes if indexes is None else indexes:
+            for record in records:
+                index.check(record)
+        for record in records:
+            self._aggregates.check(record)
+
+    def _index(self, order):
+        for index in self._indexes:
+            index.insert(order)
+        self._aggregates.add(order)
+
+    def _unindex(self, order):
+        for index in self._indexes:
+            index.remove(order)
+        self._aggregates.remove(order)
+
+    def _invalidate(self, fields=None):
+        """Tăng generation cho các field đã thay đổi (None: toàn store). Gọi khi giữ _index_lock"""
+        if fields is None:
+            self._generation += 1
+            return
+        for field in fields:
+            self._field_generations[field] = self._field_generations.get(field, 0) + 1
+
+    def _generation_of(self, filters, sort_by=None):
+        fields = sorted(set().union(*(FILTER_FIELDS[key] for key in filters), () if sort_by is None else (sort_by,)))
+        return self._generation, tuple(self._field_generations.get(field, 0) for field in fields)
+
+    def _cached(self, key, filters, sort_by, compute):
+        """
+        (records, metadata) của compute() qua search cache: cache chỉ giữ ids nên hit vẫn trả về
+        version hiện tại của từng order (các field không ảnh hưởng kết quả có thể đã được update)
+        """
+        cache = self._search_cache
+        if cache is None:
+            return compute()
+        with self._index_lock:
+            generation = self._generation_of(filters, sort_by)
+            cached = cache.get(key, generation)
+            if cached is not None:
+                ids, metadata = cached
+                return [self._lookup(order_id) for order_id in ids], metadata
+        # Write xảy ra trong lúc compute làm generation tăng nên entry này chỉ bị bỏ ở lần đọc sau
+        records, metadata = compute()
+        cache.put(key, generation, ([record.id for record in records], metadata))
+        return records, metadata
+
+    def _affected_indexes(self, fields):
+        return [index for index in self._indexes if not index.fields.isdisjoint(fields)]
+
+    def attach_journal(self, journal):
+        """Ghi mọi mutation vào write-ahead log (gắn sau khi recover để replay không bị ghi lại)"""
+        self._journal = journal
+
+    def _log(self, op, data):
+        # Gọi khi đang giữ lock shard để thứ tự records của mỗi order đúng thứ tự mutations
+        return self._journal.write(op, data) if self._journal is not None else None
+
+    def _sync(self, seq):
+        # Chờ fsync sau khi nhả lock để các writers khác được gom chung group commit
+        if seq is not None:
+            self._journal.wait(seq)
+
+    @contextmanager
+    def locked(self):
+        """Chặn mọi writes (dùng khi chụp snapshot)"""
+        with ExitStack() as stack:
+            for shard in self._shards:
+                stack.enter_context(shard.lock)
+            stack.enter_context(self._index_lock)
+            yield
+
+    def snapshot(self):
+        """Các orders tại thời điểm gọi; records bất biến nên được chuyển sang dict dần khi ghi snapshot"""
+        return map(_to_dict, self._records())
+
+    def add(self, order):
+        """Thêm order (thay thế toàn bộ nếu id đã tồn tại, vd. khi replay WAL)"""
+        record = OrderRecord.from_dict(order)
+        shard = self._shard(order['id'])
+        with shard.lock:
+            with self._index_lock:
+                self._check([record])
+                previous = shard.orders.get(order['id'])
+                if previous is not None:
+                    self._unindex(previous)
+                # Chỉ publish record sau khi index xong
+                self._index(record)
+                self._invalidate()
+                shard.orders[order['id']] = record
+            seq = self._log('order.put', order)
+        self._sync(seq)
+        return order
+
+    def add_many(self, orders):
+        """Thêm nhiều orders, mỗi index được cập nhật một lần cho cả lô"""
+        records = list(map(OrderRecord.from_dict, orders))
+        with self._locking(order['id'] for order in orders):
+            with self._index_lock:
+                self._check(records)
+                replaced = [previous for previous in map(self._get, (order['id'] for order in orders))
+                            if previous is not None]
+                for index in self._indexes:
+                    index.remove_many(replaced)
+                for previous in replaced:
+                    self._aggregates.remove(previous)
+                for record in records:
+                    self._aggregates.add(record)
+                for index in self._indexes:
+                    index.insert_many(records)
+                self._invalidate()
+                for record in records:
+                    self._shard(record.id).orders[record.id] = record
+            seq = self._log('order.put_many', orders) if orders else None
+        self._sync(seq)
+        return orders
+
+    def update(self, order_id, changes, precondition=None):
+        """
+        Tạo version mới của order với các field thay đổi (tăng `version`), chỉ re-index các index
+        có field thay đổi. Trả về (version trước, version mới); KeyError nếu order không tồn tại,
+        PreconditionFailed nếu precondition(order hiện tại) trả về False
+        """
+        shard = self._shard(order_id)
+        with shard.lock:
+            current = shard.orders[order_id]
+            previous = current.to_dict()
+            if precondition is not None and not precondition(previous):
+                raise PreconditionFailed(order_id)
+            order = {**previous, **changes, 'version': previous.get('version', 1) + 1}
+            record = OrderRecord.from_dict(order)
+            indexes = self._affected_indexes(changes)
+            with self._index_lock:
+                self._check([record], indexes)
+                for index in indexes:
+                    index.remove(current)
+                for index in indexes:
+                    index.insert(record)
+                self._aggregates.replace(current, record, changes)
+                self._invalidate(changes)
+                shard.orders[order_id] = record
+            seq = self._log('order.put', order)
+        self._sync(seq)
+        return previous, order
+
+    def update_many(self, order_ids, build_changes):
+        """
+        Cập nhật nhiều orders trong một lượt giữ lock các shards liên quan: build_changes(order)
+        trả về dict changes (hoặc None để bỏ qua order). Index được cập nhật theo từng chunk
+        UPDATE_CHUNK_SIZE orders (mỗi index một lần cho cả chunk), _index_lock được nhả giữa các
+        chunks; mọi chunks được check trước khi chunk đầu tiên được áp dụng. Lock các shards giữ
+        đến hết nên không write nào khác chen vào các orders của lô.
+        Trả về list (order mới, changes) đã áp dụng
+        """
+        with self._locking(order_ids):
+            replaced, updates, seen = [], [], set()
+            for order_id in order_ids:
+                current = self._get(order_id)
+                if current is None or order_id in seen:
+                    continue
+                seen.add(order_id)
+                previous = current.to_dict()
+                changes = build_changes(previous)
+                if changes:
+                    replaced.append(current)
+                    updates.append(({**previous, **changes, 'version': previous.get('version', 1) + 1}, changes))
+
+            fields = set().union(*(changes for _, changes in updates))
+            indexes = self._affected_indexes(fields)
+            orders = [order for order, _ in updates]
+            records = list(map(OrderRecord.from_dict, orders))
+            chunks = [(replaced[start:start + UPDATE_CHUNK_SIZE], records[start:start + UPDATE_CHUNK_SIZE],
+                       updates[start:start + UPDATE_CHUNK_SIZE])
+                      for start in range(0, len(records), UPDATE_CHUNK_SIZE)]
+            for _, chunk, _ in chunks:
+                with self._index_lock:
+                    self._check(chunk, indexes)
+            for previous, chunk, chunk_updates in chunks:
+                with self._index_lock:
+                    for index in indexes:
+                        index.remove_many(previous)
+                    for index in indexes:
+                        index.insert_many(chunk)
+                    for current, record, (_, changes) in zip(previous, chunk, chunk_updates):
+                        self._aggregates.replace(current, record, changes)
+                    self._invalidate(fields)
+                    for record in chunk:
+                        self._shard(record.id).orders[record.id] = record
+            seq = self._log('order.put_many', orders) if orders else None
+        self._sync(seq)
+        return updates
+
+    def delete(self, order_id):
+        """Xóa và trả về order; KeyError nếu order không tồn tại"""
+        shard = self._shard(order_id)
+        with shard.lock:
+            with self._index_lock:
+                record = shard.orders.pop(order_id)
+                self._unindex(record)
+                self._invalidate()
+            seq = self._log('order.delete', {'id': order_id})
+        self._sync(seq)
+        return record.to_dict()
+
+    def delete_many(self, order_ids, precondition=None, before_delete=None):
+        """
+        Xóa nhiều orders trong một lượt giữ lock các shards liên quan, bỏ qua id không tồn tại hoặc
+        có precondition(order) False. before_delete(orders) được gọi ngay trước khi xóa, lúc writes
+        vào các shards này đang bị chặn (vd. ghi orders sang archive); lỗi của nó hủy việc xóa.
+        Trả về list orders đã xóa
+        """
+        order_ids = list(dict.fromkeys(order_ids))
+        with self._locking(order_ids):
+            records = [record for record in map(self._get, order_ids) if record is not None]
+            orders = list(map(_to_dict, records))
+            if precondition is not None:
+                kept = [(record, order) for record, order in zip(records, orders) if precondition(order)]
+                records, orders = [record for record, _ in kept], [order for _, order in kept]
+            if not records:
+                return []
+            if before_delete is not None:
+                before_delete(orders)
+            with self._index_lock:
+                for record in records:
+                    del self._shard(record.id).orders[record.id]
+                    self._aggregates.remove(record)
+                for index in self._indexes:
+                    index.remove_many(records)
+                self._invalidate()
+            for order in orders:
+                seq = self._log('order.delete', {'id': order['id']})
+        self._sync(seq)
+        return orders
+
+    def stats(self, dimensions=DIMENSIONS):
+        """Aggregates theo từng chiều, chi phí O(số groups) thay vì O(số orders)"""
+        with self._index_lock:
+            return self._aggregates.snapshot(dimensions)
+
+    def page(self, offset, limit, newest_first=True):
+        """Lấy một trang orders theo createdAt, chi phí phụ thuộc vào limit"""
+        with self._index_lock:
+            ids = self._created_index.ids(offset, offset + limit, reverse=newest_first)
+            records = list(map(self._lookup, ids))
+        return list(map(_to_dict, records))
+
+    def page_after(self, after, limit, newest_first=True):
+        """Keyset pagination theo createdAt: lấy tối đa limit orders ngay sau cursor (createdAt, id)"""
+        with self._index_lock:
+            ids = islice(self._created_index.iter_ids(after=after, reverse=newest_first), limit)
+            records = list(map(self._lookup, ids))
+        return list(map(_to_dict, records))
+
+    def _plans(self, filters):
+        """Liệt kê các cách lấy candidate set: (ước lượng số rows, filters đã cover, hàm lấy ids)"""
+        plans = []
+        terms = query_terms(filters['q']) if filters.get('q') else None
+        if terms:
+            # Giao posting lists của các terms cùng với buckets của các filter so sánh bằng
+            equal = [(field, index) for field, index in (('customerId', self._customer_index),
+                                                         ('status', self._status_index)) if field in filters]
+            estimate = min([self._text_index.count(terms)] + [index.count(filters[field]) for field, index in equal])
+            plans.append((estimate, {'q'} | {field for field, _ in equal},
+                          lambda: self._text_index.ids(terms, [index.ids(filters[field]) for field, index in equal])))
+        for field, index in (('customerId', self._customer_index), ('status', self._status_index)):
+            if field in filters:
+                value = filters[field]
+                plans.append((index.count(value), {field}, lambda index=index, value=value: index.ids(value)))
+        for field, index in self._sort_indexes.items():
+            low_key, high_key = RANGE_FILTERS[field]
+            covered = {key for key in (low_key, high_key) if key in filters}
+            if covered:
+                low, high = filters.get(low_key), filters.get(high_key)
+                start, stop = index.range_bounds(low, high)
+                plans.append((stop - start, covered, lambda index=index, start=start, stop=stop: index.ids(start, stop)))
+        return plans
+
+    def _column_plan(self, filters, plans):
+        """
+        (filters đã cover, rows) khi range filters được đánh giá bằng NumPy columns, cùng với filters
+        so sánh bằng (customerId, status) và candidate set nhỏ của hash / text index nếu có;
+        None nếu không dùng columns. Gọi khi giữ _index_lock
+        """
+        columns = self._columns
+        ranges = {key for keys in RANGE_FILTERS.values() for key in keys if key in filters}
+        if columns is None or not ranges or not columns.exact():
+            return None
+        best = min(plans, key=_first)[0]
+        if best <= COLUMN_SCAN_MIN:
+            return None
+
+        # Bounds là giá trị nhỏ nhất / lớn nhất thực có trong range của sort index nên giữ đúng
+        # semantics so sánh của filters (vd. so sánh string của createdAt)
+        bounds = {}
+        for field, (low_key, high_key) in RANGE_FILTERS.items():
+            if low_key in filters or high_key in filters:
+                keys = self._sort_indexes[field].key_range(filters.get(low_key), filters.get(high_key))
+                if keys is None:
+                    return ranges, columns.rows_of(())
+                bounds[field] = tuple(map(COLUMN_ENCODERS[field], keys))
+
+        equals = {field: filters[field] for field in CODED_FIELDS if field in filters}
+        covered = ranges | equals.keys()
+        set_plans = [plan for plan in plans if ranges.isdisjoint(plan[1])]
+        set_plan = min(set_plans, key=_first) if set_plans else None
+        if set_plan is not None and set_plan[0] * COLUMN_SET_RATIO <= len(columns):
+            _, set_covered, candidate_ids = set_plan
+            return covered | set_covered, columns.select(bounds, equals, columns.rows_of(candidate_ids()))
+        return covered, columns.select(bounds, equals)
+
+    def _search(self, filters):
+        """
+        Query planner cho /orders/search: bắt đầu từ index chọn lọc nhất (hoặc NumPy columns
+        cho range filters lớn), chỉ kiểm tra các predicate còn lại trên candidate set đó. Trả về records
+        """
+        with self._index_lock:
+            plans = self._plans(filters)
+            column_plan = self._column_plan(filters, plans) if plans else None
+            ids = None
+            if column_plan is not None:
+                covered, rows = column_plan
+                ids = self._columns.ids_of(rows)
+            elif plans:
+                _, covered, candidate_ids = min(plans, key=_first)
+                ids = list(candidate_ids())
+            else:
+                # Không filter nào có index (vd. chỉ có since): duyệt toàn bộ
+                covered, candidates = (), self._records()
+            generation = self._generation_of(covered)
+        if ids is not None:
+            # Đọc records sau khi nhả lock (get không cần lock); nếu đã có write vào các field
+            # mà index cover thì record đọc được có thể không còn khớp: kiểm tra lại mọi filters
+            candidates = [record for record in map(self._get, ids) if record is not None]
+            with self._index_lock:
+                if self._generation_of(covered) != generation:
+                    covered = ()
+        remaining = [(FILTER_PREDICATES[field], value)
+                     for field, value in filters.items() if field not in covered]
+        if not remaining:
+            return candidates
+        return [record for record in candidates
+                if all(predicate(record, value) for predicate, value in remaining)]
+
+    def search(self, filters):
+        return list(map(_to_dict, self._search(filters)))
+
+    def search_page(self, filters, sort_by, descending, offset, limit):
+        """
+        Một trang kết quả search sắp xếp theo (sort_by, id) và tổng số kết quả;
+        chỉ các orders trong trang được chuyển sang dict
+        """
+        key = ('page', _query_key(filters), sort_by, descending, offset, limit)
+        records, total = self._cached(
+            key, filters, sort_by, lambda: self._search_page(filters, sort_by, descending, offset, limit))
+        return list(map(_to_dict, records)), total
+
+    def _exact_total(self, filters, plans):
+        """Số kết quả khi một index cover mọi filters (None nếu phải đếm). Gọi khi giữ _index_lock"""
+        if not filters:
+            return len(self._created_index)
+        # Estimate của text plan chỉ là cận trên, các plan còn lại đếm chính xác
+        for estimate, covered, _ in plans:
+            if 'q' not in covered and covered == filters.keys():
+                return estimate
+        return None
+
+    def _search_page(self, filters, sort_by, descending, offset, limit):
+        sort_index = self._sort_indexes.get(sort_by)
+        with self._index_lock:
+            plans = self._plans(filters)
+            column_plan = self._column_plan(filters, plans) if plans else None
+            if column_plan is not None and column_plan[0].issuperset(filters) and sort_by in COLUMN_ENCODERS:
+                # Mọi filter đã được columns cover: chọn top rows bằng NumPy, không cần duyệt orders
+                _, rows = column_plan
+                ids = self._columns.top(rows, sort_by, descending, offset + limit)[offset:]
+                return [self._lookup(order_id) for order_id in ids], len(rows)
+            estimate = min(plans, key=_first)[0] if plans else len(self._created_index)
+            total = self._exact_total(filters, plans)
+        if sort_index is not None and estimate > SORT_CANDIDATES_MAX and total is not None:
+            # Candidate set lớn và total đã biết từ index: duyệt sort index từ đầu, dừng ở offset + limit
+            return self._walk(filters, sort_index, descending, offset + limit)[offset:], total
+        records = self._search(filters)
+        return _top(records, sort_by, descending, offset + limit)[offset:], len(records)
+
+    def search_after(self, filters, sort_by, descending, limit, after=None):
+        """
+        Keyset pagination cho search: trả về (tối đa limit orders nằm sau
+        cursor `after` = (sortKey, id), còn trang sau hay không)
+        """
+        key = ('after', _query_key(filters), sort_by, descending, limit, after)
+        records, has_more = self._cached(
+            key, filters, sort_by, lambda: self._search_after(filters, sort_by, descending, limit, after))
+        return list(map(_to_dict, records)), has_more
+
+    def _search_after(self, filters, sort_by, descending, limit, after):
+        with self._index_lock:
+            plans = self._plans(filters)
+            estimate = min(plans, key=_first)[0] if plans else len(self)
+        sort_index = self._sort_indexes.get(sort_by)
+
+        if sort_index is not None and estimate > SORT_CANDIDATES_MAX:
+            # Candidate set lớn: duyệt sort index từ cursor, dừng khi đủ limit + 1 rows
+            results = self._walk(filters, sort_index, descending, limit + 1, after)
+        else:
+            # Candidate set nhỏ: chỉ lấy top limit + 1 rows sau cursor
+            sort_key = itemgetter(sort_by, 'id')
+            matches = self._search(filters)
+            if after is not None:
+                if descending:
+                    matches = [record for record in matches if sort_key(record) < after]
+                else:
+                    matches = [record for record in matches if sort_key(record) > after]
+            results = _top(matches, sort_by, descending, limit + 1)
+
+        return results[:limit], len(results) > limit
+
+    def _walk(self, filters, sort_index, descending, count, after=None):
+        """
+        Tối đa count records khớp filters theo thứ tự của sort_index, bắt đầu ngay sau key `after`.
+        Đọc index theo từng chunk nên chi phí phụ thuộc vào vị trí của row cuối cùng cần lấy
+        """
+        low_key, high_key = RANGE_FILTERS[sort_index.field]
+        low, high = filters.get(low_key), filters.get(high_key)
+        remaining = [(FILTER_PREDICATES[field], value)
+                     for field, value in filters.items() if field not in (low_key, high_key)]
+        results = []
+        while len(results) < count:
+            with self._index_lock:
+                ids = islice(sort_index.iter_ids(low, high, after, descending), SCAN_CHUNK_SIZE)
+                records = [self._lookup(order_id) for order_id in ids]
+            if not records:
+                break
+            after = (records[-1][sort_index.field], records[-1].id)
+            for record in records:
+                if all(predicate(record, value) for predicate, value in remaining):
+                    results.append(record)
+                    if len(results) == count:
+                        break
+        return results
+
+    def scan(self, filters, chunk_size=SCAN_CHUNK_SIZE):
+        """
+        Duyệt orders khớp filters theo createdAt tăng dần. Store lớn được đọc từng chunk
+        theo keyset nên bộ nhớ không phụ thuộc kích thước store và an toàn khi có ghi đồng thời
+        """
+        with self._index_lock:
+            plans = self._plans(filters)
+        if plans and min(plans, key=_first)[0] <= SORT_CANDIDATES_MAX:
+            # Candidate set nhỏ: lấy hết rồi sắp xếp
+            records = self._search(filters)
+            yield from map(_to_dict, sorted(records, key=itemgetter('createdAt', 'id')))
+            return
+
+        low_key, high_key = RANGE_FILTERS['createdAt']
+        remaining = [(FILTER_PREDICATES[field], value)
+                     for field, value in filters.items() if field not in (low_key, high_key)]
+        after = None
+        while True:
+            with self._index_lock:
+                ids = islice(self._created_index.iter_ids(filters.get(low_key), filters.get(high_key), after),
+                             chunk_size)
+                records = [self._lookup(order_id) for order_id in ids]
+            if not records:
+                return
+            after = (records[-1]['createdAt'], records[-1].id)
+            for record in records:
+                if all(predicate(record, value) for predicate, value in remaining):
+                    yield record.to_dict()
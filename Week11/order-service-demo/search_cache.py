@@ -0,0 +1,55 @@
+"""
+Search Cache
+LRU cache kết quả của /orders/search (ids của trang + metadata) theo query đã chuẩn hóa
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class SearchCache:
+    """
+    Mỗi entry gắn với generation của store tại lúc tính kết quả. Entry có generation
+    khác generation hiện tại (đã có write liên quan từ đó) coi như miss và bị bỏ
+    """
+
+    def __init__(self, max_size=256):
+        self._entries = OrderedDict()
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0
+        }
+
+    def get(self, key, generation):
+        """Giá trị đã cache của key nếu còn đúng generation, ngược lại None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+                self._stats['invalidations'] += 1
+            self._stats['misses'] += 1
+            return None
+
+    def put(self, key, generation, value):
+        with self._lock:
+            self._entries[key] = (generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def stats(self):
+        """Metrics cho /health: số entries, giới hạn, hits / misses"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        stats['maxSize'] = self._max_size
+        return stats
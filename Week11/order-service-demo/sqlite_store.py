@@ -0,0 +1,529 @@
+"""
+SQLite Store
+Backend lưu orders / webhooks trong SQLite (WAL mode) để nhiều worker processes dùng chung dữ liệu,
+cùng interface với OrderStore / WebhookRegistry
+"""
+
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from order_stats import AGGREGATE_FIELDS, DIMENSIONS, summarize
+from order_store import PreconditionFailed
+from text_index import TEXT_FIELDS, order_terms, query_terms
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id TEXT PRIMARY KEY,
+    customer_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total_amount NUMERIC NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at, id);
+CREATE INDEX IF NOT EXISTS idx_orders_total ON orders (total_amount, id);
+CREATE INDEX IF NOT EXISTS idx_orders_customer ON orders (customer_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_orders_updated ON orders (updated_at);
+
+CREATE TABLE IF NOT EXISTS order_aggregates (
+    dimension TEXT NOT NULL,
+    group_key TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    total NUMERIC NOT NULL,
+    min_amount NUMERIC,
+    max_amount NUMERIC,
+    PRIMARY KEY (dimension, group_key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS order_terms (
+    term TEXT NOT NULL,
+    order_id TEXT NOT NULL,
+    PRIMARY KEY (term, order_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_order_terms_order ON order_terms (order_id);
+
+CREATE TABLE IF NOT EXISTS webhooks (
+    id TEXT PRIMARY KEY,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS webhook_events (
+    event_type TEXT NOT NULL,
+    webhook_id TEXT NOT NULL,
+    PRIMARY KEY (event_type, webhook_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_webhook_events_webhook ON webhook_events (webhook_id);
+
+CREATE TABLE IF NOT EXISTS order_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_type TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+"""
+
+# Field của order -> cột SQLite dùng cho sort / keyset cursor
+SORT_COLUMNS = {
+    'createdAt': 'created_at',
+    'totalAmount': 'total_amount',
+    'status': 'status',
+}
+
+# Filter của /orders/search -> điều kiện SQL (thứ tự cố định để câu SQL được cache lại)
+FILTER_CLAUSES = {
+    'customerId': 'customer_id = ?',
+    'status': 'status = ?',
+    'fromDate': 'created_at >= ?',
+    'toDate': 'created_at <= ?',
+    'minTotal': 'total_amount >= ?',
+    'maxTotal': 'total_amount <= ?',
+    'since': 'updated_at >= ?',
+}
+
+# Mỗi term của filter q= -> điều kiện trên inverted index order_terms
+TERM_CLAUSE = 'id IN (SELECT order_id FROM order_terms WHERE term = ?)'
+
+# Chiều nhóm của order_aggregates -> biểu thức SQL của group key
+GROUP_EXPRESSIONS = {
+    'status': 'status',
+    'customerId': 'customer_id',
+    'day': 'substr(created_at, 1, 10)',
+}
+
+# Chiều nhóm -> điều kiện chọn orders của một group (dùng khi cần tính lại min/max)
+GROUP_CLAUSES = {
+    'status': ('status = ?', lambda key: (key,)),
+    'customerId': ('customer_id = ?', lambda key: (key,)),
+    'day': ('created_at >= ? AND created_at < ?', lambda key: (key, key + '~')),
+}
+
+# Số orders đọc mỗi lần khi scan (export)
+SCAN_CHUNK_SIZE = 500
+
+UPSERT_ORDER = """
+INSERT OR REPLACE INTO orders (id, customer_id, status, total_amount, created_at, updated_at, body)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _order_row(order):
+    return (order['id'], order['customerId'], order['status'], order['totalAmount'],
+            order['createdAt'], order['updatedAt'], json.dumps(order, ensure_ascii=False))
+
+
+AGGREGATE_ADD = """
+INSERT INTO order_aggregates (dimension, group_key, count, total, min_amount, max_amount)
+VALUES (?, ?, 1, ?, ?, ?)
+ON CONFLICT (dimension, group_key) DO UPDATE SET
+    count = count + 1,
+    total = total + excluded.total,
+    min_amount = MIN(min_amount, excluded.min_amount),
+    max_amount = MAX(max_amount, excluded.max_amount)
+"""
+
+
+def _aggregate_add(conn, order):
+    amount = order['totalAmount']
+    for dimension, key_of in DIMENSIONS.items():
+        conn.execute(AGGREGATE_ADD, (dimension, key_of(order), amount, amount, amount))
+
+
+def _aggregate_remove(conn, order):
+    """Gọi sau khi row của order đã được ghi / xóa; chỉ tính lại min/max khi bỏ đi giá trị biên"""
+    amount = order['totalAmount']
+    for dimension, key_of in DIMENSIONS.items():
+        key = key_of(order)
+        conn.execute('UPDATE order_aggregates SET count = count - 1, total = total - ? '
+                     'WHERE dimension = ? AND group_key = ?', (amount, dimension, key))
+        row = conn.execute('SELECT count, min_amount, max_amount FROM order_aggregates '
+                           'WHERE dimension = ? AND group_key = ?', (dimension, key)).fetchone()
+        if row is None:
+            continue
+        count, minimum, maximum = row
+        if count <= 0:
+            conn.execute('DELETE FROM order_aggregates WHERE dimension = ? AND group_key = ?', (dimension, key))
+        elif amount <= minimum or amount >= maximum:
+            clause, params_of = GROUP_CLAUSES[dimension]
+            conn.execute(f'UPDATE order_aggregates SET (min_amount, max_amount) = '
+                         f'(SELECT MIN(total_amount), MAX(total_amount) FROM orders WHERE {clause}) '
+                         f'WHERE dimension = ? AND group_key = ?', (*params_of(key), dimension, key))
+
+
+def _index_terms(conn, order):
+    """Ghi lại các terms của order vào order_terms"""
+    conn.execute('DELETE FROM order_terms WHERE order_id = ?', (order['id'],))
+    conn.executemany('INSERT INTO order_terms (term, order_id) VALUES (?, ?)',
+                     [(term, order['id']) for term in order_terms(order)])
+
+
+def _where(filters, extra=None):
+    """Câu WHERE + params cho filters (và điều kiện keyset nếu có)"""
+    clauses = [clause for field, clause in FILTER_CLAUSES.items() if field in filters]
+    params = [filters[field] for field in FILTER_CLAUSES if field in filters]
+    if filters.get('q'):
+        terms = sorted(query_terms(filters['q']))
+        # q không có term nào: không khớp order nào
+        clauses.extend([TERM_CLAUSE] * len(terms) if terms else ['0'])
+        params.extend(terms)
+    if extra:
+        clauses.append(extra)
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+class SqliteStorage:
+    """
+    Database dùng chung cho orders và webhooks. Mỗi thread có connection riêng
+    (sqlite3 connection không an toàn khi dùng chung giữa threads); mỗi connection tự
+    cache prepared statements theo câu SQL
+    """
+
+    def __init__(self, path, timeout=30, cached_statements=256):
+        self.path = path
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self.connection().executescript(SCHEMA)
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=self.timeout,
+                                   cached_statements=self.cached_statements)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Transaction ghi (BEGIN IMMEDIATE để read-modify-write không bị process khác chen vào).
+        Gọi lồng trong transaction đang mở của cùng thread thì dùng SAVEPOINT, nên mọi thay đổi
+        (vd. order + outbox rows của nó) chỉ được commit cùng transaction ngoài cùng
+        """
+        conn = self.connection()
+        depth = getattr(self._local, 'depth', 0)
+        savepoint = f'sp{depth}'
+        conn.execute(f'SAVEPOINT {savepoint}' if depth else 'BEGIN IMMEDIATE')
+        self._local.depth = depth + 1
+        try:
+            yield conn
+        except BaseException:
+            if depth:
+                conn.execute(f'ROLLBACK TO {savepoint}')
+                conn.execute(f'RELEASE {savepoint}')
+            else:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            self._local.depth = depth
+        conn.execute(f'RELEASE {savepoint}' if depth else 'COMMIT')
+
+
+class SqliteOrderStore:
+    """OrderStore trên SQLite: filters / sort / keyset cursor được đẩy xuống các index của bảng orders"""
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._rebuild_aggregates()
+        self._rebuild_terms()
+
+    def _rebuild_aggregates(self):
+        """Tính aggregates từ bảng orders khi bảng order_aggregates còn trống (database cũ)"""
+        with self._storage.transaction() as conn:
+            if conn.execute('SELECT 1 FROM order_aggregates LIMIT 1').fetchone() is not None:
+                return
+            for dimension, expression in GROUP_EXPRESSIONS.items():
+                conn.execute(f'INSERT INTO order_aggregates '
+                             f'SELECT ?, {expression}, COUNT(*), SUM(total_amount), MIN(total_amount), MAX(total_amount) '
+                             f'FROM orders GROUP BY {expression}', (dimension,))
+
+    def _rebuild_terms(self):
+        """Index lại order_terms khi bảng còn trống nhưng đã có orders (database cũ)"""
+        with self._storage.transaction() as conn:
+            if conn.execute('SELECT 1 FROM order_terms LIMIT 1').fetchone() is not None:
+                return
+            for body, in conn.execute('SELECT body FROM orders').fetchall():
+                _index_terms(conn, json.loads(body))
+
+    def _query(self, sql, params=()):
+        return [json.loads(body) for body, in self._storage.connection().execute(sql, params)]
+
+    @staticmethod
+    def _select(conn, order_id):
+        row = conn.execute('SELECT body FROM orders WHERE id = ?', (order_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    @staticmethod
+    def _write(conn, order, previous=None):
+        """Ghi order và cập nhật terms / aggregates (previous: version bị thay thế nếu có)"""
+        conn.execute(UPSERT_ORDER, _order_row(order))
+        if previous is None:
+            _index_terms(conn, order)
+            _aggregate_add(conn, order)
+            return
+        changed = {field for field in order if order[field] != previous.get(field)}
+        if not TEXT_FIELDS.isdisjoint(changed):
+            _index_terms(conn, order)
+        if not AGGREGATE_FIELDS.isdisjoint(changed):
+            _aggregate_remove(conn, previous)
+            _aggregate_add(conn, order)
+
+    def __len__(self):
+        return self._storage.connection().execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+
+    def __contains__(self, order_id):
+        return self._storage.connection().execute(
+            'SELECT 1 FROM orders WHERE id = ?', (order_id,)).fetchone() is not None
+
+    def get(self, order_id):
+        orders = self._query('SELECT body FROM orders WHERE id = ?', (order_id,))
+        return orders[0] if orders else None
+
+    def values(self):
+        return self._query('SELECT body FROM orders')
+
+    def add(self, order):
+        """Thêm order (thay thế toàn bộ nếu id đã tồn tại)"""
+        with self._storage.transaction() as conn:
+            self._write(conn, order, self._select(conn, order['id']))
+        return order
+
+    def add_many(self, orders):
+        """Thêm nhiều orders trong một transaction"""
+        with self._storage.transaction() as conn:
+            for order in orders:
+                self._write(conn, order, self._select(conn, order['id']))
+        return orders
+
+    def update(self, order_id, changes, precondition=None):
+        """
+        Trả về (version trước, version mới); KeyError nếu order không tồn tại,
+        PreconditionFailed nếu precondition(order hiện tại) trả về False
+        """
+        with self._storage.transaction() as conn:
+            previous = self._select(conn, order_id)
+            if previous is None:
+                raise KeyError(order_id)
+            if precondition is not None and not precondition(previous):
+                raise PreconditionFailed(order_id)
+            order = {**previous, **changes, 'version': previous.get('version', 1) + 1}
+            self._write(conn, order, previous)
+        return previous, order
+
+    def update_many(self, order_ids, build_changes):
+        """
+        Cập nhật nhiều orders trong một transaction: build_changes(order) trả về dict changes
+        (hoặc None để bỏ qua order). Trả về list (order mới, changes) đã áp dụng
+        """
+        with self._storage.transaction() as conn:
+            updates, seen = [], set()
+            for order_id in order_ids:
+                previous = self._select(conn, order_id)
+                if previous is None or order_id in seen:
+                    continue
+                seen.add(order_id)
+                changes = build_changes(previous)
+                if changes:
+                    order = {**previous, **changes, 'version': previous.get('version', 1) + 1}
+                    self._write(conn, order, previous)
+                    updates.append((order, changes))
+        return updates
+
+    def delete(self, order_id):
+        """Xóa và trả về order; KeyError nếu order không tồn tại"""
+        with self._storage.transaction() as conn:
+            order = self._select(conn, order_id)
+            if order is None:
+                raise KeyError(order_id)
+            conn.execute('DELETE FROM orders WHERE id = ?', (order_id,))
+            conn.execute('DELETE FROM order_terms WHERE order_id = ?', (order_id,))
+            _aggregate_remove(conn, order)
+        return order
+
+    def stats(self, dimensions=DIMENSIONS):
+        """Đọc bảng order_aggregates, chi phí O(số groups)"""
+        stats = {dimension: {} for dimension in dimensions}
+        rows = self._storage.connection().execute(
+            'SELECT dimension, group_key, count, total, min_amount, max_amount FROM order_aggregates')
+        for dimension, key, count, total, minimum, maximum in rows:
+            if dimension in stats:
+                stats[dimension][key] = summarize(count, total, minimum, maximum)
+        return stats
+
+    def page(self, offset, limit, newest_first=True):
+        """Lấy một trang orders theo createdAt"""
+        direction = 'DESC' if newest_first else 'ASC'
+        return self._query(
+            f'SELECT body FROM orders ORDER BY created_at {direction}, id {direction} LIMIT ? OFFSET ?',
+            (limit, offset))
+
+    def page_after(self, after, limit, newest_first=True):
+        """Keyset pagination theo createdAt: lấy tối đa limit orders ngay sau cursor (createdAt, id)"""
+        direction, op = ('DESC', '<') if newest_first else ('ASC', '>')
+        where, params = ('', []) if after is None else (f' WHERE (created_at, id) {op} (?, ?)', list(after))
+        return self._query(
+            f'SELECT body FROM orders{where} ORDER BY created_at {direction}, id {direction} LIMIT ?',
+            params + [limit])
+
+    def search(self, filters):
+        """Filters được SQLite query planner chọn index phù hợp"""
+        where, params = _where(filters)
+        return self._query('SELECT body FROM orders' + where, params)
+
+    def search_page(self, filters, sort_by, descending, offset, limit):
+        """Một trang kết quả search sắp xếp theo (sort_by, id) và tổng số kết quả"""
+        column = SORT_COLUMNS[sort_by]
+        direction = 'DESC' if descending else 'ASC'
+        where, params = _where(filters)
+        total = self._storage.connection().execute('SELECT COUNT(*) FROM orders' + where, params).fetchone()[0]
+        orders = self._query(
+            f'SELECT body FROM orders{where} ORDER BY {column} {direction}, id {direction} LIMIT ? OFFSET ?',
+            params + [limit, offset])
+        return orders, total
+
+    def search_after(self, filters, sort_by, descending, limit, after=None):
+        """
+        Keyset pagination cho search: trả về (tối đa limit orders nằm sau
+        cursor `after` = (sortKey, id), còn trang sau hay không)
+        """
+        column = SORT_COLUMNS[sort_by]
+        direction, op = ('DESC', '<') if descending else ('ASC', '>')
+        where, params = _where(filters, None if after is None else f'({column}, id) {op} (?, ?)')
+        if after is not None:
+            params.extend(after)
+        results = self._query(
+            f'SELECT body FROM orders{where} ORDER BY {column} {direction}, id {direction} LIMIT ?',
+            params + [limit + 1])
+        return results[:limit], len(results) > limit
+
+    def scan(self, filters, chunk_size=SCAN_CHUNK_SIZE):
+        """
+        Duyệt orders khớp filters theo createdAt tăng dần, đọc từng chunk theo keyset
+        để không giữ read transaction trong lúc response đang stream
+        """
+        after = None
+        while True:
+            orders, _ = self.search_after(filters, 'createdAt', False, chunk_size, after)
+            if not orders:
+                return
+            after = (orders[-1]['createdAt'], orders[-1]['id'])
+            yield from orders
+
+
+class SqliteWebhookRegistry:
+    """WebhookRegistry trên SQLite, bảng webhook_events là index event type -> webhooks active"""
+
+    def __init__(self, storage):
+        self._storage = storage
+
+    def _query(self, sql, params=()):
+        return [json.loads(body) for body, in self._storage.connection().execute(sql, params)]
+
+    def __len__(self):
+        return self._storage.connection().execute('SELECT COUNT(*) FROM webhooks').fetchone()[0]
+
+    def __contains__(self, webhook_id):
+        return self._storage.connection().execute(
+            'SELECT 1 FROM webhooks WHERE id = ?', (webhook_id,)).fetchone() is not None
+
+    def get(self, webhook_id):
+        webhooks = self._query('SELECT body FROM webhooks WHERE id = ?', (webhook_id,))
+        return webhooks[0] if webhooks else None
+
+    def values(self):
+        return self._query('SELECT body FROM webhooks')
+
+    @staticmethod
+    def _write(conn, webhook):
+        conn.execute('INSERT OR REPLACE INTO webhooks (id, body) VALUES (?, ?)',
+                     (webhook['id'], json.dumps(webhook, ensure_ascii=False)))
+        conn.execute('DELETE FROM webhook_events WHERE webhook_id = ?', (webhook['id'],))
+        if webhook.get('isActive', True):
+            conn.executemany('INSERT OR IGNORE INTO webhook_events (event_type, webhook_id) VALUES (?, ?)',
+                             [(event_type, webhook['id']) for event_type in webhook.get('events', [])])
+
+    def add(self, webhook):
+        """Thêm webhook (thay thế toàn bộ nếu id đã tồn tại)"""
+        with self._storage.transaction() as conn:
+            self._write(conn, webhook)
+        return webhook
+
+    def update(self, webhook_id, changes):
+        """Cập nhật webhook và re-index (events / isActive có thể thay đổi)"""
+        with self._storage.transaction() as conn:
+            row = conn.execute('SELECT body FROM webhooks WHERE id = ?', (webhook_id,)).fetchone()
+            if row is None:
+                raise KeyError(webhook_id)
+            webhook = {**json.loads(row[0]), **changes}
+            self._write(conn, webhook)
+        return webhook
+
+    def delete(self, webhook_id):
+        with self._storage.transaction() as conn:
+            row = conn.execute('SELECT body FROM webhooks WHERE id = ?', (webhook_id,)).fetchone()
+            if row is None:
+                raise KeyError(webhook_id)
+            conn.execute('DELETE FROM webhooks WHERE id = ?', (webhook_id,))
+            conn.execute('DELETE FROM webhook_events WHERE webhook_id = ?', (webhook_id,))
+        return json.loads(row[0])
+
+    def subscribers(self, event_type):
+        """Các webhooks active đã subscribe event_type"""
+        return self._query(
+            'SELECT w.body FROM webhook_events e JOIN webhooks w ON w.id = e.webhook_id WHERE e.event_type = ?',
+            (event_type,))
+
+
+class SqliteEventFeed:
+    """
+    Change feed của order events trong bảng order_events (AUTOINCREMENT nên id không bao giờ
+    bị dùng lại), dùng chung giữa các worker processes; chỉ giữ `capacity` events gần nhất
+    """
+
+    def __init__(self, storage, capacity=100000, poll_interval=1.0):
+        self._storage = storage
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def _last_id(conn):
+        row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'order_events'").fetchone()
+        return row[0] if row else 0
+
+    def publish(self, events):
+        """Thêm các events (event_type, data), trả về id của event cuối"""
+        with self._storage.transaction() as conn:
+            conn.executemany('INSERT INTO order_events (event_type, data) VALUES (?, ?)', events)
+            last_id = self._last_id(conn)
+            conn.execute('DELETE FROM order_events WHERE id <= ?', (last_id - self.capacity,))
+        with self._cond:
+            self._cond.notify_all()
+        return last_id
+
+    def last_id(self):
+        return self._last_id(self._storage.connection())
+
+    def read_after(self, last_id, limit=100):
+        """Như EventFeed.read_after: (events, cursor mới, liên tục hay không)"""
+        conn = self._storage.connection()
+        conn.execute('BEGIN')
+        try:
+            current = self._last_id(conn)
+            oldest = conn.execute('SELECT MIN(id) FROM order_events').fetchone()[0] or current + 1
+            complete = oldest - 1 <= last_id <= current
+            events = conn.execute('SELECT id, event_type, data FROM order_events WHERE id > ? ORDER BY id LIMIT ?',
+                                  (last_id if complete else oldest - 1, limit)).fetchall()
+        finally:
+            conn.execute('COMMIT')
+        if events:
+            return events, events[-1][0], complete
+        return events, last_id if complete else current, complete
+
+    def wait(self, last_id, timeout):
+        """Events từ process khác chỉ thấy được bằng polling nên chờ tối đa poll_interval"""
+        with self._cond:
+            self._cond.wait(min(timeout, self.poll_interval))
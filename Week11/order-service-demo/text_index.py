@@ -0,0 +1,153 @@
+"""
+Text Index
+Inverted index trên tên / mã sản phẩm và ghi chú của order cho filter q= của /orders/search,
+tìm không phân biệt hoa thường và dấu tiếng Việt
+"""
+
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from functools import lru_cache
+
+_TOKEN = re.compile(r'\w+')
+
+# Dấu thanh / dấu mũ sau khi tách bằng NFD
+_MARKS = re.compile(r'[\u0300-\u036f]')
+
+# Field của order mà text index phụ thuộc (update field khác không cần re-index)
+TEXT_FIELDS = {'items', 'notes'}
+
+
+def fold(text):
+    """Chữ thường, bỏ dấu (kể cả đ -> d): 'Điện thoại' -> 'dien thoai'"""
+    return _MARKS.sub('', unicodedata.normalize('NFD', text.lower())).replace('đ', 'd')
+
+
+def tokenize(text):
+    return _TOKEN.findall(fold(text)) if text else []
+
+
+def order_terms(order):
+    """Các terms của order: productName, productId của từng item và notes"""
+    parts = [str(order.get('notes') or '')]
+    for item in order.get('items') or ():
+        parts.append(str(item.get('productName') or ''))
+        parts.append(str(item.get('productId') or ''))
+    return set(tokenize(' '.join(parts)))
+
+
+@lru_cache(maxsize=1024)
+def query_terms(query):
+    """Terms của q (order phải chứa tất cả); rỗng nếu q không có chữ / số nào"""
+    return frozenset(tokenize(query))
+
+
+def matches(order, query):
+    """q không có term nào không khớp order nào (thay vì khớp mọi order)"""
+    terms = query_terms(query)
+    return bool(terms) and terms <= order_terms(order)
+
+
+def add_id(posting, order_id):
+    """Thêm id vào posting list (list ids đã sắp xếp, 8 bytes mỗi id thay vì ~40 bytes của set)"""
+    insort(posting, order_id)
+
+
+def discard_id(posting, order_id):
+    i = bisect_left(posting, order_id)
+    if i < len(posting) and posting[i] == order_id:
+        del posting[i]
+
+
+def add_ids(posting, order_ids):
+    """
+    Thêm nhiều ids vào posting list trong một lượt: Timsort ghép đoạn đã sắp xếp với ids mới
+    bằng galloping, thay vì mỗi insort dời cả phần sau của list
+    """
+    posting += order_ids
+    posting.sort()
+
+
+def discard_ids(posting, order_ids):
+    """Xóa nhiều ids khỏi posting list: bisect vị trí từng id rồi ghép các đoạn còn lại một lần"""
+    kept, start = [], 0
+    for order_id in sorted(order_ids):
+        i = bisect_left(posting, order_id, start)
+        if i < len(posting) and posting[i] == order_id:
+            kept += posting[start:i]
+            start = i + 1
+    if start:
+        kept += posting[start:]
+        posting[:] = kept
+
+
+def contains_id(posting, order_id):
+    i = bisect_left(posting, order_id)
+    return i < len(posting) and posting[i] == order_id
+
+
+def intersect(postings):
+    """Tập ids thuộc mọi posting list: bắt đầu từ list ngắn nhất, tra các list còn lại bằng bisect"""
+    postings = sorted(postings, key=len)
+    result = postings[0]
+    for posting in postings[1:]:
+        if not result:
+            break
+        result = [order_id for order_id in result if contains_id(posting, order_id)]
+    return set(result)
+
+
+def _group_by_term(orders):
+    """term -> ids của các orders chứa term, để mỗi posting list chỉ được sửa một lần"""
+    groups = {}
+    for order in orders:
+        order_id = order['id']
+        for term in order_terms(order):
+            groups.setdefault(term, []).append(order_id)
+    return groups
+
+
+class TextIndex:
+    """Inverted index term -> posting list (order ids đã sắp xếp)"""
+
+    fields = TEXT_FIELDS
+
+    def __init__(self):
+        self._postings = {}
+
+    def check(self, order):
+        order_terms(order)
+
+    def insert(self, order):
+        order_id = order['id']
+        for term in order_terms(order):
+            add_id(self._postings.setdefault(term, []), order_id)
+
+    def insert_many(self, orders):
+        for term, order_ids in _group_by_term(orders).items():
+            add_ids(self._postings.setdefault(term, []), order_ids)
+
+    def remove(self, order):
+        order_id = order['id']
+        for term in order_terms(order):
+            posting = self._postings.get(term)
+            if posting is not None:
+                discard_id(posting, order_id)
+                if not posting:
+                    del self._postings[term]
+
+    def remove_many(self, orders):
+        for term, order_ids in _group_by_term(orders).items():
+            posting = self._postings.get(term)
+            if posting is not None:
+                discard_ids(posting, order_ids)
+                if not posting:
+                    del self._postings[term]
+
+    def count(self, terms):
+        """Cận trên số orders chứa tất cả terms (posting list ngắn nhất)"""
+        return min(len(self._postings.get(term, ())) for term in terms)
+
+    def ids(self, terms, extra=()):
+        """Ids chứa tất cả terms (và thuộc mọi posting list trong extra)"""
+        return intersect([*(self._postings.get(term, ()) for term in terms), *extra])
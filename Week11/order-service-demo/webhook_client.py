@@ -0,0 +1,31 @@
+"""
+Webhook Client
+HTTP client dùng chung cho mọi delivery workers: connection pool theo host và keep-alive
+"""
+
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class WebhookClient:
+    """
+    Giữ một requests.Session với pool connections cho mỗi host đích,
+    subscribers gửi thường xuyên sẽ dùng lại connection đã mở (không handshake TCP/TLS lại)
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=4, connect_timeout=3, read_timeout=10):
+        self.timeout = (connect_timeout, read_timeout)
+        self._session = requests.Session()
+        # Không lưu cookies giữa các subscribers
+        self._session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self._session.headers['Connection'] = 'keep-alive'
+
+        # pool_connections: số host được giữ pool, pool_maxsize: số connections mỗi host
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def post(self, url, body, headers):
+        return self._session.post(url, data=body, headers=headers, timeout=self.timeout)
@@ -0,0 +1,82 @@
+"""
+Webhook Dispatcher
+Gửi webhook qua bounded queue và một pool cố định các delivery workers
+"""
+
+import queue
+import threading
+
+
+class WebhookDispatcher:
+    """
+    Request thread chỉ enqueue delivery rồi trả về ngay; workers gọi `deliver`.
+    Khi queue đầy, submit trả về False và được đếm vào metric `rejected`
+    để latency ghi order không phụ thuộc vào tốc độ của subscribers.
+    """
+
+    def __init__(self, deliver, workers=4, max_queue_size=1000):
+        self._deliver = deliver
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._worker_count = workers
+        self._threads = []
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._stats = {
+            'enqueued': 0,
+            'delivered': 0,
+            'failed': 0,
+            'rejected': 0
+        }
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self._worker_count):
+                thread = threading.Thread(target=self._run, name=f'webhook-worker-{i}')
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self._stats[key] += delta
+
+    def submit(self, delivery):
+        """Đưa delivery vào queue, trả về False nếu queue đầy (overflow)"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(delivery)
+        except queue.Full:
+            self._count('rejected')
+            return False
+        self._count('enqueued')
+        return True
+
+    def _run(self):
+        while True:
+            delivery = self._queue.get()
+            with self._lock:
+                self._busy += 1
+            try:
+                ok = self._deliver(delivery)
+            except Exception as e:
+                print(f"Webhook worker error: {str(e)}")
+                ok = False
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                self._queue.task_done()
+            self._count('delivered' if ok else 'failed')
+
+    def stats(self):
+        """Metrics cho /health: kích thước queue, workers bận, số delivery bị từ chối"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['busyWorkers'] = self._busy
+        stats['workers'] = self._worker_count
+        stats['queueSize'] = self._queue.qsize()
+        stats['queueCapacity'] = self._queue.maxsize
+        return stats
@@ -0,0 +1,148 @@
+"""
+Webhook Guard
+Circuit breaker và token-bucket rate limit cho từng webhook subscriber
+"""
+
+import threading
+import time
+
+
+class CircuitBreaker:
+    """
+    closed -> open sau `failure_threshold` lỗi liên tiếp;
+    open -> half_open sau `cooldown` giây, cho một probe đi qua;
+    probe thành công -> closed, thất bại -> open lại
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+
+    def acquire(self, now):
+        """Trả về 0 nếu được gửi, ngược lại số giây cần chờ"""
+        if self.state == 'closed':
+            return 0
+        if self.state == 'open':
+            remaining = self.opened_at + self.cooldown - now
+            if remaining > 0:
+                return remaining
+            self.state = 'half_open'
+            self.probe_started_at = None
+        # half_open: chỉ một probe tại một thời điểm (probe quá cooldown coi như đã mất)
+        if self.probe_started_at is not None and now - self.probe_started_at < self.cooldown:
+            return min(1.0, self.cooldown)
+        self.probe_started_at = now
+        return 0
+
+    def record_success(self):
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+
+    def record_failure(self, now):
+        self.consecutive_failures += 1
+        if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+            self.state = 'open'
+            self.opened_at = now
+            self.probe_started_at = None
+
+    def to_dict(self, now):
+        return {
+            'state': self.state,
+            'consecutiveFailures': self.consecutive_failures,
+            'retryInSeconds': round(max(0.0, self.opened_at + self.cooldown - now), 3)
+            if self.state == 'open' else 0
+        }
+
+
+class TokenBucket:
+    """Token bucket: `rate` tokens mỗi giây, tối đa `burst` tokens"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.time()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, now):
+        """Lấy một token, trả về 0 nếu thành công hoặc số giây đến khi có token"""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def to_dict(self, now):
+        self._refill(now)
+        return {
+            'requestsPerSecond': self.rate,
+            'burst': self.burst,
+            'availableTokens': round(self.tokens, 3)
+        }
+
+
+class DeliveryGuard:
+    """Giữ circuit breaker + rate limiter theo webhook id, dùng chung cho relay và workers"""
+
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._breakers = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _breaker(self, webhook_id):
+        breaker = self._breakers.get(webhook_id)
+        if breaker is None:
+            breaker = self._breakers[webhook_id] = CircuitBreaker(self.failure_threshold, self.cooldown)
+        return breaker
+
+    def _bucket(self, webhook_id, rate_limit):
+        if not rate_limit:
+            self._buckets.pop(webhook_id, None)
+            return None
+        bucket = self._buckets.get(webhook_id)
+        if bucket is None or (bucket.rate, bucket.burst) != (rate_limit['requestsPerSecond'], rate_limit['burst']):
+            bucket = self._buckets[webhook_id] = TokenBucket(rate_limit['requestsPerSecond'], rate_limit['burst'])
+        return bucket
+
+    def acquire(self, webhook_id, rate_limit=None):
+        """Trả về 0 nếu delivery được gửi ngay, ngược lại số giây nên hoãn"""
+        now = time.time()
+        with self._lock:
+            wait = self._breaker(webhook_id).acquire(now)
+            if wait:
+                return wait
+            bucket = self._bucket(webhook_id, rate_limit)
+            return bucket.acquire(now) if bucket else 0
+
+    def record_success(self, webhook_id):
+        with self._lock:
+            self._breaker(webhook_id).record_success()
+
+    def record_failure(self, webhook_id):
+        with self._lock:
+            self._breaker(webhook_id).record_failure(time.time())
+
+    def forget(self, webhook_id):
+        with self._lock:
+            self._breakers.pop(webhook_id, None)
+            self._buckets.pop(webhook_id, None)
+
+    def state(self, webhook_id, rate_limit=None):
+        """Trạng thái circuit breaker và rate limit để hiển thị trên API"""
+        now = time.time()
+        with self._lock:
+            state = {'circuitBreaker': self._breaker(webhook_id).to_dict(now)}
+            bucket = self._bucket(webhook_id, rate_limit)
+            state['rateLimit'] = bucket.to_dict(now) if bucket else None
+        return state
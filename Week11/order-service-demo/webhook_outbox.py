@@ -0,0 +1,426 @@
+"""
+Webhook Outbox
+Lưu webhook deliveries vào SQLite trước khi gửi, retry với exponential backoff + jitter
+và chuyển sang dead-letter table khi hết số lần thử
+"""
+
+import json
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    webhook_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    body BLOB NOT NULL,
+    headers TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_at REAL,
+    last_error TEXT,
+    created_at TEXT NOT NULL,
+    order_id TEXT,
+    batch_max INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at);
+
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    outbox_id INTEGER NOT NULL,
+    webhook_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    body BLOB NOT NULL,
+    headers TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    created_at TEXT NOT NULL,
+    failed_at TEXT NOT NULL,
+    order_id TEXT,
+    batch_max INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_dead_letters_webhook ON dead_letters (webhook_id);
+"""
+
+# Cột được thêm sau khi outbox đã có dữ liệu: (bảng, tên cột, kiểu)
+MIGRATIONS = [
+    ('outbox', 'order_id', 'TEXT'),
+    ('outbox', 'batch_max', 'INTEGER'),
+    ('dead_letters', 'order_id', 'TEXT'),
+    ('dead_letters', 'batch_max', 'INTEGER'),
+]
+
+POST_MIGRATION_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_outbox_webhook ON outbox (webhook_id, status, order_id);
+"""
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class WebhookOutbox:
+    """
+    Durable outbox: deliveries được ghi vào SQLite ngay khi order thay đổi,
+    relay thread lấy các row đến hạn và đẩy sang dispatcher.
+    Với `storage` (SqliteStorage của orders, cùng file `path`), enqueue ghi qua connection của
+    storage nên tham gia transaction đang mở của mutation order trên cùng thread
+    """
+
+    # Thời gian relay chờ khi dispatcher queue đầy
+    BACKPRESSURE_DELAY = 0.2
+
+    def __init__(self, path, max_attempts=8, base_delay=2.0, max_delay=600.0,
+                 lease_seconds=120.0, poll_interval=1.0, storage=None):
+        self._storage = storage
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._relay = None
+
+    def _migrate(self):
+        columns = {table: {row['name'] for row in self._conn.execute(f'PRAGMA table_info({table})')}
+                   for table in ('outbox', 'dead_letters')}
+        for table, name, column_type in MIGRATIONS:
+            if name not in columns[table]:
+                self._conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+        self._conn.executescript(POST_MIGRATION_SCHEMA)
+
+    # ----- Ghi / ack deliveries -----
+
+    def enqueue(self, deliveries):
+        """
+        Ghi các deliveries của một event trong cùng một transaction.
+        Delivery có `batch` ({maxEvents, maxDelayMs, coalesce}) sẽ chờ trong outbox
+        tối đa maxDelayMs để relay gom thành một request cho subscriber đó
+        """
+        if not deliveries:
+            return
+        if self._storage is not None:
+            with self._storage.transaction() as conn:
+                self._insert(conn, deliveries)
+        else:
+            with self._lock:
+                with self._conn:
+                    self._conn.execute('BEGIN IMMEDIATE')
+                    self._insert(self._conn, deliveries)
+        self._wakeup.set()
+
+    def _insert(self, conn, deliveries):
+        now = time.time()
+        created_at = _now_iso()
+        for d in deliveries:
+            batch = d.get('batch')
+            if batch and batch.get('coalesce') and d.get('orderId'):
+                # Bỏ event cũ (chưa gửi) của cùng order, chỉ giữ trạng thái mới nhất
+                conn.execute(
+                    "DELETE FROM outbox WHERE webhook_id = ? AND order_id = ? AND event_type = ? "
+                    "AND status = 'pending' AND attempts = 0",
+                    (d['webhookId'], d['orderId'], d['eventType'])
+                )
+            conn.execute(
+                'INSERT INTO outbox (webhook_id, url, event_type, body, headers, next_attempt_at, '
+                'created_at, order_id, batch_max) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (d['webhookId'], d['url'], d['eventType'], d['body'], json.dumps(d['headers']),
+                 now + batch['maxDelayMs'] / 1000 if batch else now, created_at,
+                 d.get('orderId'), batch['maxEvents'] if batch else None)
+            )
+            if batch:
+                self._flush_full_batch(conn, d['webhookId'], batch['maxEvents'], now)
+
+    @staticmethod
+    def _flush_full_batch(conn, webhook_id, max_events, now):
+        """Đủ maxEvents thì cho batch đến hạn ngay, không chờ hết maxDelayMs"""
+        waiting = conn.execute(
+            "SELECT COUNT(*) FROM outbox WHERE webhook_id = ? AND status = 'pending' "
+            "AND attempts = 0 AND batch_max IS NOT NULL",
+            (webhook_id,)
+        ).fetchone()[0]
+        if waiting >= max_events:
+            conn.execute(
+                "UPDATE outbox SET next_attempt_at = ? WHERE webhook_id = ? AND status = 'pending' "
+                "AND attempts = 0 AND batch_max IS NOT NULL AND next_attempt_at > ?",
+                (now, webhook_id, now)
+            )
+
+    def claim_due(self, limit=100):
+        """
+        Đánh dấu inflight và trả về các deliveries đến hạn (kể cả inflight đã hết lease).
+        Rows của webhook bật batching được gom theo subscriber, kèm các rows đang chờ cùng window
+        """
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN IMMEDIATE')
+                rows = self._conn.execute(
+                    "SELECT * FROM outbox WHERE (status = 'pending' AND next_attempt_at <= ?) "
+                    "OR (status = 'inflight' AND claimed_at <= ?) ORDER BY next_attempt_at LIMIT ?",
+                    (now, now - self.lease_seconds, limit)
+                ).fetchall()
+
+                claimed = {row['id']: row for row in rows}
+                for webhook_id, batch_max in {(row['webhook_id'], row['batch_max'])
+                                              for row in rows if row['batch_max']}:
+                    # Window đã mở: gửi luôn các events đang chờ của cùng subscriber
+                    for row in self._conn.execute(
+                        "SELECT * FROM outbox WHERE webhook_id = ? AND status = 'pending' "
+                        "AND attempts = 0 AND batch_max IS NOT NULL ORDER BY id LIMIT ?",
+                        (webhook_id, batch_max)
+                    ):
+                        claimed.setdefault(row['id'], row)
+
+                self._conn.executemany(
+                    "UPDATE outbox SET status = 'inflight', claimed_at = ? WHERE id = ?",
+                    [(now, outbox_id) for outbox_id in claimed]
+                )
+        return self._group_deliveries(sorted(claimed.values(), key=lambda row: row['id']))
+
+    def _group_deliveries(self, rows):
+        deliveries = []
+        batches = {}
+        for row in rows:
+            if not row['batch_max']:
+                deliveries.append(self._to_delivery([row]))
+                continue
+            group = batches.setdefault(row['webhook_id'], [[]])
+            if len(group[-1]) >= row['batch_max']:
+                group.append([])
+            group[-1].append(row)
+        for groups in batches.values():
+            deliveries.extend(self._to_delivery(group, batch=True) for group in groups)
+        return deliveries
+
+    def release(self, outbox_ids):
+        """Trả deliveries chưa gửi được về pending (ví dụ khi dispatcher queue đầy)"""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET status = 'pending', claimed_at = NULL WHERE id = ?",
+                [(outbox_id,) for outbox_id in outbox_ids]
+            )
+
+    def defer(self, outbox_ids, delay):
+        """Hoãn deliveries mà không tính là một lần thử (circuit open / rate limited)"""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE outbox SET status = 'pending', claimed_at = NULL, next_attempt_at = ? WHERE id = ?",
+                [(time.time() + delay, outbox_id) for outbox_id in outbox_ids]
+            )
+
+    def ack(self, outbox_ids):
+        """Delivery thành công: xóa các rows khỏi outbox"""
+        with self._lock:
+            self._conn.executemany('DELETE FROM outbox WHERE id = ?', [(i,) for i in outbox_ids])
+
+    def discard(self, outbox_ids):
+        """Bỏ deliveries không còn gửi được (webhook đã bị xóa) mà không tính là một lần thử"""
+        self.ack(outbox_ids)
+
+    def purge_webhook(self, webhook_id):
+        """
+        Xóa mọi deliveries chưa gửi xong (pending, đang chờ batch, inflight) của webhook, trả về số rows.
+        Với `storage`, chạy trong transaction đang mở của cùng thread (vd. transaction xóa webhook)
+        """
+        if self._storage is not None:
+            with self._storage.transaction() as conn:
+                return conn.execute('DELETE FROM outbox WHERE webhook_id = ?', (webhook_id,)).rowcount
+        with self._lock:
+            return self._conn.execute('DELETE FROM outbox WHERE webhook_id = ?', (webhook_id,)).rowcount
+
+    def fail(self, outbox_ids, error):
+        """
+        Delivery thất bại: lên lịch retry (cùng một thời điểm cho cả batch)
+        hoặc chuyển sang dead letters, trả về số rows đã thành dead letters
+        """
+        dead = 0
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN IMMEDIATE')
+                rows = self._conn.execute(
+                    f"SELECT * FROM outbox WHERE id IN ({', '.join('?' for _ in outbox_ids)})",
+                    list(outbox_ids)
+                ).fetchall()
+                if not rows:
+                    return 0
+                retry_at = time.time() + self.backoff(max(row['attempts'] for row in rows) + 1)
+                for row in rows:
+                    attempts = row['attempts'] + 1
+                    if attempts >= self.max_attempts:
+                        self._conn.execute(
+                            'INSERT INTO dead_letters (outbox_id, webhook_id, url, event_type, body, headers, '
+                            'attempts, last_error, created_at, failed_at, order_id, batch_max) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            (row['id'], row['webhook_id'], row['url'], row['event_type'], row['body'],
+                             row['headers'], attempts, error, row['created_at'], _now_iso(),
+                             row['order_id'], row['batch_max'])
+                        )
+                        self._conn.execute('DELETE FROM outbox WHERE id = ?', (row['id'],))
+                        dead += 1
+                        continue
+                    self._conn.execute(
+                        "UPDATE outbox SET status = 'pending', attempts = ?, next_attempt_at = ?, "
+                        "claimed_at = NULL, last_error = ? WHERE id = ?",
+                        (attempts, retry_at, error, row['id'])
+                    )
+        # Đánh thức relay để tính lại thời điểm retry gần nhất
+        self._wakeup.set()
+        return dead
+
+    def backoff(self, attempts):
+        """Exponential backoff với jitter: nửa cố định + nửa ngẫu nhiên"""
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    # ----- Dead letters -----
+
+    def list_dead_letters(self, webhook_id=None, limit=50):
+        with self._lock:
+            if webhook_id:
+                rows = self._conn.execute(
+                    'SELECT * FROM dead_letters WHERE webhook_id = ? ORDER BY id DESC LIMIT ?',
+                    (webhook_id, limit)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    'SELECT * FROM dead_letters ORDER BY id DESC LIMIT ?', (limit,)
+                ).fetchall()
+        return [self._dead_letter_to_dict(row) for row in rows]
+
+    def replay_dead_letters(self, dead_letter_ids=None, webhook_id=None, webhook_exists=None):
+        """
+        Đưa dead letters trở lại outbox với attempts = 0, giữ order_id / batch_max để delivery được
+        gom batch (và coalesce) như lần gửi đầu. Letters có webhook_exists(webhook_id) False (webhook
+        đã bị xóa) không được replay và vẫn nằm trong dead letters.
+        Trả về (số đã replay, số bị bỏ qua vì webhook không còn)
+        """
+        conditions, params = [], []
+        if dead_letter_ids is not None:
+            conditions.append(f"id IN ({', '.join('?' for _ in dead_letter_ids)})")
+            params.extend(dead_letter_ids)
+        if webhook_id:
+            conditions.append('webhook_id = ?')
+            params.append(webhook_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        with self._lock:
+            with self._conn:
+                self._conn.execute('BEGIN IMMEDIATE')
+                rows = self._conn.execute(f'SELECT * FROM dead_letters {where}', params).fetchall()
+                orphaned = {row['id'] for row in rows
+                            if webhook_exists is not None and not webhook_exists(row['webhook_id'])}
+                rows = [row for row in rows if row['id'] not in orphaned]
+                self._conn.executemany(
+                    'INSERT INTO outbox (webhook_id, url, event_type, body, headers, next_attempt_at, created_at, '
+                    'order_id, batch_max) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(row['webhook_id'], row['url'], row['event_type'], row['body'], row['headers'],
+                      time.time(), row['created_at'], row['order_id'], row['batch_max']) for row in rows]
+                )
+                self._conn.executemany('DELETE FROM dead_letters WHERE id = ?', [(row['id'],) for row in rows])
+        if rows:
+            self._wakeup.set()
+        return len(rows), len(orphaned)
+
+    # ----- Relay -----
+
+    def ensure_relay(self, submit, gate=None):
+        """
+        Start relay thread (một lần): đẩy deliveries đến hạn sang `submit`.
+        `gate(delivery)` trả về số giây cần hoãn (0 = gửi ngay)
+        """
+        if self._relay is not None:
+            return
+        with self._lock:
+            if self._relay is not None:
+                return
+            self._relay = threading.Thread(target=self._run_relay, args=(submit, gate), name='webhook-outbox-relay')
+            self._relay.daemon = True
+            self._relay.start()
+
+    def _run_relay(self, submit, gate):
+        while True:
+            self._wakeup.clear()
+            backpressure = False
+            try:
+                deliveries = self.claim_due()
+                for i, delivery in enumerate(deliveries):
+                    wait = gate(delivery) if gate else 0
+                    if wait > 0:
+                        # Subscriber đang bị chặn: để lại trong outbox, không chiếm delivery worker
+                        self.defer(delivery['outboxIds'], wait)
+                        continue
+                    if not submit(delivery):
+                        # Dispatcher đầy: giữ lại trong outbox, thử lại ở vòng sau
+                        self.release([outbox_id for d in deliveries[i:] for outbox_id in d['outboxIds']])
+                        backpressure = True
+                        break
+            except Exception as e:
+                print(f"Webhook outbox relay error: {str(e)}")
+            if backpressure:
+                time.sleep(self.BACKPRESSURE_DELAY)
+            else:
+                self._wakeup.wait(self._next_wait())
+
+    def _next_wait(self):
+        """Ngủ đến retry gần nhất, tối đa poll_interval"""
+        with self._lock:
+            next_due = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'"
+            ).fetchone()[0]
+        if next_due is None:
+            return self.poll_interval
+        return max(0.0, min(self.poll_interval, next_due - time.time()))
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+            dead = self._conn.execute('SELECT COUNT(*) FROM dead_letters').fetchone()[0]
+        return {
+            'pending': counts.get('pending', 0),
+            'inflight': counts.get('inflight', 0),
+            'deadLetters': dead
+        }
+
+    # ----- Helpers -----
+
+    @staticmethod
+    def _to_delivery(rows, batch=False):
+        first = rows[0]
+        return {
+            'outboxIds': [row['id'] for row in rows],
+            'webhookId': first['webhook_id'],
+            'url': first['url'],
+            'eventType': 'batch' if batch else first['event_type'],
+            'bodies': [row['body'] for row in rows],
+            'headers': json.loads(first['headers']),
+            'batch': batch,
+            'attempts': max(row['attempts'] for row in rows)
+        }
+
+    @staticmethod
+    def _dead_letter_to_dict(row):
+        return {
+            'id': row['id'],
+            'webhookId': row['webhook_id'],
+            'url': row['url'],
+            'event': row['event_type'],
+            'payload': json.loads(row['body']),
+            'attempts': row['attempts'],
+            'lastError': row['last_error'],
+            'createdAt': row['created_at'],
+            'failedAt': row['failed_at']
+        }
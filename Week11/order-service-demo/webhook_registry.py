@@ -0,0 +1,100 @@
+"""
+Webhook Registry
+Lưu webhooks theo id và duy trì index event type -> các webhooks đang active
+"""
+
+import threading
+
+
+class WebhookRegistry:
+    """
+    Fan-out chỉ duyệt subscribers của event, không scan toàn bộ webhooks.
+    Webhook đã lưu không bị sửa tại chỗ (update tạo bản mới) nên delivery threads
+    luôn đọc được một version nhất quán (url, secret, batch, ...)
+    """
+
+    def __init__(self):
+        self._webhooks = {}
+        self._subscribers = {}
+        self._lock = threading.RLock()
+        self._journal = None
+
+    def __len__(self):
+        return len(self._webhooks)
+
+    def __contains__(self, webhook_id):
+        return webhook_id in self._webhooks
+
+    def get(self, webhook_id):
+        return self._webhooks.get(webhook_id)
+
+    def values(self):
+        with self._lock:
+            return list(self._webhooks.values())
+
+    def _index(self, webhook):
+        if not webhook.get('isActive', True):
+            return
+        for event_type in webhook.get('events', []):
+            self._subscribers.setdefault(event_type, {})[webhook['id']] = webhook
+
+    def _unindex(self, webhook):
+        for event_type in webhook.get('events', []):
+            subscribers = self._subscribers.get(event_type)
+            if subscribers is not None:
+                subscribers.pop(webhook['id'], None)
+                if not subscribers:
+                    del self._subscribers[event_type]
+
+    def attach_journal(self, journal):
+        """Ghi mọi mutation vào write-ahead log (gắn sau khi recover để replay không bị ghi lại)"""
+        self._journal = journal
+
+    def _log(self, op, data):
+        return self._journal.write(op, data) if self._journal is not None else None
+
+    def _sync(self, seq):
+        if seq is not None:
+            self._journal.wait(seq)
+
+    def locked(self):
+        """Lock chặn mọi writes (dùng khi chụp snapshot)"""
+        return self._lock
+
+    def snapshot(self):
+        """Các webhooks tại thời điểm gọi (webhooks bất biến nên không cần copy)"""
+        return self.values()
+
+    def add(self, webhook):
+        """Thêm webhook (thay thế toàn bộ nếu id đã tồn tại, vd. khi replay WAL)"""
+        with self._lock:
+            if webhook['id'] in self._webhooks:
+                self._unindex(self._webhooks[webhook['id']])
+            self._webhooks[webhook['id']] = webhook
+            self._index(webhook)
+            seq = self._log('webhook.put', webhook)
+        self._sync(seq)
+        return webhook
+
+    def update(self, webhook_id, changes):
+        """Cập nhật webhook và re-index (events / isActive có thể thay đổi)"""
+        with self._lock:
+            self._unindex(self._webhooks[webhook_id])
+            webhook = self._webhooks[webhook_id] = {**self._webhooks[webhook_id], **changes}
+            self._index(webhook)
+            seq = self._log('webhook.put', webhook)
+        self._sync(seq)
+        return webhook
+
+    def delete(self, webhook_id):
+        with self._lock:
+            webhook = self._webhooks.pop(webhook_id)
+            self._unindex(webhook)
+            seq = self._log('webhook.delete', {'id': webhook_id})
+        self._sync(seq)
+        return webhook
+
+    def subscribers(self, event_type):
+        """Các webhooks active đã subscribe event_type"""
+        with self._lock:
+            return list(self._subscribers.get(event_type, {}).values())
@@ -0,0 +1,233 @@
+"""
+Write-Ahead Log
+Append-only log (JSON lines) cho mutations của orders / webhooks với group commit fsync,
+kèm snapshot định kỳ để khởi động nhanh
+"""
+
+import glob
+import json
+import os
+import threading
+
+
+class WriteAheadLogError(Exception):
+    """Log không ghi / fsync được: mutation chưa durable và log không nhận thêm records"""
+
+
+class WriteAheadLog:
+    """
+    Store gọi write() khi đang giữ lock của nó (giữ đúng thứ tự mutations) rồi wait()
+    sau khi nhả lock. Flusher thread ghi + fsync cả nhóm records đang chờ trong một lần,
+    nên chi phí fsync được chia cho mọi writers đồng thời (group commit).
+    Lỗi ghi / fsync làm log dừng hẳn (records sau nó không được ghi để log không có lỗ hổng):
+    writers đang chờ và mọi write() / wait() sau đó nhận WriteAheadLogError
+    """
+
+    def __init__(self, directory, fsync=True, snapshot_every=100000):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.fsync = fsync
+        self.snapshot_every = snapshot_every
+        self._cond = threading.Condition()
+        self._file_lock = threading.Lock()
+        self._pending = []
+        self._seq = 0
+        self._durable_seq = 0
+        self._segment_start = 1
+        self._file = None
+        self._snapshot_seq = 0
+        self._stats = {'groupCommits': 0, 'records': 0}
+        self._flusher = None
+        self._error = None
+        self._snapshot_requested = threading.Event()
+
+    # ----- Files -----
+
+    def _segment_path(self, start_seq):
+        return os.path.join(self.directory, f'wal-{start_seq:020d}.log')
+
+    def _snapshot_path(self, seq):
+        return os.path.join(self.directory, f'snapshot-{seq:020d}.jsonl')
+
+    @staticmethod
+    def _seq_from_path(path):
+        return int(os.path.basename(path).split('-')[1].split('.')[0])
+
+    def _segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'wal-*.log')), key=self._seq_from_path)
+
+    def _snapshots(self):
+        return sorted(glob.glob(os.path.join(self.directory, 'snapshot-*.jsonl')), key=self._seq_from_path)
+
+    # ----- Recovery -----
+
+    def recover(self, load_snapshot, apply_record):
+        """
+        Đọc snapshot mới nhất (load_snapshot(kind, data) cho từng entity)
+        rồi replay các records có seq lớn hơn (apply_record(op, data))
+        """
+        snapshots = self._snapshots()
+        if snapshots:
+            with open(snapshots[-1], encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                for line in f:
+                    entry = json.loads(line)
+                    load_snapshot(entry['kind'], entry['data'])
+            self._snapshot_seq = header['seq']
+
+        last_seq = self._snapshot_seq
+        for path in self._segments():
+            with open(path, 'rb+') as f:
+                good_size = 0
+                for line in f:
+                    try:
+                        record = json.loads(line) if line.endswith(b'\n') else None
+                    except ValueError:
+                        record = None
+                    if record is None:
+                        # Record cuối bị ghi dở khi crash: cắt bỏ để records mới không nối sau nó
+                        f.truncate(good_size)
+                        break
+                    good_size += len(line)
+                    if record['seq'] <= last_seq:
+                        continue
+                    apply_record(record['op'], record['data'])
+                    last_seq = record['seq']
+
+        self._seq = self._durable_seq = last_seq
+        self._segment_start = last_seq + 1
+        return last_seq
+
+    # ----- Ghi log -----
+
+    def write(self, op, data):
+        """Đưa record vào nhóm commit kế tiếp (không chờ fsync), trả về seq để wait()"""
+        body = json.dumps({'op': op, 'data': data}, ensure_ascii=False)
+        with self._cond:
+            self._raise_if_failed()
+            self._seq += 1
+            self._pending.append(f'{{"seq":{self._seq},{body[1:]}\n')
+            self._ensure_flusher()
+            self._cond.notify_all()
+            return self._seq
+
+    def wait(self, seq):
+        """Chờ đến khi record `seq` đã được fsync; WriteAheadLogError nếu flusher đã gặp lỗi"""
+        with self._cond:
+            while self._durable_seq < seq:
+                self._raise_if_failed()
+                self._cond.wait()
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise WriteAheadLogError(f'write-ahead log failed: {self._error}') from self._error
+
+    def _ensure_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._run_flusher, name='wal-flusher')
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def _run_flusher(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                batch, self._pending = self._pending, []
+                target = self._seq
+
+            try:
+                with self._file_lock:
+                    if self._file is None:
+                        self._file = open(self._segment_path(self._segment_start), 'a', encoding='utf-8')
+                    self._file.write(''.join(batch))
+                    self._file.flush()
+                    if self.fsync:
+                        os.fsync(self._file.fileno())
+            except Exception as e:
+                # Không biết phần nào của nhóm đã xuống đĩa: dừng log, đánh thức writers để trả lỗi
+                print(f"WAL flush failed: {str(e)}")
+                with self._cond:
+                    self._error = e
+                    self._pending = []
+                    self._cond.notify_all()
+                return
+
+            with self._cond:
+                self._durable_seq = target
+                self._stats['groupCommits'] += 1
+                self._stats['records'] += len(batch)
+                self._cond.notify_all()
+
+            if self.snapshot_every and target - self._snapshot_seq >= self.snapshot_every:
+                self._snapshot_requested.set()
+
+    # ----- Snapshot -----
+
+    def start_snapshots(self, freeze, collect):
+        """
+        Start thread chụp snapshot khi log đủ `snapshot_every` records.
+        freeze(): context manager chặn mọi writes; collect(): trả về {kind: [entities]}
+        """
+        thread = threading.Thread(target=self._run_snapshots, args=(freeze, collect), name='wal-snapshot')
+        thread.daemon = True
+        thread.start()
+
+    def _run_snapshots(self, freeze, collect):
+        while True:
+            self._snapshot_requested.wait()
+            self._snapshot_requested.clear()
+            try:
+                self.snapshot(freeze, collect)
+            except Exception as e:
+                print(f"WAL snapshot failed: {str(e)}")
+
+    def snapshot(self, freeze, collect):
+        """Chụp snapshot nhất quán rồi xóa các log segments đã được snapshot bao phủ"""
+        with freeze():
+            state = collect()
+            seq = self._rotate()
+
+        path = self._snapshot_path(seq)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'seq': seq}) + '\n')
+            for kind, entities in state.items():
+                for entity in entities:
+                    f.write(json.dumps({'kind': kind, 'data': entity}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._snapshot_seq = seq
+
+        for old in self._snapshots():
+            if self._seq_from_path(old) < seq:
+                os.remove(old)
+        for segment in self._segments():
+            if self._seq_from_path(segment) <= seq:
+                os.remove(segment)
+        return seq
+
+    def _rotate(self):
+        """Đóng segment hiện tại (sau khi mọi records đã fsync), records sau sẽ vào segment mới"""
+        with self._cond:
+            seq = self._seq
+        self.wait(seq)
+        with self._file_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._segment_start = seq + 1
+        return seq
+
+    def stats(self):
+        with self._cond:
+            commits = self._stats['groupCommits']
+            return {
+                'lastSeq': self._seq,
+                'durableSeq': self._durable_seq,
+                'snapshotSeq': self._snapshot_seq,
+                'groupCommits': commits,
+                'avgRecordsPerCommit': round(self._stats['records'] / commits, 2) if commits else 0,
+                'error': str(self._error) if self._error is not None else None
+            }